@@ -1,156 +1,268 @@
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.ensemble import RandomForestRegressor
-from collections import defaultdict
 import joblib
 import os
 import logging
-import json
 
-
-le = LabelEncoder()
-scaler = StandardScaler()
-model = RandomForestRegressor()
+from compiled_transforms import check_labels, encode, record_matrix, scale
+from forest_store import flat_path, load_model, model_variant
+from metrics import record_model_call, timed
+from model_registry import registry
+from month_calendar import MonthlyTotals
+from risk_engine import risk_table
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Load the LabelEncoder and scaler from files
+# Paths to the model, scaler and LabelEncoder files
 base_dir = os.path.dirname(os.path.abspath(__file__))
 scaler_path = os.path.join(base_dir,  'scaler.pkl')
 label_encoder_path = os.path.join(base_dir, 'label_encoder.pkl')
 model_path = os.path.join(base_dir, 'random_forest_model.pkl')
+# Compact variant from compact_models.py selected by ML_MODEL_VARIANTS, or None
+variant = model_variant('electricity')
+
+def load_artifacts():
+    """
+    Load the electricity model, scaler and LabelEncoder from disk. Called by
+    the model registry the first time the electricity model is used.
+    """
+    return {
+        'model': load_model(model_path, variant),
+        'scaler': joblib.load(scaler_path),
+        'label_encoder': joblib.load(label_encoder_path)
+    }
+
+def warmup(artifacts):
+    """
+    Dummy row for every state, run on a new version before it is swapped in.
+    """
+    state_names = artifacts['label_encoder'].classes_.tolist()
+    predict_outputs([{'energyPerTime': 100.0, 'responsibleArea': 10.0, 'totalArea': 100.0}] * len(state_names), state_names)
 
-scaler = joblib.load(scaler_path)
-label_encoder = joblib.load(label_encoder_path)
-model = joblib.load(model_path)
+registry.register('electricity', load_artifacts,
+                  paths=[model_path, flat_path(model_path, variant), scaler_path, label_encoder_path], warmup=warmup)
 
 
+# Feature columns in training order
+FEATURE_COLUMNS = ['stateName', 'energyPerTime', 'responsibleArea', 'totalArea']
+
 # Function to preprocess the input data
-def preprocess_data(input_data):
+def preprocess_data(input_data, state_names=None):
     """
     Preprocess input data for predictions with 'stateName' as the first feature.
+
+    Args:
+        input_data (list of dict or DataFrame): The daily rows; never modified.
+        state_names (str or list, optional): The state of every row, or one state per
+            row. Without it each row's own 'stateName' is used.
+    Returns:
+        np.ndarray: The scaled feature matrix.
     """
-    # Convert JSON data to DataFrame
-    input_df = pd.DataFrame(input_data)
-    
-    # Ensure required columns exist
-    required_columns = ['stateName', 'energyPerTime', 'responsibleArea', 'totalArea']
-    missing_columns = [col for col in required_columns if col not in input_df.columns]
-    if missing_columns:
-        raise ValueError(f"Missing columns in input data: {missing_columns}")
-    
-    # Reorder columns to match training order
-    input_df = input_df[required_columns]
-
-    # Encode 'stateName' using the LabelEncoder
-    input_df['stateName'] = label_encoder.transform(input_df['stateName'])
-
-    # Scale the features using the previously fitted scaler
-    input_scaled = scaler.transform(input_df)
-    
+    artifacts = registry.get('electricity')
+
+    with timed('electricity', 'encode'):
+        # With the compiled scaler, well-formed records go straight into a
+        # float matrix; everything else goes through a DataFrame
+        values = None
+        if 'compiled_scaler' in artifacts and not isinstance(input_data, pd.DataFrame):
+            values = record_matrix(input_data, FEATURE_COLUMNS[1:])
+            if values is not None and state_names is None:
+                if all('stateName' in record for record in input_data):
+                    state_names = [record['stateName'] for record in input_data]
+                else:
+                    values = None
+
+        if values is None:
+            # Convert JSON data to DataFrame
+            input_df = input_data if isinstance(input_data, pd.DataFrame) else pd.DataFrame(input_data)
+
+            # Ensure required columns exist
+            required_columns = FEATURE_COLUMNS if state_names is None else FEATURE_COLUMNS[1:]
+            missing_columns = [col for col in required_columns if col not in input_df.columns]
+            if missing_columns:
+                raise ValueError(f"Missing columns in input data: {missing_columns}")
+
+            if state_names is None:
+                state_names = input_df['stateName']
+            values = input_df[FEATURE_COLUMNS[1:]].to_numpy(dtype=np.float64)
+
+        # Encode each distinct state once and spread the codes over the rows
+        if isinstance(state_names, str):
+            state_codes = np.full(len(values), encode(artifacts, [state_names])[0])
+        else:
+            positions, unique_states = pd.factorize(np.asarray(state_names, dtype=object), use_na_sentinel=False)
+            state_codes = encode(artifacts, list(unique_states))[positions]
+
+        features = np.column_stack((state_codes, values))
+
+    # Scale the features, in training order, using the previously fitted scaler
+    with timed('electricity', 'scale'):
+        input_scaled = scale(artifacts, features, FEATURE_COLUMNS)
+
     return input_scaled
 
+# The model's feature matrix is what preprocess_data returns
+model_inputs = preprocess_data
+
+def predict_outputs(input_data, state_names=None):
+    """
+    Predict the CO2 of every row of input_data (records or a DataFrame with
+    the preprocess_data columns) in one call. state_names is passed on to
+    preprocess_data.
+    Returns:
+        np.ndarray: (rows,) predicted CO2.
+    """
+    input_scaled = preprocess_data(input_data, state_names)
+    record_model_call('electricity', len(input_scaled))
+    with timed('electricity', 'predict'):
+        return registry.get('electricity')['model'].predict(input_scaled)
+
 # Function to predict emissions and evaluate risk
-def predict_emissions_and_risk(days_data, state_name):
+def predict_emissions_and_risk(days_data, state_name, first_entry=1):
     """
     Predict CO2 emissions and evaluate risk for the provided data.
 
     Args:
         days_data (list of dict): List of dictionaries with daily data.
         state_name (str): The state name.
+        first_entry (int): Entry number of the first day, for scoring a long input in chunks.
 
     Returns:
         list of dict: Predictions with risk levels.
     """
-    # Add the state name to each day's data
-    for day in days_data:
-        day['stateName'] = state_name
-    
-    # Preprocess the input data
-    input_scaled = preprocess_data(days_data)
-
-    # Predict CO2 emissions
-    predictions = model.predict(input_scaled)
+    # Preprocess the input data for the one state and predict CO2 emissions
+    predictions = predict_outputs(days_data, state_name)
 
-    # Create a response with risk levels
+    # Create a response with risk levels, banding all predictions at once
+    with timed('electricity', 'risk'):
+        risk_levels = RISK_TABLE.label(RISK_TABLE.classify(predictions))
     response = []
-    for i, predicted_co2 in enumerate(predictions):
-        risk_level, predicted_value = assess_risk(predicted_co2)
-        response.append({
-            "Entry No ": i + 1,
-            "predicted_co2": predicted_value,
-            "risk_level": risk_level
-        })
+    with timed('electricity', 'format'):
+        for i, (predicted_co2, risk_level) in enumerate(zip(predictions, risk_levels)):
+            response.append({
+                "Entry No ": i + first_entry,
+                "predicted_co2": predicted_co2,
+                "risk_level": risk_level
+            })
 
     return response
 
+def predict_emissions_and_risk_by_state(states_data):
+    """
+    Predict CO2 emissions and evaluate risk for several states at once,
+    encoding each distinct state once and scoring all rows in one matrix.
+
+    Args:
+        states_data (dict or list): {state name: list of daily dicts}, or a list of
+            daily dicts that each carry their own 'stateName'. Never modified.
+
+    Returns:
+        dict: State name -> that state's predictions, shaped and numbered like
+            predict_emissions_and_risk's.
+    """
+    if isinstance(states_data, dict):
+        results = {state_name: [] for state_name in states_data}
+        rows = [day for days_data in states_data.values() for day in days_data]
+        state_names = [state_name for state_name, days_data in states_data.items() for _ in days_data]
+    else:
+        rows = list(states_data)
+        untagged = [i + 1 for i, day in enumerate(rows) if 'stateName' not in day]
+        if untagged:
+            raise ValueError(f"Rows without a stateName: {untagged[:10]}")
+        state_names = [day['stateName'] for day in rows]
+        check_labels(state_names)
+        results = {state_name: [] for state_name in state_names}
+
+    if not rows:
+        return results
+
+    predictions = predict_outputs(rows, state_names)
+    with timed('electricity', 'risk'):
+        risk_levels = RISK_TABLE.label(RISK_TABLE.classify(predictions))
+
+    # Number every state's entries on their own, in input order
+    with timed('electricity', 'format'):
+        for state_name, predicted_co2, risk_level in zip(state_names, predictions, risk_levels):
+            state_results = results[state_name]
+            state_results.append({
+                "Entry No ": len(state_results) + 1,
+                "predicted_co2": predicted_co2,
+                "risk_level": risk_level
+            })
+
+    return results
+
+# Risk levels and the default thresholds between them; a CO2 value below a
+# threshold stays under it. Overridable through ML_RISK_THRESHOLDS.
+RISK_LEVELS = ["Low Risk", "Moderate Risk", "High Risk", "Severe Risk"]
+RISK_TABLE = risk_table('electricity', ['predicted_co2'], {'predicted_co2': [300, 700, 1200]}, RISK_LEVELS)
+
 # Function to assess risk based on CO2 levels
 def assess_risk(predicted_co2):
     """
     Assess risk level based on CO2 levels.
     """
-    if predicted_co2 < 300:
-        return "Low Risk", predicted_co2
-    elif predicted_co2 < 700:
-        return "Moderate Risk", predicted_co2
-    elif predicted_co2 < 1200:
-        return "High Risk", predicted_co2
-    else:
-        return "Severe Risk", predicted_co2
-
-def calculate_monthly_summary_and_format(daily_predictions):
-    
-
-        monthly_emissions = defaultdict(lambda: defaultdict(list))
-        monthly_risk_summary = defaultdict(lambda: defaultdict(int))
-        formatted_output = []
-
-        months = {
-            "January": range(1, 32),
-            "February": range(32, 60),
-            "March": range(60, 91),
-            "April": range(91, 121),
-            "May": range(121, 152),
-            "June": range(152, 182),
-            "July": range(182, 213),
-            "August": range(213, 244),
-            "September": range(244, 274),
-            "October": range(274, 305),
-            "November": range(305, 335),
-            "December": range(335, 366)
+    return RISK_LEVELS[RISK_TABLE.classify_one(predicted_co2)], predicted_co2
+
+def daily_results(daily_predictions):
+    """
+    (entry number, [prediction]) tuples from predict_emissions_and_risk.
+    """
+    return [(prediction['Entry No '], [prediction]) for prediction in daily_predictions]
+
+def monthly_totals(start_year=None):
+    """
+    Empty running totals for add_monthly_totals and format_monthly_summary.
+    """
+    return MonthlyTotals(1, len(RISK_LEVELS), start_year)
+
+@timed('electricity', 'monthly_totals')
+def add_monthly_totals(totals, daily_predictions):
+    """
+    Add the output of predict_emissions_and_risk to running monthly totals,
+    treating each entry number as a day number.
+    """
+    risk_codes = {risk_level: code for code, risk_level in enumerate(RISK_LEVELS)}
+    totals.add(
+        [prediction['Entry No '] for prediction in daily_predictions],
+        [prediction['predicted_co2'] for prediction in daily_predictions],
+        [risk_codes[prediction['risk_level']] for prediction in daily_predictions]
+    )
+
+@timed('electricity', 'monthly_summary')
+def format_monthly_summary(totals):
+    """
+    One summary per month from running monthly totals.
+    """
+    averages = totals.means()[:, 0]
+
+    formatted_output = []
+    for month, label in enumerate(totals.labels()):
+        month_summary = {
+            **label,
+            "Average Emissions": float(averages[month]) if totals.counts[month] else 0,
+            "Risk Levels": {}
         }
 
-        for prediction in daily_predictions:
-            entry_number = prediction['Entry No ']
-            month = None
-            for m, entry_range in months.items():
-                if entry_number in entry_range:
-                    month = m
-                    break
-
-            if month:
-                monthly_emissions[month]['emissions'].append(prediction['predicted_co2'])
-                monthly_risk_summary[month][prediction['risk_level']] += 1
-
-        for month in months:
-            if monthly_emissions[month]['emissions']:
-                avg_emissions = sum(monthly_emissions[month]['emissions']) / len(monthly_emissions[month]['emissions'])
-            else:
-                avg_emissions = 0
-
-            month_summary = {
-                "Month": month,
-                "Average Emissions": avg_emissions,
-                "Risk Levels": {}
-            }
-
-            risk_counts = monthly_risk_summary[month]
-            total_risks = sum(risk_counts.values())
-            for risk_level, count in risk_counts.items():
+        risk_counts = totals.histograms[month, 0].tolist()
+        total_risks = sum(risk_counts)
+        for risk_level, count in zip(RISK_LEVELS, risk_counts):
+            if count:
                 month_summary["Risk Levels"][risk_level] = f"{(count / total_risks) * 100:.2f}%"
 
-            formatted_output.append(month_summary)
+        formatted_output.append(month_summary)
+
+    return formatted_output
 
-        return formatted_output
+def calculate_monthly_summary_and_format(daily_predictions, start_year=None):
+    """
+    Average the predicted CO2 and summarize the risk levels per calendar
+    month, treating each entry number as a day number.
+
+    start_year is the calendar year of entry 1, so leap years get a February
+    29th. Inputs spanning several years get a "Year" field per month.
+    """
+    totals = monthly_totals(start_year)
+    add_monthly_totals(totals, daily_predictions)
+    return format_monthly_summary(totals)
@@ -1,33 +1,50 @@
 # Import necessary libraries
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
 import joblib
 import os
-from collections import defaultdict
-import json
-from flask import Flask, request, jsonify
 
-app = Flask(__name__)
+from compiled_transforms import CompiledEncoder, check_labels, scale
+from forest_store import flat_path, load_model, model_variant
+from lookup_table import load_lookup_table
+from metrics import record_model_call, timed
+from model_registry import registry
+from month_calendar import MonthlyTotals
+from risk_engine import risk_table
 
-# Initialize the LabelEncoder instance
-le = LabelEncoder()
-scaler = StandardScaler()
-model = RandomForestRegressor()
 # Set the base directory and paths to the model, label encoder, and scaler
 base_dir = os.path.dirname(os.path.abspath(__file__))
 scaler_path = os.path.join(base_dir, 'scaler.pkl')
 label_encoder_path = os.path.join(base_dir, 'label_encoder.pkl')
 model_path = os.path.join(base_dir, 'random_forest_model.pkl')
+lookup_path = os.path.join(base_dir, 'explosive_lookup.npz')
+# Compact variant from compact_models.py selected by ML_MODEL_VARIANTS, or None
+variant = model_variant('explosive')
 
-# Load the LabelEncoder from the file
-le = joblib.load(label_encoder_path)
-scaler = joblib.load(scaler_path)
-model = joblib.load(model_path)
-# Now, 'le' is correctly loaded as an instance of LabelEncoder
+def load_artifacts():
+    """
+    Load the explosive model, scaler and LabelEncoder from disk. Called by
+    the model registry the first time the explosive model is used. When a
+    lookup table compiled by lookup_table.py exists it replaces the forest,
+    unless a compact variant is selected (the table tabulates the full model).
+    """
+    model = load_model(model_path, variant)
+    return {
+        'model': model if variant else load_lookup_table(lookup_path, model_path, fallback=model),
+        'scaler': joblib.load(scaler_path),
+        'label_encoder': joblib.load(label_encoder_path)
+    }
+
+def warmup(artifacts):
+    """
+    Dummy prediction for every known explosive type, run by the registry
+    on a new version before it is swapped in.
+    """
+    explosive_types = artifacts['label_encoder'].classes_.tolist()
+    predict_outputs(explosive_types, [100.0] * len(explosive_types))
+
+registry.register('explosive', load_artifacts,
+                  paths=[model_path, flat_path(model_path, variant), scaler_path, label_encoder_path, lookup_path], warmup=warmup)
 
 # Function to handle unseen explosive types
 def safe_transform(encoder, value):
@@ -44,47 +61,160 @@ def safe_transform(encoder, value):
         print(f"Warning: '{value}' is an unseen category! Returning placeholder value.")
         return -1  # Assign a placeholder value for unseen types
 
-# Risk evaluation thresholds
-def risk_evaluation(row):
-    thresholds = {
-        'CO': [400, 700, 1000],
-        'NOx': [20, 40, 60],
-        'NH3': [50, 80, 120],
-        'HCN': [20, 50, 80],
-        'H2S': [20, 50, 80],
-        'SO2': [1, 5, 10],
-        'CO2': [1000, 5000, 10000]
-    }
+# Vectorized version of safe_transform for a whole column of explosive types
+def safe_transform_many(encoder, values):
+    """
+    Encode a list of explosive types in one pass, mapping non-string and
+    unseen types to -1 exactly like safe_transform does. encoder is the
+    LabelEncoder or its CompiledEncoder.
+    """
+    codes = np.full(len(values), -1, dtype=np.int64)
+    string_positions = [i for i, value in enumerate(values) if isinstance(value, str)]
+
+    non_strings = [value for value in values if not isinstance(value, str)]
+    # Lists and dicts are a malformed request rather than an unknown type
+    check_labels(non_strings)
+    for value in set(non_strings):
+        print(f"Warning: '{value}' is not a string, returning placeholder value!")
 
+    if string_positions and isinstance(encoder, CompiledEncoder):
+        # One dict lookup per value
+        string_codes = [encoder.codes.get(values[i], -1) for i in string_positions]
+        codes[string_positions] = string_codes
+
+        for value in {values[i] for i, code in zip(string_positions, string_codes) if code < 0}:
+            print(f"Warning: '{value}' is an unseen category! Returning placeholder value.")
+
+    elif string_positions:
+        classes = np.asarray(encoder.classes_, dtype=str)
+        strings = np.array([values[i] for i in string_positions], dtype=str)
+
+        # Binary search every value into the sorted classes and keep only exact matches
+        positions = np.searchsorted(classes, strings)
+        positions[positions == len(classes)] = 0
+        found = classes[positions] == strings
+        codes[np.asarray(string_positions)[found]] = positions[found]
+
+        for value in set(strings[~found].tolist()):
+            print(f"Warning: '{value}' is an unseen category! Returning placeholder value.")
+
+    return codes
+
+# Risk evaluation thresholds, in the same order as the model's output columns
+GASES = ['CO', 'NOx', 'NH3', 'HCN', 'H2S', 'SO2', 'CO2']
+RISK_THRESHOLDS = {
+    'CO': [400, 700, 1000],
+    'NOx': [20, 40, 60],
+    'NH3': [50, 80, 120],
+    'HCN': [20, 50, 80],
+    'H2S': [20, 50, 80],
+    'SO2': [1, 5, 10],
+    'CO2': [1000, 5000, 10000]
+}
+RISK_LABELS = ["Low", "Moderate", "High", "Severe"]
+# Only exceeding a threshold moves a gas up a level, hence right=True
+RISK_TABLE = risk_table('explosive', GASES, RISK_THRESHOLDS, RISK_LABELS, right=True)
+
+def risk_evaluation(row):
     risks = {}
-    for gas, levels in thresholds.items():
+    for gas in GASES:
         value = row.get(gas, 0)  # Safely get the value for the gas, default to 0 if not present
-        if value > levels[2]:
-            risks[gas] = "Severe"
-        elif value > levels[1]:
-            risks[gas] = "High"
-        elif value > levels[0]:
-            risks[gas] = "Moderate"
-        else:
-            risks[gas] = "Low"
+        risks[gas] = RISK_LABELS[RISK_TABLE.classify_one(value, gas)]
     return risks
 
+def risk_evaluation_many(predictions):
+    """
+    Bin a (rows, gases) prediction matrix into risk levels for all gases at
+    once. Returns an integer matrix indexing into RISK_LABELS.
+    """
+    return RISK_TABLE.classify(predictions)
+
+# The scaler's features, in training order
+FEATURE_COLUMNS = ['explosiveType', 'amount']
+
+def model_inputs(explosive_types, amounts):
+    """
+    Encode and scale parallel sequences of explosive types and amounts into
+    the feature matrix the model predicts on. Unseen explosive types are
+    encoded as -1.
+    """
+    artifacts = registry.get('explosive')
+    with timed('explosive', 'encode'):
+        encoder = artifacts.get('compiled_encoder') or artifacts['label_encoder']
+        input_features = np.column_stack((safe_transform_many(encoder, list(explosive_types)), np.asarray(amounts)))
+    with timed('explosive', 'scale'):
+        return scale(artifacts, input_features, FEATURE_COLUMNS)
+
+def predict_outputs(explosive_types, amounts):
+    """
+    Predict the gas emissions of parallel sequences of explosive types and
+    amounts with one model call.
+    Returns:
+        np.ndarray: (rows, GASES) emissions.
+    """
+    input_scaled = model_inputs(explosive_types, amounts)
+    record_model_call('explosive', len(input_scaled))
+    with timed('explosive', 'predict'):
+        return registry.get('explosive')['model'].predict(input_scaled)
+
 # Function to predict emissions and evaluate risks for multiple explosives per day
-def predict_7_days_multiple_explosives(input_data):
+def predict_7_days_multiple_explosives(input_data, batched=True, first_day=1):
     """
     Predict emissions and evaluate risks for each day over 7 days, where each day can contain one or more explosive types.
 
     Parameters:
     input_data (list of lists): List containing explosive types and amounts for each day.
                                 E.g., [['TNT', 3000], ['Dynamite', 2000], ...]
+    batched (bool): Score all days in one columnar pass with a single model call.
+                    Set to False to fall back to one model call per explosive.
+    first_day (int): Day number of the first day, for scoring a long input in chunks.
 
     Returns:
     dict: Dictionary with predictions for each day.
     """
+    if not batched:
+        return predict_7_days_multiple_explosives_per_row(input_data, first_day)
+
+    # Flatten every day's explosives into columns, remembering which day each came from
+    day_numbers = []
+    explosive_types = []
+    amounts = []
+    for day, explosives in enumerate(input_data, start=first_day):
+        for explosive_type, amount in explosives:
+            day_numbers.append(day)
+            explosive_types.append(explosive_type)
+            amounts.append(amount)
+
+    all_predictions = {f"Day {day}": [] for day in range(first_day, first_day + len(input_data))}
+    if not explosive_types:
+        return all_predictions
+
+    predicted_emissions = predict_outputs(explosive_types, amounts)
+    with timed('explosive', 'risk'):
+        risk_levels = RISK_TABLE.label(risk_evaluation_many(predicted_emissions))
+
+    # Build the records in the same column order the per-row version produced
+    with timed('explosive', 'format'):
+        for day, explosive_type, emissions, risks in zip(day_numbers, explosive_types, predicted_emissions.tolist(), risk_levels):
+            record = {
+                'Explosive Type': explosive_type,
+                'Risk Evaluation': dict(zip(GASES, risks))
+            }
+            record.update(zip(GASES, emissions))
+            all_predictions[f"Day {day}"].append([record])
+
+    return all_predictions
+
+def predict_7_days_multiple_explosives_per_row(input_data, first_day=1):
+    """
+    Reference implementation of predict_7_days_multiple_explosives that
+    builds DataFrames and runs one model call per explosive.
+    """
+    artifacts = registry.get('explosive')
     all_predictions = {}
 
     # Loop through each day in the input data (days can have multiple explosives)
-    for day, explosives in enumerate(input_data, start=1):
+    for day, explosives in enumerate(input_data, start=first_day):
         daily_predictions = []
 
         for explosive_type, amount in explosives:
@@ -92,16 +222,16 @@ def predict_7_days_multiple_explosives(input_data):
             input_df = pd.DataFrame([[explosive_type, amount]], columns=['explosiveType', 'amount'])
 
             # Encode explosive type
-            input_df['explosiveType'] = input_df['explosiveType'].apply(lambda x: safe_transform(le, x))
+            input_df['explosiveType'] = input_df['explosiveType'].apply(lambda x: safe_transform(artifacts['label_encoder'], x))
 
             # Scale the input data
-            input_df_scaled = scaler.transform(input_df)
+            input_df_scaled = artifacts['scaler'].transform(input_df)
 
             # Predict emissions for this explosive type
-            predicted_emissions = model.predict(input_df_scaled)
+            predicted_emissions = artifacts['model'].predict(input_df_scaled)
 
             # Create a DataFrame for the predictions
-            predicted_df = pd.DataFrame(predicted_emissions, columns=['CO', 'NOx', 'NH3', 'HCN', 'H2S', 'SO2', 'CO2'])
+            predicted_df = pd.DataFrame(predicted_emissions, columns=GASES)
 
             # Add the explosive type as a new column
             predicted_df['Explosive Type'] = explosive_type
@@ -109,7 +239,7 @@ def predict_7_days_multiple_explosives(input_data):
             # Add risk evaluations
             predicted_df['Risk Evaluation'] = predicted_df.apply(risk_evaluation, axis=1)
 
-            ordered_columns = ['Explosive Type', 'Risk Evaluation', 'CO', 'NOx', 'NH3', 'HCN', 'H2S', 'SO2', 'CO2']
+            ordered_columns = ['Explosive Type', 'Risk Evaluation'] + GASES
             ordered_df = predicted_df[ordered_columns]
 
             # Convert the DataFrame to a dictionary with the correct column order
@@ -120,72 +250,85 @@ def predict_7_days_multiple_explosives(input_data):
 
     return all_predictions
 
-def calculate_monthly_summary_and_format(all_predictions):
-    # Initialize structures for monthly aggregation
-    monthly_emissions = defaultdict(lambda: defaultdict(list))
-    monthly_risk_summary = defaultdict(lambda: defaultdict(int))
-    explosive_types = defaultdict(set)
-    formatted_output = []
+def daily_results(all_predictions):
+    """
+    Flatten the output of predict_7_days_multiple_explosives per day.
+    Returns:
+        list: (day number, list of explosive records) tuples, in day order.
+    """
+    return [
+        (int(day.split()[1]), [explosive for explosive_group in day_data for explosive in explosive_group])
+        for day, day_data in all_predictions.items()
+    ]
 
-    # Define the months and their corresponding day ranges
-    months = {
-        "January": range(1, 31),
-        "February": range(31, 60),
-        "March": range(61, 91),
-        "April": range(91, 121),
-        "May": range(121, 151),
-        "June": range(151, 181),
-        "July": range(181, 212),
-        "August": range(212, 243),
-        "September": range(243, 273),
-        "October": range(273, 304),
-        "November": range(304, 334),
-        "December": range(334, 365)
-    }
+def monthly_totals(start_year=None):
+    """
+    Empty running totals for add_monthly_totals and format_monthly_summary.
+    """
+    return MonthlyTotals(len(GASES), len(RISK_LABELS), start_year)
+
+@timed('explosive', 'monthly_totals')
+def add_monthly_totals(totals, all_predictions):
+    """
+    Add the output of predict_7_days_multiple_explosives to running monthly totals.
+    """
+    day_numbers = []
+    records = []
+    for day_number, explosives in daily_results(all_predictions):
+        day_numbers.extend([day_number] * len(explosives))
+        records.extend(explosives)
+
+    risk_codes = {risk_level: code for code, risk_level in enumerate(RISK_LABELS)}
+    totals.add(
+        day_numbers,
+        [[explosive[gas] for gas in GASES] for explosive in records],
+        [[risk_codes[explosive["Risk Evaluation"][gas]] for gas in GASES] for explosive in records],
+        [explosive["Explosive Type"] for explosive in records]
+    )
+
+@timed('explosive', 'monthly_summary')
+def format_monthly_summary(totals):
+    """
+    One summary per month from running monthly totals.
+    """
+    averages = totals.means()
 
-    # Process each day's data
-    for day, day_data in all_predictions.items():
-        day_number = int(day.split()[1])
-        month = None
-        for m, day_range in months.items():
-            if day_number in day_range:
-                month = m
-                break
-
-        if month:
-            for explosive_group in day_data:
-                for explosive in explosive_group:
-                    # Aggregate monthly emissions
-                    for gas in ["CO", "NOx", "NH3", "HCN", "H2S", "SO2", "CO2"]:
-                        monthly_emissions[month][gas].append(explosive[gas])
-
-                    # Count risk levels for monthly risk summary
-                    for gas, risk_level in explosive["Risk Evaluation"].items():
-                        monthly_risk_summary[month][f"{gas} - {risk_level}"] += 1
-
-                    # Collect explosive types
-                    explosive_types[month].add(explosive["Explosive Type"])
-
-    # Calculate monthly averages for emissions
-    for month in months:
+    # Each gas reports the level that showed up last for the first time in the
+    # month, as a share of all the month's gas readings
+    reported_levels = np.argmax(np.where(totals.histograms > 0, totals.first_rows, -1), axis=2)
+
+    formatted_output = []
+    for month, label in enumerate(totals.labels()):
         month_summary = {
-            "Month": month,
-            "Explosive Type": list(explosive_types[month]),
-            "Emissions": {gas: 0 for gas in ["CO", "NOx", "NH3", "HCN", "H2S", "SO2", "CO2"]},
+            **label,
+            "Explosive Type": totals.month_names(month),
+            "Emissions": dict(zip(GASES, averages[month].tolist() if totals.counts[month] else [0] * len(GASES))),
             "Risk Evaluation": {}
         }
 
-        # Calculate average emissions for the month
-        for gas, values in monthly_emissions[month].items():
-            month_summary["Emissions"][gas] = sum(values) / len(values) if values else 0
-
-        # Summarize risk levels for the month
-        risk_counts = monthly_risk_summary[month]
-        total_risks = sum(risk_counts.values())
-        for risk, count in risk_counts.items():
-            gas, risk_level = risk.split(" - ")
-            month_summary["Risk Evaluation"][gas] = f"{risk_level} - {(count / total_risks) * 100:.2f}%"
+        total_risks = int(totals.histograms[month].sum())
+        if total_risks:
+            for i, gas in enumerate(GASES):
+                level = reported_levels[month, i]
+                count = int(totals.histograms[month, i, level])
+                month_summary["Risk Evaluation"][gas] = f"{RISK_LABELS[level]} - {(count / total_risks) * 100:.2f}%"
 
         formatted_output.append(month_summary)
 
-    return formatted_output
\ No newline at end of file
+    return formatted_output
+
+def calculate_monthly_summary_and_format(all_predictions, start_year=None):
+    """
+    Average the gas emissions and summarize the risk evaluations of the
+    daily predictions per calendar month.
+
+    Args:
+        all_predictions (dict): Output of predict_7_days_multiple_explosives.
+        start_year (int, optional): Calendar year of day 1, so leap years get a February 29th.
+
+    Returns:
+        list: One summary per month. Inputs spanning several years get a "Year" field.
+    """
+    totals = monthly_totals(start_year)
+    add_monthly_totals(totals, all_predictions)
+    return format_monthly_summary(totals)
@@ -1,176 +1,283 @@
 import pandas as pd
 import numpy as np
 import joblib
-import json
 import os
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from collections import defaultdict
 
-label_encoder = LabelEncoder()
-scaler = StandardScaler()
-model = RandomForestRegressor()
+from compiled_transforms import encode, scale
+from forest_store import flat_path, load_model, model_variant
+from lookup_table import load_lookup_table
+from metrics import record_model_call, timed
+from model_registry import registry
+from month_calendar import MonthlyTotals
+from risk_engine import risk_table
 
-# Load the LabelEncoder and scaler from files
+# Paths to the model, scaler and LabelEncoder files
 base_dir = os.path.dirname(os.path.abspath(__file__))
 scaler_path = os.path.join(base_dir, 'fuel_scaler.pkl')
 label_encoder_path = os.path.join(base_dir, 'fuel_label_encoder.pkl')
 model_path = os.path.join(base_dir, 'fuel_model.pkl')
+lookup_path = os.path.join(base_dir, 'fuel_lookup.npz')
+# Compact variant from compact_models.py selected by ML_MODEL_VARIANTS, or None
+variant = model_variant('fuel')
 
-model = joblib.load(model_path)
-scaler = joblib.load(scaler_path)
-label_encoder = joblib.load(label_encoder_path)
+def load_artifacts():
+    """
+    Load the fuel model, scaler and LabelEncoder from disk. Called by the
+    model registry the first time the fuel model is used. When a lookup
+    table compiled by lookup_table.py exists it replaces the forest, unless
+    a compact variant is selected (the table tabulates the full model).
+    """
+    model = load_model(model_path, variant)
+    return {
+        'model': model if variant else load_lookup_table(lookup_path, model_path, fallback=model),
+        'scaler': joblib.load(scaler_path),
+        'label_encoder': joblib.load(label_encoder_path)
+    }
+
+def warmup(artifacts):
+    """
+    Score one row per fuel type with freshly loaded artifacts, so a new
+    version has run every code path once before it serves requests.
+    """
+    fuel_types = artifacts['label_encoder'].classes_.tolist()
+    predict_outputs(fuel_types, [100.0] * len(fuel_types))
+
+registry.register('fuel', load_artifacts,
+                  paths=[model_path, flat_path(model_path, variant), scaler_path, label_encoder_path, lookup_path], warmup=warmup)
+
+# Feature names used during training and the order of the model's outputs
+FEATURE_COLUMNS = ["Fuel", "Quantity Fuel Consumed (liters)"]
+EMISSION_TYPES = [
+    "CO2 (kg)",
+    "Nitrous Oxide CO2e (kg)",
+    "Methane CO2e (kg)",
+    "Total Direct CO2e (kg)",
+    "Indirect CO2e (kg)",
+    "Life Cycle CO2e (kg)"
+]
+
+# Emissions are reported (and averaged) rounded to this many decimals
+EMISSION_DECIMALS = 3
+
+# Risk levels and the default thresholds between them; a value below a
+# threshold stays under it. Overridable through ML_RISK_THRESHOLDS.
+RISK_LEVELS = ["Low Risk", "Moderate Risk", "High Risk", "Severe Risk"]
+RISK_THRESHOLDS = {
+    'CO2 (kg)': [2000, 9000, 15000],
+    'Nitrous Oxide CO2e (kg)': [200, 500, 1000],
+    'Methane CO2e (kg)': [30, 100, 200],
+    'Total Direct CO2e (kg)': [2000, 9000, 15000],
+    'Indirect CO2e (kg)': [500, 1000, 1500],
+    'Life Cycle CO2e (kg)': [10000, 15000, 20000]
+}
+RISK_TABLE = risk_table('fuel', EMISSION_TYPES, RISK_THRESHOLDS, RISK_LEVELS)
 
 # Risk level function
 def assign_risk(value, emission_type):
-    thresholds = {
-        'CO2 (kg)': [2000, 9000, 15000],
-        'Nitrous Oxide CO2e (kg)': [200, 500, 1000],
-        'Methane CO2e (kg)': [30, 100, 200],
-        'Total Direct CO2e (kg)': [2000, 9000, 15000],
-        'Indirect CO2e (kg)': [500, 1000, 1500],
-        'Life Cycle CO2e (kg)': [10000, 15000, 20000]
+    if emission_type in RISK_THRESHOLDS:
+        return RISK_LEVELS[RISK_TABLE.classify_one(value, emission_type)]
+    return "Unknown"
+
+def format_fuel_result(fuel_type, volume, prediction, risk_levels=None):
+    """
+    Build the per-fuel result for one prediction row, rounding the
+    emission values to EMISSION_DECIMALS decimal places. `risk_levels` are the labels of
+    the row's risk codes; without them each value is banded on its own.
+    """
+    if risk_levels is None:
+        risk_levels = [assign_risk(prediction[i], emission_type) for i, emission_type in enumerate(EMISSION_TYPES)]
+
+    return {
+        "fuel_type": fuel_type,
+        "quantity_fuel_consumed_liters": volume,
+        "emissions": {
+            emission_type: round(prediction[i], EMISSION_DECIMALS) for i, emission_type in enumerate(EMISSION_TYPES)
+        },
+        "risk_levels": {
+            emission_type: risk_level for emission_type, risk_level in zip(EMISSION_TYPES, risk_levels)
+        }
     }
 
-    if emission_type in thresholds:
-        if value < thresholds[emission_type][0]:
-            return "Low Risk"
-        elif value < thresholds[emission_type][1]:
-            return "Moderate Risk"
-        elif value < thresholds[emission_type][2]:
-            return "High Risk"
-        else:
-            return "Severe Risk"
-    return "Unknown"
+def model_inputs(fuel_types, volumes):
+    """
+    Encode and scale parallel sequences of fuel types and volumes into the
+    feature matrix the model predicts on, in one call each.
+    """
+    artifacts = registry.get('fuel')
+    with timed('fuel', 'encode'):
+        fuel_encoded = encode(artifacts, fuel_types)
+        input_features = np.column_stack((fuel_encoded, np.asarray(volumes)))
+    with timed('fuel', 'scale'):
+        return scale(artifacts, input_features, FEATURE_COLUMNS)
+
+def predict_outputs(fuel_types, volumes):
+    """
+    Predict the emissions of parallel sequences of fuel types and volumes
+    with one model call.
+    Returns:
+        np.ndarray: (rows, EMISSION_TYPES) unrounded emissions.
+    """
+    input_scaled = model_inputs(fuel_types, volumes)
+    record_model_call('fuel', len(input_scaled))
+    with timed('fuel', 'predict'):
+        return registry.get('fuel')['model'].predict(input_scaled)
 
 # Predict emissions and risk
-def predict_emissions_and_risk(daily_fuel_data):
+def predict_emissions_and_risk(daily_fuel_data, batched=True, first_day=1):
     """
     Predict emissions and risk levels for 7 days of fuel data.
     Args:
         daily_fuel_data (list): A list of 7 days, each containing tuples of fuel type and volume.
+        batched (bool): Score every tuple of every day with a single encode/scale/predict
+            call. Set to False to fall back to one model call per tuple.
+        first_day (int): Day number of the first day, for scoring a long input in chunks.
     Returns:
         dict: JSON-formatted predictions with risk levels.
     """
+    if not batched:
+        return predict_emissions_and_risk_per_row(daily_fuel_data, first_day)
+
+    # Flatten every day's tuples into one list of rows, remembering which day each came from
+    day_numbers = []
+    fuel_types = []
+    volumes = []
+    for day_index, fuels in enumerate(daily_fuel_data, start=first_day):
+        for fuel_type, volume in fuels:
+            day_numbers.append(day_index)
+            fuel_types.append(fuel_type)
+            volumes.append(volume)
+
+    results = []
+
+    if fuel_types:
+        predictions = predict_outputs(fuel_types, volumes)
+        with timed('fuel', 'risk'):
+            risk_levels = RISK_TABLE.label(RISK_TABLE.classify(predictions))
+
+        # Scatter the rows back into the per-day response shape
+        with timed('fuel', 'format'):
+            for day_index, fuel_type, volume, prediction, row_risks in zip(day_numbers, fuel_types, volumes, predictions, risk_levels):
+                results.append({
+                    "day": day_index,
+                    "fuel_data": format_fuel_result(fuel_type, volume, prediction, row_risks)
+                })
+
+    # Return the formatted JSON response with the "status" and "predictions" keys
+    response = {
+        "status": "success",
+        "predictions": results
+    }
+
+    return response
+
+def predict_emissions_and_risk_per_row(daily_fuel_data, first_day=1):
+    """
+    Reference implementation of predict_emissions_and_risk that runs one
+    model call per (fuel_type, volume) tuple. Kept for benchmarking the
+    batched path against.
+    """
+    artifacts = registry.get('fuel')
     results = []
 
-    for day_index, fuels in enumerate(daily_fuel_data, start=1):
+    for day_index, fuels in enumerate(daily_fuel_data, start=first_day):
         for fuel_type, volume in fuels:
             # Encode fuel type and prepare data
-            fuel_encoded = label_encoder.transform([fuel_type])[0]
+            fuel_encoded = artifacts['label_encoder'].transform([fuel_type])[0]
             input_features = np.array([[fuel_encoded, volume]])  # numpy array
 
             # Convert input to DataFrame with the feature names used during training
-            input_df = pd.DataFrame(input_features, columns=["Fuel", "Quantity Fuel Consumed (liters)"])
+            input_df = pd.DataFrame(input_features, columns=FEATURE_COLUMNS)
 
             # Scale the input features
-            input_scaled = scaler.transform(input_df)
+            input_scaled = artifacts['scaler'].transform(input_df)
 
             # Predict emissions
-            prediction = model.predict(input_scaled)[0]
-
-            # Create result for this fuel, rounding the emission values to 3 decimal places
-            fuel_result = {
-                "fuel_type": fuel_type,
-                "quantity_fuel_consumed_liters": volume,
-                "emissions": {
-                    "CO2 (kg)": round(prediction[0], 3),
-                    "Nitrous Oxide CO2e (kg)": round(prediction[1], 3),
-                    "Methane CO2e (kg)": round(prediction[2], 3),
-                    "Total Direct CO2e (kg)": round(prediction[3], 3),
-                    "Indirect CO2e (kg)": round(prediction[4], 3),
-                    "Life Cycle CO2e (kg)": round(prediction[5], 3)
-                },
-                "risk_levels": {
-                    "CO2 (kg)": assign_risk(prediction[0], "CO2 (kg)"),
-                    "Nitrous Oxide CO2e (kg)": assign_risk(prediction[1], "Nitrous Oxide CO2e (kg)"),
-                    "Methane CO2e (kg)": assign_risk(prediction[2], "Methane CO2e (kg)"),
-                    "Total Direct CO2e (kg)": assign_risk(prediction[3], "Total Direct CO2e (kg)"),
-                    "Indirect CO2e (kg)": assign_risk(prediction[4], "Indirect CO2e (kg)"),
-                    "Life Cycle CO2e (kg)": assign_risk(prediction[5], "Life Cycle CO2e (kg)")
-                }
-            }
+            prediction = artifacts['model'].predict(input_scaled)[0]
 
             # Append the result for this fuel to the daily predictions
             results.append({
                 "day": day_index,
-                "fuel_data": fuel_result
+                "fuel_data": format_fuel_result(fuel_type, volume, prediction)
             })
 
-    # Return the formatted JSON response with the "status" and "predictions" keys
     response = {
         "status": "success",
         "predictions": results
     }
 
     return response
-def calculate_monthly_summary_and_format(daily_predictions):
-    # Initialize structures for monthly aggregation
-    monthly_emissions = defaultdict(lambda: defaultdict(list))
-    monthly_risk_summary = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    fuel_types = defaultdict(set)
-    formatted_output = []
-
-    # Define the months and their corresponding day ranges
-    months = {
-        "January": range(1, 31),
-        "February": range(31, 60),
-        "March": range(61, 91),
-        "April": range(91, 121),
-        "May": range(121, 151),
-        "June": range(151, 181),
-        "July": range(181, 212),
-        "August": range(212, 243),
-        "September": range(243, 273),
-        "October": range(273, 304),
-        "November": range(304, 334),
-        "December": range(334, 365)
-    }
 
-    # Process each day's data
+def daily_results(daily_predictions):
+    """
+    Group the output of predict_emissions_and_risk by day.
+    Returns:
+        list: (day, list of per-fuel results) tuples, in day order.
+    """
+    days = {}
     for prediction in daily_predictions['predictions']:
-        day_number = prediction['day']
-        month = None
-        for m, day_range in months.items():
-            if day_number in day_range:
-                month = m
-                break
-
-        if month:
-            fuel_data = prediction['fuel_data']
-            # Aggregate monthly emissions
-            for emission_type, value in fuel_data['emissions'].items():
-                monthly_emissions[month][emission_type].append(value)
-
-            # Count risk levels for monthly risk summary
-            for emission_type, risk_level in fuel_data['risk_levels'].items():
-                monthly_risk_summary[month][emission_type][risk_level] += 1
-
-            # Collect fuel types
-            fuel_types[month].add(fuel_data['fuel_type'])
-
-    # Calculate monthly averages for emissions
-    for month in months:
+        days.setdefault(prediction['day'], []).append(prediction['fuel_data'])
+    return list(days.items())
+
+def monthly_totals(start_year=None):
+    """
+    Empty running totals for add_monthly_totals and format_monthly_summary.
+    """
+    return MonthlyTotals(len(EMISSION_TYPES), len(RISK_LEVELS), start_year)
+
+@timed('fuel', 'monthly_totals')
+def add_monthly_totals(totals, daily_predictions):
+    """
+    Add the output of predict_emissions_and_risk to running monthly totals.
+    """
+    fuel_data = [prediction['fuel_data'] for prediction in daily_predictions['predictions']]
+    risk_codes = {risk_level: code for code, risk_level in enumerate(RISK_LEVELS)}
+    totals.add(
+        [prediction['day'] for prediction in daily_predictions['predictions']],
+        [[data['emissions'][emission_type] for emission_type in EMISSION_TYPES] for data in fuel_data],
+        [[risk_codes[data['risk_levels'][emission_type]] for emission_type in EMISSION_TYPES] for data in fuel_data],
+        [data['fuel_type'] for data in fuel_data]
+    )
+
+@timed('fuel', 'monthly_summary')
+def format_monthly_summary(totals):
+    """
+    One summary per month from running monthly totals.
+    """
+    averages = totals.means()
+
+    formatted_output = []
+    for month, label in enumerate(totals.labels()):
         month_summary = {
-            "Month": month,
-            "Fuel Types": list(fuel_types[month]),
-            "Emissions": {emission_type: 0 for emission_type in ["CO2 (kg)", "Nitrous Oxide CO2e (kg)", "Methane CO2e (kg)", "Total Direct CO2e (kg)", "Indirect CO2e (kg)", "Life Cycle CO2e (kg)"]},
+            **label,
+            "Fuel Types": totals.month_names(month),
+            "Emissions": dict(zip(EMISSION_TYPES, averages[month].tolist() if totals.counts[month] else [0] * len(EMISSION_TYPES))),
             "Risk Levels": {}
         }
 
-        # Calculate average emissions for the month
-        for emission_type, values in monthly_emissions[month].items():
-            month_summary["Emissions"][emission_type] = sum(values) / len(values) if values else 0
-
         # Summarize risk levels for the month
-        for emission_type, risk_levels in monthly_risk_summary[month].items():
-            total_risks = sum(risk_levels.values())
-            risk_summary = {}
-            for risk_level, count in risk_levels.items():
-                risk_summary[risk_level] = f"{risk_level} - {(count / total_risks) * 100:.2f}%"
-            month_summary["Risk Levels"][emission_type] = risk_summary
+        for i, emission_type in enumerate(EMISSION_TYPES):
+            risk_counts = totals.histograms[month, i].tolist()
+            total_risks = sum(risk_counts)
+            if total_risks:
+                month_summary["Risk Levels"][emission_type] = {
+                    risk_level: f"{risk_level} - {(count / total_risks) * 100:.2f}%"
+                    for risk_level, count in zip(RISK_LEVELS, risk_counts) if count
+                }
 
         formatted_output.append(month_summary)
 
-    return formatted_output
\ No newline at end of file
+    return formatted_output
+
+def calculate_monthly_summary_and_format(daily_predictions, start_year=None):
+    """
+    Average the emissions and summarize the risk levels of the daily
+    predictions per calendar month.
+    Args:
+        daily_predictions (dict): Output of predict_emissions_and_risk.
+        start_year (int, optional): Calendar year of day 1, so leap years get a February 29th.
+    Returns:
+        list: One summary per month. Inputs spanning several years get a "Year" field.
+    """
+    totals = monthly_totals(start_year)
+    add_monthly_totals(totals, daily_predictions)
+    return format_monthly_summary(totals)
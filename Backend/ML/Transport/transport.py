@@ -1,29 +1,50 @@
-from flask import Flask, request, jsonify
 import pandas as pd
 import numpy as np
 import joblib
 import os
-from collections import defaultdict
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics import mean_squared_error
+
+from compiled_transforms import encode
+from forest_store import flat_path, load_model, model_variant
+from metrics import record_model_call, timed
+from model_registry import registry
+from month_calendar import MonthlyTotals
+from risk_engine import risk_table
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Correctly construct the relative path to the model and label encoder files
 model_path = os.path.join(base_dir, 'carbon_emission_model.pkl')
 label_encoder_path = os.path.join(base_dir, 'transport_label_encoder.pkl')
+# Compact variant from compact_models.py selected by ML_MODEL_VARIANTS, or None
+variant = model_variant('transport')
+
+def load_artifacts():
+    """
+    Load the model and label encoder. Called by the model registry the
+    first time the transport model is used.
+    """
+    try:
+        return {
+            'model': load_model(model_path, variant),
+            'label_encoder': joblib.load(label_encoder_path)
+        }
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        print(f"Model path: {model_path}")
+        print(f"Label encoder path: {label_encoder_path}")
+        raise  # Re-raise the exception after logging the error
+
+def warmup(artifacts):
+    """
+    Dummy shipment for every transport method, run on a new version
+    before it is swapped in.
+    """
+    methods = artifacts['label_encoder'].classes_.tolist()
+    rows = len(methods)
+    predict_outputs(['kg'] * rows, [100.0] * rows, ['km'] * rows, [100.0] * rows, methods)
 
-# Load the model and label encoder
-try:
-    model = joblib.load(model_path)
-    transport_label_encoder = joblib.load(label_encoder_path)
-except FileNotFoundError as e:
-    print(f"Error: {e}")
-    print(f"Model path: {model_path}")
-    print(f"Label encoder path: {label_encoder_path}")
-    raise  # Re-raise the exception after logging the error
+registry.register('transport', load_artifacts,
+                  paths=[model_path, flat_path(model_path, variant), label_encoder_path], warmup=warmup)
 
 def preprocess_data(dataframe):
     """
@@ -33,6 +54,7 @@ def preprocess_data(dataframe):
     dataframe.columns = dataframe.columns.str.strip()  # Clean column names
 
     # Encode transport_method using LabelEncoder
+    transport_label_encoder = registry.get('transport')['label_encoder']
     dataframe['transport_method'] = transport_label_encoder.transform(dataframe['transport_method'])
 
     # Extract numerical values from carbonEmissions
@@ -47,46 +69,153 @@ def split_data(dataframe):
     Function to split the data into features (X) and target (y),
     and create training and testing sets.
     """
+    # Only needed when retraining, so keep it off the service's import path
+    from sklearn.model_selection import train_test_split
+
     X = dataframe[['weight_value', 'distance_value', 'transport_method']]
     y = dataframe['carbonEmissions']
     return train_test_split(X, y, test_size=0.2, random_state=42)
 
+# Risk levels and the default thresholds between them; an emission below a
+# threshold stays under it. Overridable through ML_RISK_THRESHOLDS.
+RISK_LEVELS = ['Low Risk', 'Moderate Risk', 'High Risk', 'Severe Risk']
+RISK_TABLE = risk_table('transport', ['Predicted Emission'], {'Predicted Emission': [500, 2000, 5000]}, RISK_LEVELS)
+
 def assess_risk(emission_value):
     """
     Function to determine the risk level based on the emission value.
     """
-    if emission_value < 500:
-        return 'Low Risk'
-    elif emission_value < 2000:
-        return 'Moderate Risk'
-    elif emission_value < 5000:
-        return 'High Risk'
-    else:
-        return 'Severe Risk'
+    return RISK_LEVELS[RISK_TABLE.classify_one(emission_value)]
+
+# The model was trained on weights in kilograms and distances in kilometres.
+# These factors convert every accepted input unit to those training units.
+WEIGHT_UNIT_FACTORS = {
+    'g': 0.001,
+    'kg': 1.0,
+    'lb': 0.45359237,
+    't': 1000.0,
+    'mt': 1000.0
+}
+DISTANCE_UNIT_FACTORS = {
+    'km': 1.0,
+    'mi': 1.609344
+}
+FEATURE_COLUMNS = ['weight_value', 'distance_value', 'transport_method']
 
-def predict_emissions_and_risk(days_data):
+def unit_factors(units, factors, kind):
+    """
+    Look up the conversion factor for every unit in `units` at once.
+    Raises ValueError naming any unit that is not supported.
+    """
+    units = np.array([str(unit).strip().lower() for unit in units], dtype=str)
+    unique_units, inverse = np.unique(units, return_inverse=True)
+
+    unknown = [unit for unit in unique_units.tolist() if unit not in factors]
+    if unknown:
+        raise ValueError(f"Unsupported {kind} unit(s): {unknown}. Expected one of {sorted(factors)}.")
+
+    return np.array([factors[unit] for unit in unique_units.tolist()], dtype=float)[inverse]
+
+def model_inputs(weight_units, weight_values, distance_units, distance_values, transport_methods):
+    """
+    Build the model's features from parallel sequences of shipment fields,
+    normalizing the units with array ops and encoding the methods.
+    """
+    artifacts = registry.get('transport')
+    with timed('transport', 'encode'):
+        weights = np.asarray(weight_values, dtype=float) * unit_factors(weight_units, WEIGHT_UNIT_FACTORS, 'weight')
+        distances = np.asarray(distance_values, dtype=float) * unit_factors(distance_units, DISTANCE_UNIT_FACTORS, 'distance')
+        methods = encode(artifacts, list(transport_methods))
+
+        # A plain matrix unless the model wants its training column names
+        if artifacts.get('array_inputs'):
+            return np.column_stack((weights, distances, methods))
+        return pd.DataFrame({
+            'weight_value': weights,
+            'distance_value': distances,
+            'transport_method': methods
+        }, columns=FEATURE_COLUMNS)
+
+def predict_outputs(weight_units, weight_values, distance_units, distance_values, transport_methods):
+    """
+    Predict the emissions of parallel sequences of shipment fields with one
+    model call.
+    Returns:
+        np.ndarray: (rows,) emissions.
+    """
+    features = model_inputs(weight_units, weight_values, distance_units, distance_values, transport_methods)
+    record_model_call('transport', len(features))
+    with timed('transport', 'predict'):
+        return registry.get('transport')['model'].predict(features)
+
+def predict_emissions_and_risk(days_data, batched=True, first_day=1):
     """
     Function to predict emissions and assess risk levels for a 7-day input.
     Each day's predictions and risks are displayed.
+
+    Weights and distances are converted from their given units (g/kg/lb/t, km/mi)
+    to the kilograms and kilometres the model was trained on. With batched=True
+    all shipments of all days are scored with a single model call. Days are
+    numbered from first_day, for scoring a long input in chunks.
     """
+    if not batched:
+        return predict_emissions_and_risk_per_row(days_data, first_day)
+
+    # Flatten every day's entries into columns, remembering which day each came from
+    day_numbers = []
+    entries = []
+    for day, day_data in enumerate(days_data, start=first_day):
+        for entry in day_data:
+            day_numbers.append(day)
+            entries.append(entry)
+
+    results = [{'Day': day, 'Results': []} for day in range(first_day, first_day + len(days_data))]
+    if not entries:
+        return results
+
+    weight_units, weight_values, distance_units, distance_values, transport_methods = zip(*entries)
+    predicted_emissions = predict_outputs(weight_units, weight_values, distance_units, distance_values, transport_methods)
+    with timed('transport', 'risk'):
+        risk_levels = RISK_TABLE.label(RISK_TABLE.classify(predicted_emissions))
+
+    with timed('transport', 'format'):
+        for day, transport_method, predicted_emission, risk_level in zip(day_numbers, transport_methods, predicted_emissions, risk_levels):
+            results[day - first_day]['Results'].append({
+                'Trasport Method': transport_method,
+                'Predicted Emission': predicted_emission,
+                'Risk Level': risk_level
+            })
+
+    return results
+
+def predict_emissions_and_risk_per_row(days_data, first_day=1):
+    """
+    Reference implementation of predict_emissions_and_risk that runs one
+    model call per shipment.
+    """
+    artifacts = registry.get('transport')
     results = []  # To store predictions and risks for all 7 days
 
-    for day, day_data in enumerate(days_data, start=1):
+    for day, day_data in enumerate(days_data, start=first_day):
         day_results = []  # Store results for one day
 
         for entry in day_data:
             # Extract features from the entry
             weight_unit, weight_value, distance_unit, distance_value, transport_method = entry
 
+            # Convert the weight and distance to the training units
+            weight_value = float(weight_value) * unit_factors([weight_unit], WEIGHT_UNIT_FACTORS, 'weight')[0]
+            distance_value = float(distance_value) * unit_factors([distance_unit], DISTANCE_UNIT_FACTORS, 'distance')[0]
+
             # Convert transport_method to numeric
-            transport_method_encoded = transport_label_encoder.transform([transport_method])[0]
+            transport_method_encoded = artifacts['label_encoder'].transform([transport_method])[0]
 
             # Create a DataFrame with proper column names
             features = pd.DataFrame([[weight_value, distance_value, transport_method_encoded]],
-                                    columns=['weight_value', 'distance_value', 'transport_method'])
+                                    columns=FEATURE_COLUMNS)
 
             # Predict emissions
-            predicted_emission = model.predict(features)[0]
+            predicted_emission = artifacts['model'].predict(features)[0]
 
             # Assess risk
             risk_level = assess_risk(predicted_emission)
@@ -99,69 +228,74 @@ def predict_emissions_and_risk(days_data):
 
     return results
 
-def calculate_monthly_summary_and_format(daily_predictions):
-    # Initialize structures for monthly aggregation
-    monthly_emissions = defaultdict(lambda: defaultdict(list))
-    monthly_risk_summary = defaultdict(lambda: defaultdict(int))
-    transport_methods = defaultdict(set)
-    formatted_output = []
+def daily_results(daily_predictions):
+    """
+    (day, list of shipment results) tuples from predict_emissions_and_risk.
+    """
+    return [(prediction['Day'], prediction['Results']) for prediction in daily_predictions]
+
+def monthly_totals(start_year=None):
+    """
+    Empty running totals for add_monthly_totals and format_monthly_summary.
+    """
+    return MonthlyTotals(1, len(RISK_LEVELS), start_year)
 
-    # Define the months and their corresponding day ranges
-    months = {
-        "January": range(1, 32),
-        "February": range(32, 60),
-        "March": range(60, 91),
-        "April": range(91, 121),
-        "May": range(121, 152),
-        "June": range(152, 182),
-        "July": range(182, 213),
-        "August": range(213, 244),
-        "September": range(244, 274),
-        "October": range(274, 305),
-        "November": range(305, 335),
-        "December": range(335, 366)
-    }
-
-    # Process each day's data
+@timed('transport', 'monthly_totals')
+def add_monthly_totals(totals, daily_predictions):
+    """
+    Add the output of predict_emissions_and_risk to running monthly totals.
+    """
+    # Flatten every day's results, remembering which day each came from
+    day_numbers = []
+    results = []
     for prediction in daily_predictions:
-        day_number = prediction['Day']
-        month = None
-        for m, day_range in months.items():
-            if day_number in day_range:
-                month = m
-                break
-
-        if month:
-            for transport_data in prediction['Results']:
-                # Aggregate monthly emissions
-                monthly_emissions[month]['emissions'].append(transport_data['Predicted Emission'])
-
-                # Count risk levels for monthly risk summary
-                monthly_risk_summary[month][transport_data['Risk Level']] += 1
-
-                # Collect transport methods
-                transport_methods[month].add(transport_data['Trasport Method'])
-
-    # Calculate monthly averages for emissions
-    for month in months:
-        if monthly_emissions[month]['emissions']:
-            avg_emissions = sum(monthly_emissions[month]['emissions']) / len(monthly_emissions[month]['emissions'])
-        else:
-            avg_emissions = 0
+        for transport_data in prediction['Results']:
+            day_numbers.append(prediction['Day'])
+            results.append(transport_data)
 
+    risk_codes = {risk_level: code for code, risk_level in enumerate(RISK_LEVELS)}
+    totals.add(
+        day_numbers,
+        [result['Predicted Emission'] for result in results],
+        [risk_codes[result['Risk Level']] for result in results],
+        [result['Trasport Method'] for result in results]
+    )
+
+@timed('transport', 'monthly_summary')
+def format_monthly_summary(totals):
+    """
+    One summary per month from running monthly totals.
+    """
+    averages = totals.means()[:, 0]
+
+    formatted_output = []
+    for month, label in enumerate(totals.labels()):
         month_summary = {
-            "Month": month,
-            "Transport Methods": list(transport_methods[month]),
-            "Average Emissions": avg_emissions,
+            **label,
+            "Transport Methods": totals.month_names(month),
+            "Average Emissions": float(averages[month]) if totals.counts[month] else 0,
             "Risk Levels": {}
         }
 
         # Summarize risk levels for the month
-        risk_counts = monthly_risk_summary[month]
-        total_risks = sum(risk_counts.values())
-        for risk_level, count in risk_counts.items():
-            month_summary["Risk Levels"][risk_level] = f"{(count / total_risks) * 100:.2f}%"
+        risk_counts = totals.histograms[month, 0].tolist()
+        total_risks = sum(risk_counts)
+        for risk_level, count in zip(RISK_LEVELS, risk_counts):
+            if count:
+                month_summary["Risk Levels"][risk_level] = f"{(count / total_risks) * 100:.2f}%"
 
         formatted_output.append(month_summary)
 
     return formatted_output
+
+def calculate_monthly_summary_and_format(daily_predictions, start_year=None):
+    """
+    Average the predicted emissions and summarize the risk levels of the
+    daily predictions per calendar month.
+
+    start_year is the calendar year of day 1, so leap years get a February
+    29th. Inputs spanning several years get a "Year" field per month.
+    """
+    totals = monthly_totals(start_year)
+    add_monthly_totals(totals, daily_predictions)
+    return format_monthly_summary(totals)
@@ -0,0 +1,179 @@
+"""
+Admission control for the prediction routes, by rows in flight.
+
+A year-long backfill scores tens of thousands of rows, a dashboard request
+a few dozen, so requests are admitted by the prediction rows they carry
+rather than by count. RowLimiter lets requests run while their rows fit in
+`max_rows`, queues up to `max_queued` more for at most `max_wait` seconds,
+and turns the rest away:
+
+    429  the queue is full
+    503  a queued request could not be admitted in time
+
+both with a Retry-After estimated from the recent throughput, so the
+backlog stays bounded instead of every request slowing down. Used by the
+ASGI server in asgi.py, on its event loop.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+
+from metrics import ADMISSION_WAIT_SECONDS, ADMITTED_ROWS, ENABLED, QUEUED_REQUESTS, REJECTED_REQUESTS
+from scheduler import INTERACTIVE, PRIORITIES
+
+# Seconds of finished requests the throughput estimate looks back on
+THROUGHPUT_WINDOW = 10.0
+
+
+class Saturated(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Args:
+        status (int): 429 or 503.
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def request_rows(data):
+    """
+    Prediction rows a parsed request body asks for: the entries of every
+    day, of every state and of every model in a /ml/batch body. Electricity
+    days are one row each.
+    """
+    if isinstance(data, list):
+        return sum(len(day) if isinstance(day, list) else 1 for day in data)
+    if not isinstance(data, dict):
+        return 0
+    if 'days_data' in data:
+        return request_rows(data['days_data'])
+    if isinstance(data.get('states'), dict):
+        return sum(request_rows(days) for days in data['states'].values())
+    if isinstance(data.get('states'), list):
+        return len(data['states'])
+    # /ml/batch: one regular body per model
+    return sum(request_rows(body) for body in data.values() if isinstance(body, dict))
+
+
+class RowLimiter:
+    """
+    Admits requests while their rows fit in a budget: queued interactive
+    requests before queued bulk ones (see scheduler.py), in arrival order
+    within a class. Not thread-safe: call it from one event loop.
+
+    Args:
+        max_rows (int): Rows that may be in flight at once. A request with
+            more rows than this is admitted alone.
+        max_queued (int): Requests that may wait for admission.
+        max_wait (float): Seconds a request may wait before it gets a 503.
+    """
+
+    def __init__(self, max_rows, max_queued=64, max_wait=5.0):
+        self.max_rows = max_rows
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.rows = 0
+        # Per class, highest priority first: (rows, future) of the waiting
+        # requests, oldest first
+        self._waiting = {priority: deque() for priority in sorted(PRIORITIES, key=PRIORITIES.get)}
+        # (finish time, rows) of recently finished requests
+        self._finished = deque()
+
+    def queued(self):
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+    def retry_after(self):
+        """
+        Seconds until the admitted and queued rows are likely done, 1 to 60.
+        """
+        now = time.monotonic()
+        while self._finished and self._finished[0][0] < now - THROUGHPUT_WINDOW:
+            self._finished.popleft()
+        throughput = sum(rows for _, rows in self._finished) / THROUGHPUT_WINDOW
+        backlog = self.rows + sum(rows for waiting in self._waiting.values() for rows, _ in waiting)
+        if not throughput:
+            return 1
+        return min(60, max(1, math.ceil(backlog / throughput)))
+
+    def _ahead(self, priority):
+        # Requests of this class or a higher one that are already waiting
+        return any(self._waiting[other] for other in self._waiting if PRIORITIES[other] <= PRIORITIES[priority])
+
+    async def acquire(self, rows, priority=INTERACTIVE):
+        """
+        Wait until `rows` more rows fit, and return the rows to release()
+        afterwards. Raises Saturated when the request is turned away.
+        """
+        rows = min(rows, self.max_rows)
+        # Requests without rows (metrics, status, bad bodies) never wait
+        if not rows or not self._ahead(priority) and self.rows + rows <= self.max_rows:
+            self._admit(rows)
+            return rows
+        if self.queued() >= self.max_queued:
+            self._reject(429)
+            raise Saturated(429, self.retry_after(), "Too many requests are queued, retry later.")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (rows, future)
+        waiting = self._waiting[priority]
+        waiting.append(entry)
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Admitted just as the wait ran out
+                return rows
+            waiting.remove(entry)
+            self._update_gauges()
+            self._reject(503)
+            raise Saturated(503, self.retry_after(), "The server is at capacity, retry later.")
+        except asyncio.CancelledError:
+            # The client went away while waiting
+            if future.done():
+                self.release(rows)
+            else:
+                waiting.remove(entry)
+                self._update_gauges()
+            raise
+        finally:
+            if ENABLED:
+                ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, priority)
+        return rows
+
+    def release(self, rows):
+        """
+        Return an admitted request's rows and admit the queued requests that
+        fit now, by class. A class only goes once the ones above it are empty.
+        """
+        self.rows -= rows
+        self._finished.append((time.monotonic(), rows))
+        for waiting in self._waiting.values():
+            while waiting and self.rows + waiting[0][0] <= self.max_rows:
+                waiting_rows, future = waiting.popleft()
+                self._admit(waiting_rows)
+                future.set_result(None)
+            if waiting:
+                break
+        self._update_gauges()
+
+    def _admit(self, rows):
+        self.rows += rows
+        self._update_gauges()
+
+    def _reject(self, status):
+        if ENABLED:
+            REJECTED_REQUESTS.inc(1, str(status))
+
+    def _update_gauges(self):
+        if ENABLED:
+            ADMITTED_ROWS.set(self.rows)
+            for priority, waiting in self._waiting.items():
+                QUEUED_REQUESTS.set(len(waiting), priority)
@@ -0,0 +1,206 @@
+"""
+Persisted, incrementally updated monthly aggregates.
+
+The dashboards post a growing year of days every day only to see updated
+monthly numbers. AggregateStore keeps the MonthlyTotals of every
+(site, category) series in SQLite instead: one row per month holding the
+count, the output sums, the risk-code histograms, the first row of every
+(output, code) pair and the names seen. Appending days scores only the new
+days and rewrites only the months they fall in. A summary is read back from
+the month rows alone, so it costs O(months) however many days were stored.
+
+Sums are reloaded as they were saved and new rows are added to them one by
+one, so a series appended day by day summarizes exactly like the same days
+sent to the model route in one request.
+
+Days are numbered per series as in the model routes. An append starts at
+first_day, by default the day after the last stored one. Leading days that
+are already stored are skipped, so posting the whole year again with
+first_day=1 only adds the new days. A series spans at most MAX_YEARS years
+of days, since its calendar and month rows grow with the last day number.
+
+The database is ML_AGGREGATE_DB, aggregates.sqlite by default.
+"""
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from pipelines import SUMMARIES, predict_days
+
+DEFAULT_PATH = 'aggregates.sqlite'
+
+# Day numbers beyond MAX_YEARS * 366 are rejected
+MAX_YEARS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    site TEXT NOT NULL,
+    category TEXT NOT NULL,
+    start_year INTEGER,
+    rows INTEGER NOT NULL,
+    last_day INTEGER NOT NULL,
+    PRIMARY KEY (site, category)
+);
+CREATE TABLE IF NOT EXISTS months (
+    site TEXT NOT NULL,
+    category TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sums BLOB NOT NULL,
+    histograms BLOB NOT NULL,
+    first_rows BLOB NOT NULL,
+    names TEXT NOT NULL,
+    PRIMARY KEY (site, category, month)
+);
+"""
+
+
+class AggregateStore:
+    """
+    SQLite store of per-(site, category, month) running totals.
+
+    Every call opens its own connection, so one store can be shared by
+    threads and processes; appends take SQLite's write lock for their
+    read-modify-write.
+
+    Args:
+        path (str, optional): Database file; defaults to ML_AGGREGATE_DB or aggregates.sqlite.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('ML_AGGREGATE_DB', DEFAULT_PATH)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(connection)
+
+    def _load(self, connection, site, category):
+        series = connection.execute(
+            "SELECT start_year, rows, last_day FROM series WHERE site = ? AND category = ?", (site, category)
+        ).fetchone()
+        if series is None:
+            return None, 0
+        start_year, rows, last_day = series
+
+        totals = SUMMARIES[category].monthly_totals(start_year)
+        totals.rows = rows
+        for month, count, sums, histograms, first_rows, names in connection.execute(
+            "SELECT month, count, sums, histograms, first_rows, names FROM months WHERE site = ? AND category = ?",
+            (site, category)
+        ):
+            totals.restore(
+                month, count, np.frombuffer(sums, dtype=np.float64),
+                np.frombuffer(histograms, dtype=np.int64), np.frombuffer(first_rows, dtype=np.int64), json.loads(names)
+            )
+        return totals, last_day
+
+    def append(self, site, category, days, options=None, start_year=None, first_day=None):
+        """
+        Score new days and fold them into the site's stored monthly totals.
+
+        Args:
+            site (str): Site (mine) the days belong to.
+            category (str): One of PREDICTORS.
+            days (list): The category's days_data entries, one per day.
+            options (dict, optional): Extra request fields, e.g. 'state_name' for electricity.
+            start_year (int, optional): Calendar year of day 1; fixed by a series' first append.
+            first_day (int, optional): Day number of days[0]; defaults to the day after the last stored one.
+        Returns:
+            MonthlyTotals: The series' updated totals.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            totals, last_day = self._load(connection, site, category)
+            if totals is None:
+                totals = SUMMARIES[category].monthly_totals(start_year)
+            elif start_year is not None and start_year != totals.start_year:
+                raise ValueError(f"start_year of {site}/{category} is {totals.start_year}, not {start_year}.")
+
+            first_day = last_day + 1 if first_day is None else first_day
+            if first_day < 1:
+                raise ValueError("first_day must be at least 1.")
+            if first_day + len(days) - 1 > MAX_YEARS * 366:
+                raise ValueError(f"A series covers at most {MAX_YEARS * 366} days ({MAX_YEARS} years), "
+                                 f"these days would end on day {first_day + len(days) - 1}.")
+            # Days up to last_day are already in the totals
+            skipped = max(0, last_day + 1 - first_day)
+            days = days[skipped:]
+            if not days:
+                return totals
+            first_day += skipped
+
+            counts = totals.counts.copy()
+            predictions = predict_days(category, days, options or {}, first_day)
+            SUMMARIES[category].add_monthly_totals(totals, predictions)
+
+            # Only rewrite the months the new days fell in
+            changed = np.nonzero(totals.counts[:len(counts)] != counts)[0].tolist() + list(range(len(counts), totals.n_months))
+            connection.executemany(
+                "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (site, category, month, int(totals.counts[month]), totals.sums[month].tobytes(),
+                     totals.histograms[month].tobytes(), totals.first_rows[month].tobytes(),
+                     json.dumps(totals.month_names(month)))
+                    for month in changed if totals.counts[month]
+                ]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)",
+                (site, category, totals.start_year, totals.rows, first_day + len(days) - 1)
+            )
+        return totals
+
+    def totals(self, site, category):
+        """
+        The stored MonthlyTotals of a series, or None if nothing was appended to it.
+        """
+        with self._connect() as connection:
+            return self._load(connection, site, category)[0]
+
+    def last_day(self, site, category):
+        """
+        Day number of the last stored day of a series; 0 when it is empty.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT last_day FROM series WHERE site = ? AND category = ?", (site, category)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def summary(self, site, category):
+        """
+        The series' monthly summary, as the category's model route formats it,
+        or None if nothing was appended to it.
+        """
+        totals = self.totals(site, category)
+        return None if totals is None else SUMMARIES[category].format_monthly_summary(totals)
+
+    def delete(self, site, category):
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM months WHERE site = ? AND category = ?", (site, category))
+            connection.execute("DELETE FROM series WHERE site = ? AND category = ?", (site, category))
+
+
+class _Transaction:
+    """
+    Context manager that commits on success, rolls back on error and always
+    closes the connection (sqlite3's own only does the first two).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if self.connection.in_transaction:
+                self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.connection.close()
@@ -1,18 +1,190 @@
-from flask import Flask, request, jsonify
+import os
+import time
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 from flask_cors import CORS, cross_origin
-# Import model prediction functions from individual model files
-from Transport.transport import predict_emissions_and_risk as predict_transport_emissions_trans
+from admission import request_rows
+from aggregate_store import AggregateStore
+from json_provider import NumpyJSONProvider
+from metrics import CONTENT_TYPE, METRICS, finish_request, start_request, timed
+from model_registry import registry
+from pipelines import PREDICTORS, REQUIRED_OPTIONS, SUMMARIES, combined_total, predict_days, run_pipelines, run_scheduled, validate_options
+from profiler import SlowRequestProfiler
+from response_compression import ResponseCompressor
+from scheduler import BULK, classify, scheduler, set_priority
+from streaming import DEFAULT_CHUNK_DAYS, read_ndjson, stream_predictions
+# Import the monthly summary functions from individual model files
 from Transport.transport import calculate_monthly_summary_and_format as calculate_monthly_summary_and_format_trans
-from Fuel.fuel import predict_emissions_and_risk as predict_fuel_emissions  # Import the fuel model's prediction function
 from Fuel.fuel import calculate_monthly_summary_and_format as calculate_monthly_summary_and_format_fuel
-from Electricity.electricity import predict_emissions_and_risk as predict_emissions_and_risk  # Import the appropriate function
 from Electricity.electricity import calculate_monthly_summary_and_format as calculate_monthly_summary_and_format  # Import the appropriate function
-from Explosives.explosive import predict_7_days_multiple_explosives as predict_7_days_multiple_explosives  # Import the appropriate function
+from Electricity.electricity import predict_emissions_and_risk_by_state
 from Explosives.explosive import calculate_monthly_summary_and_format as calculate_monthly_summary_and_format_explosives
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
 
+def request_category():
+    """
+    The model a request is for: its <category>, else the path segment after /ml.
+    """
+    if not has_request_context():
+        return 'other'
+    category = (request.view_args or {}).get('category')
+    if category is None:
+        parts = request.path.split('/')
+        category = parts[2] if len(parts) > 2 and parts[1] == 'ml' else 'other'
+    return category
+
+class TimedJSONProvider(NumpyJSONProvider):
+    """
+    The numpy-aware JSON provider, timing every jsonify as the request's
+    'serialize' stage.
+    """
+
+    def response(self, *args, **kwargs):
+        with timed(request_category(), 'serialize'):
+            return super().response(*args, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+# Set ML_COMPRESS_MIN_BYTES (e.g. 1024) to gzip/zstd-compress larger responses
+# for clients that accept it.
+if int(os.environ.get('ML_COMPRESS_MIN_BYTES', 0)) > 0:
+    compress_response = ResponseCompressor(
+        min_bytes=int(os.environ['ML_COMPRESS_MIN_BYTES']),
+        gzip_level=int(os.environ.get('ML_GZIP_LEVEL', 5)),
+        zstd_level=int(os.environ.get('ML_ZSTD_LEVEL', 3))
+    )
+
+    @app.after_request
+    def compress(response):
+        with timed(request_category(), 'compress'):
+            return compress_response(response, request.accept_encodings)
+
+# Set ML_PROFILE_SLOW_MS to sample the stacks of requests while they run and
+# write the ones slower than that to ML_PROFILE_DIR as collapsed stacks.
+profiler = None
+if os.environ.get('ML_PROFILE_SLOW_MS'):
+    profiler = SlowRequestProfiler(
+        slow_ms=float(os.environ['ML_PROFILE_SLOW_MS']),
+        interval_ms=float(os.environ.get('ML_PROFILE_INTERVAL_MS', 5)),
+        directory=os.environ.get('ML_PROFILE_DIR', 'profiles')
+    )
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    start_request()
+    registry.begin_request()
+    if profiler is not None:
+        profiler.start()
+    if scheduler is not None:
+        try:
+            set_priority(request_priority())
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+
+def request_priority():
+    """
+    The scheduler class of the request: its X-Priority header, else bulk for
+    large JSON bodies and for NDJSON uploads.
+    """
+    header = request.headers.get('X-Priority')
+    if request.is_json:
+        # Parsed once: the route's get_json() returns the cached body
+        return classify(request_rows(request.get_json(silent=True)), header)
+    if request.method == 'POST' and not header:
+        return BULK
+    return classify(0, header)
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    # The model versions that answered (streamed responses: the loaded ones)
+    response.headers['X-Model-Version'] = ','.join(
+        f"{category}={version}" for category, version in registry.request_versions().items())
+    if not response.is_streamed:
+        finish_request(route, request.method, response.status_code, time.perf_counter() - g.request_start)
+        return response
+
+    # Streamed responses are scored while they are sent, so they are timed,
+    # counted and released when the server closes them: after the last chunk,
+    # or when the client goes away
+    g.finish_on_close = True
+    method, path, status, start = request.method, request.path, response.status_code, g.request_start
+
+    def finish_stream():
+        finish_request(route, method, status, time.perf_counter() - start)
+        end_request(f"{method} {path}", start)
+
+    response.call_on_close(finish_stream)
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    # Also runs when a streaming view returns, before its body is sent
+    if not g.get('finish_on_close'):
+        end_request(f"{request.method} {request.path}", g.get('request_start', time.perf_counter()))
+
+def end_request(name, start):
+    """
+    Release the request's model versions and finish its profile.
+    """
+    registry.end_request()
+    if profiler is not None:
+        profiler.finish(name, time.perf_counter() - start)
+
+# Set ML_COALESCE_WINDOW_MS (e.g. 2) to batch concurrent predictions per model
+# for that long, or until ML_COALESCE_MAX_ROWS rows are queued.
+if float(os.environ.get('ML_COALESCE_WINDOW_MS', 0)) > 0:
+    registry.enable_coalescing(
+        window_ms=float(os.environ['ML_COALESCE_WINDOW_MS']),
+        max_rows=int(os.environ.get('ML_COALESCE_MAX_ROWS', 1024))
+    )
+
+# Set ML_PREDICTION_CACHE_SIZE to cache up to that many prediction rows,
+# optionally expiring them after ML_PREDICTION_CACHE_TTL seconds.
+if int(os.environ.get('ML_PREDICTION_CACHE_SIZE', 0)) > 0:
+    registry.enable_cache(
+        max_entries=int(os.environ['ML_PREDICTION_CACHE_SIZE']),
+        ttl_seconds=float(os.environ['ML_PREDICTION_CACHE_TTL']) if os.environ.get('ML_PREDICTION_CACHE_TTL') else None
+    )
+
+# Models are loaded the first time each route is hit. Set ML_EAGER_WARMUP=1
+# to load all of them at startup instead (e.g. before a worker takes traffic).
+if os.environ.get('ML_EAGER_WARMUP', '').lower() in ('1', 'true', 'yes'):
+    registry.warmup()
+
+# Set ML_MODEL_WATCH_INTERVAL (seconds) to reload a model when its files
+# change: the new version is loaded and warmed up in the background, then
+# swapped in while running requests finish on the old one.
+if float(os.environ.get('ML_MODEL_WATCH_INTERVAL', 0)) > 0:
+    registry.watch(float(os.environ['ML_MODEL_WATCH_INTERVAL']))
+
+# Persisted monthly aggregates of the /ml/<category>/aggregates/<site> routes,
+# in ML_AGGREGATE_DB (aggregates.sqlite by default); opened on first use.
+aggregate_store = None
+
+def get_aggregate_store():
+    global aggregate_store
+    if aggregate_store is None:
+        aggregate_store = AggregateStore()
+    return aggregate_store
+
+def get_start_year(data):
+    """
+    Optional 'start_year' field: the calendar year of day 1, used by the
+    monthly summaries to place leap days. Without it every year has 365 days.
+    """
+    start_year = data.get('start_year')
+    if start_year is None:
+        return None
+    if isinstance(start_year, bool) or not isinstance(start_year, int):
+        raise ValueError("start_year must be an integer year.")
+    return start_year
+
 @app.route('/ml/transport', methods=['POST'])
 def ml_transport():
     """
@@ -34,10 +206,10 @@ def ml_transport():
         daily_transport_data = data['days_data']
 
         # Call the transport model's prediction function
-        daily_predictions = predict_transport_emissions_trans(daily_transport_data)
+        daily_predictions = predict_days('transport', daily_transport_data, data)
 
         # Calculate monthly summary
-        monthly_summary = calculate_monthly_summary_and_format_trans(daily_predictions)
+        monthly_summary = calculate_monthly_summary_and_format_trans(daily_predictions, start_year=get_start_year(data))
 
         # Return the monthly summary as a JSON response
         response = {
@@ -66,10 +238,16 @@ def ml_explosive():
     processes it, and returns predictions with risk levels.
     """
     data = request.get_json()  # Get the JSON data from the request
-    # Call the explosive model's prediction function
-    daily_predictions = predict_7_days_multiple_explosives(data['days_data'])
-    # Calculate monthly summary
-    monthly_summary = calculate_monthly_summary_and_format_explosives(daily_predictions)
+    try:
+        # Call the explosive model's prediction function
+        daily_predictions = predict_days('explosive', data['days_data'], data)
+        # Calculate monthly summary
+        monthly_summary = calculate_monthly_summary_and_format_explosives(daily_predictions, start_year=get_start_year(data))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     return jsonify(monthly_summary)  # Return the monthly summary as a JSON response
 
 @app.route('/ml/fuel', methods=['POST'])
@@ -93,10 +271,10 @@ def ml_fuel():
         daily_fuel_data = data['days_data']
 
         # Call the fuel model's prediction function
-        daily_predictions = predict_fuel_emissions(daily_fuel_data)
+        daily_predictions = predict_days('fuel', daily_fuel_data, data)
 
         # Calculate monthly summary
-        monthly_summary = calculate_monthly_summary_and_format_fuel(daily_predictions)
+        monthly_summary = calculate_monthly_summary_and_format_fuel(daily_predictions, start_year=get_start_year(data))
 
         # Return the monthly summary as a JSON response
         response = {
@@ -124,11 +302,29 @@ def ml_electricity():
     """
     Flask route for the electricity model that accepts input data,
     processes it, and returns predictions with risk levels.
+
+    Several states are scored in one call when the body has a `states`
+    mapping of state name -> days_data, or days_data rows that carry their
+    own stateName and no state_name; the response then holds one monthly
+    summary per state.
     """
     try:
         # Parse JSON data from the POST request
         data = request.get_json()
 
+        # Multi-state request: every state's rows are scored in one model call
+        if 'states' in data or ('days_data' in data and 'state_name' not in data):
+            states_data = data['states'] if 'states' in data else data['days_data']
+            predictions = run_scheduled(predict_emissions_and_risk_by_state, states_data)
+            start_year = get_start_year(data)
+            return jsonify({
+                'status': 'success',
+                'states': {
+                    state: calculate_monthly_summary_and_format(state_predictions, start_year=start_year)
+                    for state, state_predictions in predictions.items()
+                }
+            }), 200
+
         # Validate incoming data
         if 'days_data' not in data or 'state_name' not in data:
             return jsonify({
@@ -141,9 +337,9 @@ def ml_electricity():
         state_name = data['state_name']
 
         # Call the electricity model's prediction function
-        predictions = predict_emissions_and_risk(days_data, state_name)
+        predictions = predict_days('electricity', days_data, data)
 
-        monthly_summary = calculate_monthly_summary_and_format(predictions)
+        monthly_summary = calculate_monthly_summary_and_format(predictions, start_year=get_start_year(data))
         # Return the predictions as a JSON response
         response = {
             'status': 'success',
@@ -165,5 +361,186 @@ def ml_electricity():
             'message': f"An unexpected error occurred: {str(e)}"
         }), 500
 
+def get_int_arg(args, name, default=None, minimum=None):
+    """
+    Optional integer query parameter, raising ValueError when it is not one.
+    """
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer.")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}.")
+    return value
+
+@app.route('/ml/<category>/stream', methods=['POST'])
+def ml_stream(category):
+    """
+    Streaming variant of the model routes for multi-year inputs.
+
+    The body is NDJSON with one day per line (start_year, state_name and
+    chunk_days go in the query string) or the same JSON body as the
+    non-streaming route. Days are scored chunk_days at a time and every
+    day's results are written back as an NDJSON line, followed by the
+    monthly summary.
+    """
+    if category not in PREDICTORS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown model: {category}."
+        }), 404
+
+    try:
+        if request.is_json:
+            data = request.get_json()
+            if 'days_data' not in data:
+                raise ValueError('Missing required field: days_data.')
+            days = data['days_data']
+            options = data
+            start_year = get_start_year(data)
+        else:
+            days = read_ndjson(request.stream)
+            options = request.args
+            start_year = get_int_arg(request.args, 'start_year')
+        chunk_days = get_int_arg(request.args, 'chunk_days', DEFAULT_CHUNK_DAYS, minimum=1)
+
+        missing = [field for field in REQUIRED_OPTIONS.get(category, []) if field not in options]
+        if missing:
+            raise ValueError(f"Missing required field(s): {', '.join(missing)}.")
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    lines = stream_predictions(category, days, options, start_year=start_year, chunk_days=chunk_days, dumps=app.json.dumps)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@app.route('/ml/batch', methods=['POST'])
+def ml_batch():
+    """
+    Run several models in one request. The body holds the regular request
+    body of each wanted model under its name ("fuel", "explosive",
+    "transport", "electricity") and an optional shared start_year. The
+    models run concurrently; the response has every monthly summary and
+    the combined CO2 total per month.
+    """
+    try:
+        data = request.get_json()
+
+        requests = {category: options for category, options in data.items() if category != 'start_year'}
+        unknown = [category for category in requests if category not in PREDICTORS]
+        if unknown or not requests:
+            return jsonify({
+                'status': 'error',
+                'message': f"Expected one or more of {list(PREDICTORS)}, got {list(requests)}."
+            }), 400
+        for category, options in requests.items():
+            validate_options(category, options)
+
+        start_year = get_start_year(data)
+        totals = run_pipelines(requests, start_year=start_year)
+
+        response = {
+            'status': 'success',
+            'monthly_summaries': {category: SUMMARIES[category].format_monthly_summary(totals[category]) for category in totals},
+            'total': combined_total(totals, start_year=start_year)
+        }
+
+        return jsonify(response), 200
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f"An unexpected error occurred: {str(e)}"
+        }), 500
+
+@app.route('/ml/<category>/aggregates/<site>', methods=['GET', 'POST'])
+def ml_aggregates(category, site):
+    """
+    Incrementally maintained monthly summary of a site's days.
+
+    POST takes the category's regular request body, plus an optional
+    first_day (the day number of days_data[0], by default the day after the
+    last stored day). Only days not stored yet are scored and folded into
+    the site's monthly totals. GET returns the stored summary without
+    scoring anything.
+    """
+    if category not in PREDICTORS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown model: {category}."
+        }), 404
+
+    try:
+        store = get_aggregate_store()
+        if request.method == 'POST':
+            data = request.get_json()
+            validate_options(category, data)
+            first_day = data.get('first_day')
+            if first_day is not None and (isinstance(first_day, bool) or not isinstance(first_day, int)):
+                raise ValueError("first_day must be an integer day number.")
+            totals = store.append(site, category, data['days_data'], data, start_year=get_start_year(data), first_day=first_day)
+        else:
+            totals = store.totals(site, category)
+            if totals is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': f"No {category} aggregates stored for site {site}."
+                }), 404
+
+        return jsonify({
+            'status': 'success',
+            'site': site,
+            'last_day': store.last_day(site, category),
+            'monthly_summary': SUMMARIES[category].format_monthly_summary(totals)
+        }), 200
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f"An unexpected error occurred: {str(e)}"
+        }), 500
+
+@app.route('/metrics', methods=['GET'])
+def ml_metrics():
+    """
+    Request, stage and model metrics in the Prometheus text format.
+    """
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
+@app.route('/ml/cache', methods=['GET'])
+def ml_cache():
+    """
+    Report the prediction cache's hit, miss and eviction counters.
+    """
+    if registry.cache is None:
+        return jsonify({'status': 'disabled'}), 200
+    return jsonify({'status': 'enabled', **registry.cache.stats()}), 200
+
+@app.route('/ml/models', methods=['GET'])
+def ml_models():
+    """
+    Report the loaded version of every model and the old versions still
+    finishing requests after a reload.
+    """
+    return jsonify({'status': 'success', 'models': registry.status()}), 200
+
 if __name__ == '__main__':
     app.run(debug=True, port=8800)  # Run Flask app on port 8800
@@ -0,0 +1,282 @@
+"""
+ASGI serving mode for the Flask app, with bounded concurrency.
+
+The Flask dev server runs every request on its own thread, so one slow
+year-long request competes for the CPU with every dashboard request and a
+burst of them queues without limit. Under an ASGI server the requests are
+instead:
+
+    1. read, sized and classed on the event loop (see admission.request_rows
+       and scheduler.classify),
+    2. admitted by rows in flight, interactive ones first, or answered
+       429/503 with Retry-After,
+    3. run through the Flask app on a fixed-size thread pool.
+
+Every route, hook and header of the Flask app works the same. Streamed
+responses are sent chunk by chunk and NDJSON uploads are read as the
+route consumes them; such an upload is counted as one chunk of days.
+
+Serve it with uvicorn (pip install uvicorn), from Backend/ML:
+    uvicorn asgi:app --port 8800
+or python asgi.py. Configured with
+    ML_ASGI_THREADS           threads running requests (default: CPU count, at least 2)
+    ML_MAX_ROWS_IN_FLIGHT     rows admitted at once (default 50000)
+    ML_MAX_QUEUED_REQUESTS    requests that may wait for admission (default 64)
+    ML_ADMISSION_TIMEOUT      seconds a request may wait (default 5)
+"""
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from admission import RowLimiter, Saturated, request_rows
+from app import app as flask_app
+from profiler import run_profiled
+from scheduler import BULK, INTERACTIVE, classify
+from streaming import DEFAULT_CHUNK_DAYS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def parse_json(body):
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity tokens, which the routes' stdlib parser accepts
+            pass
+    return json.loads(body)
+
+
+class ReceiveStream(io.RawIOBase):
+    """
+    wsgi.input reading the ASGI request body on demand, from a pool thread.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = b''
+        self.more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and self.more:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self.more = False
+                break
+            self.pending = message.get('body', b'')
+            self.more = message.get('more_body', False)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def is_json_mimetype(content_type):
+    """
+    Whether a Content-Type is JSON, as Flask's request.is_json decides it:
+    application/json or application/*+json. NDJSON uploads are not.
+    """
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+async def read_body(receive):
+    parts = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        parts.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(parts)
+
+
+def build_environ(scope, body_stream):
+    """
+    The WSGI environ of an ASGI HTTP request.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body_stream,
+        # The body ends where the ASGI messages end, with or without Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        # Repeated headers are joined, as a WSGI server does
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class AsyncPredictionServer:
+    """
+    ASGI application running a WSGI app on a bounded thread pool behind a
+    RowLimiter.
+
+    Args:
+        wsgi_app: The Flask app.
+        limiter (RowLimiter): Admission control by rows in flight.
+        threads (int): Requests run at once; the others wait for a thread.
+    """
+
+    def __init__(self, wsgi_app, limiter, threads):
+        self.wsgi_app = wsgi_app
+        self.limiter = limiter
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='ml-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+        loop = asyncio.get_running_loop()
+        headers = dict(scope['headers'])
+        is_json = is_json_mimetype(headers.get(b'content-type', b'').decode('latin-1'))
+        if is_json:
+            # JSON bodies are parsed whole by the routes anyway, so read them
+            # first and count their rows
+            body = await read_body(receive)
+            try:
+                rows = request_rows(parse_json(body)) if body else 0
+            except ValueError:
+                # Left to the route, which answers 400
+                rows = 0
+            body_stream = io.BytesIO(body)
+        else:
+            rows = self.stream_rows(scope)
+            body_stream = io.BufferedReader(ReceiveStream(receive, loop))
+
+        # Queued by the same classes as the scheduler: X-Priority, else size
+        header = headers.get(b'x-priority', b'').decode('latin-1')
+        try:
+            if is_json or header:
+                priority = classify(rows, header)
+            else:
+                # NDJSON uploads are bulk
+                priority = BULK if rows else INTERACTIVE
+        except ValueError:
+            # An invalid header is answered 400 by the app
+            priority = INTERACTIVE
+
+        try:
+            rows = await self.limiter.acquire(rows, priority)
+        except Saturated as e:
+            return await self.reject(send, e)
+        try:
+            await self.run(scope, body_stream, send, loop)
+        finally:
+            self.limiter.release(rows)
+
+    def stream_rows(self, scope):
+        """
+        Rows of a streamed NDJSON upload: the route scores one chunk of days
+        at a time.
+        """
+        if scope['method'] != 'POST' or not scope['path'].endswith('/stream'):
+            return 0
+        chunk_days = parse_qs(scope['query_string'].decode('latin-1')).get('chunk_days', [DEFAULT_CHUNK_DAYS])[0]
+        try:
+            return max(1, int(chunk_days))
+        except ValueError:
+            return 0
+
+    async def run(self, scope, body_stream, send, loop):
+        # Every step of a request runs in the same context, so the Flask
+        # request context, the registry's version pins and the profiler's
+        # samples follow it from thread to thread
+        context = contextvars.copy_context()
+
+        def call(function, *args):
+            return loop.run_in_executor(self.executor, context.run, run_profiled, function, *args)
+
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response_headers]
+
+        result = await call(self.wsgi_app, build_environ(scope, body_stream), start_response)
+        try:
+            iterator = iter(result)
+            chunk = await call(next, iterator, None)
+            await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await call(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Runs the Flask teardown of streamed responses
+            if hasattr(result, 'close'):
+                await call(result.close)
+
+    async def reject(self, send, error):
+        body = json.dumps({'status': 'error', 'message': str(error)}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': error.status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(error.retry_after).encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncPredictionServer(
+    flask_app,
+    limiter=RowLimiter(
+        max_rows=int(os.environ.get('ML_MAX_ROWS_IN_FLIGHT', 50000)),
+        max_queued=int(os.environ.get('ML_MAX_QUEUED_REQUESTS', 64)),
+        max_wait=float(os.environ.get('ML_ADMISSION_TIMEOUT', 5))
+    ),
+    threads=int(os.environ.get('ML_ASGI_THREADS', max(2, os.cpu_count() or 1)))
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=8800)
@@ -0,0 +1,144 @@
+"""
+Load test the ASGI serving mode against the threaded Flask server.
+
+Starts each server in a subprocess and runs two kinds of clients at once:
+bulk clients posting year-long /ml/explosive backfills (365 days of 50
+entries) and interactive clients posting the 7-day dashboard requests of
+all four routes. Clients that get a 429/503 wait for its Retry-After (at
+most one second) and try again. Reports, per server and kind of client,
+the answered requests per second, latency percentiles of the successful
+ones and how many were turned away. Run from Backend/ML (needs uvicorn):
+    python -m benchmarks.async_load --bulk-clients 4 --interactive-clients 16 --seconds 20
+Prefix it with ML_SCHEDULER_SLOTS=1 to compare the servers with the
+priority scheduler on.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.coalescer_load import make_payloads
+
+PORT = 8812
+
+SERVERS = {
+    'flask threaded': [sys.executable, '-c', f"from app import app; app.run(port={PORT}, threaded=True)"],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(PORT), '--log-level', 'warning']
+}
+
+
+def make_bulk_payload(days=365, entries=50, seed=0):
+    rng = random.Random(seed)
+    return {'days_data': [[[rng.choice(['ANFO', 'TNT', 'Emulsion']), rng.uniform(10, 5000)] for _ in range(entries)] for _ in range(days)]}
+
+
+def start_server(command, env):
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait until the server answers
+    for _ in range(400):
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            connection.request('GET', '/ml/models')
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError(f"{command} did not start")
+
+
+def client(requests, stop, results):
+    """
+    Post the (route, body) pairs in turn until stopped, appending
+    (status, seconds) to results.
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=120)
+    i = random.randrange(len(requests))
+    while not stop.is_set():
+        route, body = requests[i % len(requests)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection.request('POST', route, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        except OSError:
+            results.append((0, time.perf_counter() - start))
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=120)
+            continue
+        results.append((response.status, time.perf_counter() - start))
+        if response.status in (429, 503):
+            stop.wait(min(1.0, float(response.getheader('Retry-After', 1))))
+
+
+def report(label, kind, results, seconds):
+    ok = np.array([latency for status, latency in results if status == 200]) * 1000
+    rejected = sum(status in (429, 503) for status, _ in results)
+    failed = len(results) - len(ok) - rejected
+    percentiles = np.percentile(ok, [50, 95, 99]) if len(ok) else [float('nan')] * 3
+    print(f"{label:<16} {kind:<12} {len(ok) / seconds:>8.2f} {percentiles[0]:>9.0f} {percentiles[1]:>9.0f} "
+          f"{percentiles[2]:>9.0f} {rejected:>9} {failed:>7}")
+
+
+def run(label, command, env, args):
+    server = start_server(command, env)
+    try:
+        interactive = [(route, json.dumps(payload)) for route, payload in make_payloads().items()]
+        bulk = [('/ml/explosive', json.dumps(make_bulk_payload(seed=seed))) for seed in range(2)]
+        # Load every model before timing
+        for route, body in interactive:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=60)
+            connection.request('POST', route, body=body, headers={'Content-Type': 'application/json'})
+            connection.getresponse().read()
+
+        stop = threading.Event()
+        results = {'bulk': [], 'interactive': []}
+        threads = (
+            [threading.Thread(target=client, args=(bulk, stop, results['bulk'])) for _ in range(args.bulk_clients)]
+            + [threading.Thread(target=client, args=(interactive, stop, results['interactive'])) for _ in range(args.interactive_clients)]
+        )
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    for kind, kind_results in results.items():
+        report(label, kind, kind_results, args.seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bulk-clients', type=int, default=4)
+    parser.add_argument('--interactive-clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--max-rows', type=int, help="ML_MAX_ROWS_IN_FLIGHT of the ASGI server")
+    parser.add_argument('--threads', type=int, help="ML_ASGI_THREADS of the ASGI server")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.max_rows:
+        env['ML_MAX_ROWS_IN_FLIGHT'] = str(args.max_rows)
+    if args.threads:
+        env['ML_ASGI_THREADS'] = str(args.threads)
+
+    print(f"{args.bulk_clients} bulk + {args.interactive_clients} interactive clients, {args.seconds:.0f}s per server")
+    print(f"{'server':<16} {'clients':<12} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'429/503':>9} {'errors':>7}")
+    for label in args.servers:
+        run(label, SERVERS[label], env, args)
+
+
+if __name__ == '__main__':
+    main()
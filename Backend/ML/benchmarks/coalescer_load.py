@@ -0,0 +1,117 @@
+"""
+Load test the Flask app with the request coalescer off and on.
+
+Starts app.py in a subprocess for each configuration, fires small 7-day
+requests at all four /ml routes from many concurrent clients and reports
+throughput and latency percentiles. Run from Backend/ML:
+    python -m benchmarks.coalescer_load --clients 32 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+PORT = 8811
+
+
+def make_payloads(seed=0):
+    rng = random.Random(seed)
+    return {
+        '/ml/fuel': {'days_data': [[[rng.choice(['Diesel', 'Petrol']), rng.uniform(10, 5000)]] for _ in range(7)]},
+        '/ml/explosive': {'days_data': [[[rng.choice(['ANFO', 'TNT']), rng.uniform(10, 5000)]] for _ in range(7)]},
+        '/ml/transport': {'days_data': [[['kg', rng.uniform(10, 50000), 'km', rng.uniform(1, 2000), 'truck']] for _ in range(7)]},
+        '/ml/electricity': {'state_name': 'Odisha', 'days_data': [
+            {'energyPerTime': rng.uniform(0, 3000), 'responsibleArea': rng.uniform(0, 100), 'totalArea': rng.uniform(100, 1000)}
+            for _ in range(7)
+        ]}
+    }
+
+
+def start_server(env):
+    code = f"from app import app; app.run(port={PORT}, threaded=True)"
+    server = subprocess.Popen([sys.executable, '-c', code], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait until the server answers
+    for _ in range(200):
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("Flask app did not start")
+
+
+def client(payloads, stop, latencies, errors):
+    connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=30)
+    routes = list(payloads)
+    i = random.randrange(len(routes))
+    while not stop.is_set():
+        route = routes[i % len(routes)]
+        i += 1
+        body = json.dumps(payloads[route])
+        start = time.perf_counter()
+        connection.request('POST', route, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+
+
+def run(label, env, clients, seconds):
+    server = start_server(env)
+    try:
+        payloads = make_payloads()
+        # Load every model before timing
+        for route, payload in payloads.items():
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=30)
+            connection.request('POST', route, body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+            connection.getresponse().read()
+
+        stop = threading.Event()
+        latencies, errors = [], []
+        threads = [threading.Thread(target=client, args=(payloads, stop, latencies, errors)) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = np.array(latencies) * 1000
+    print(f"{label:<22} {len(latencies) / seconds:>9.1f} {np.percentile(latencies, 50):>9.1f} "
+          f"{np.percentile(latencies, 99):>9.1f} {len(errors):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--window-ms', type=float, default=2)
+    parser.add_argument('--max-rows', type=int, default=1024)
+    args = parser.parse_args()
+
+    base_env = dict(os.environ)
+    base_env.pop('ML_COALESCE_WINDOW_MS', None)
+    coalesced_env = dict(base_env, ML_COALESCE_WINDOW_MS=str(args.window_ms), ML_COALESCE_MAX_ROWS=str(args.max_rows))
+
+    print(f"{args.clients} clients, {args.seconds:.0f}s per run")
+    print(f"{'configuration':<22} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    run('coalescer off', base_env, args.clients, args.seconds)
+    run(f'coalescer {args.window_ms:g} ms', coalesced_env, args.clients, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
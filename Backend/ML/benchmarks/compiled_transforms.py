@@ -0,0 +1,81 @@
+"""
+Compare the compiled encoders and scalers with the sklearn ones.
+
+For every category, scores random inputs through predict_outputs with the
+compiled transforms and again after reloading the artifacts with
+ML_COMPILED_TRANSFORMS=0. It checks that both give exactly the same
+predictions and reports the median latency per call. Run from Backend/ML:
+    python -m benchmarks.compiled_transforms
+"""
+import contextlib
+import io
+import os
+import time
+import warnings
+
+import numpy as np
+
+from model_registry import registry
+from pipelines import SUMMARIES
+
+ROW_COUNTS = [1, 7, 365, 10000]
+
+
+def make_columns(category, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    classes = list(registry.get(category)['label_encoder'].classes_)
+    if category == 'fuel':
+        return rng.choice(classes, rows).tolist(), rng.uniform(0, 5000, rows).tolist()
+    if category == 'explosive':
+        # Unseen types are encoded as -1 by both paths
+        return rng.choice(classes + ['Unknown'], rows).tolist(), rng.uniform(0, 5000, rows).tolist()
+    if category == 'transport':
+        return (rng.choice(['kg', 't', 'lb'], rows).tolist(), rng.uniform(0, 50000, rows).tolist(),
+                rng.choice(['km', 'mi'], rows).tolist(), rng.uniform(0, 2000, rows).tolist(), rng.choice(classes, rows).tolist())
+    records = [
+        {'energyPerTime': e, 'responsibleArea': r, 'totalArea': t}
+        for e, r, t in zip(rng.uniform(0, 3000, rows).tolist(), rng.uniform(0, 100, rows).tolist(), rng.uniform(100, 1000, rows).tolist())
+    ]
+    return records, rng.choice(classes, rows).tolist()
+
+
+def median_latency(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def measure(category, columns, repeat):
+    predict = SUMMARIES[category].predict_outputs
+    # Keep the explosive module's unseen-type warnings out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return median_latency(lambda: predict(*columns), repeat), predict(*columns)
+
+
+def main():
+    # Models fitted on DataFrames warn about plain arrays on the sklearn path
+    warnings.simplefilter('ignore', UserWarning)
+
+    print(f"{'category':<12} {'rows':>6} {'sklearn':>10} {'compiled':>10} {'speedup':>8}")
+    for category in SUMMARIES:
+        inputs = {rows: make_columns(category, rows, seed=rows) for rows in ROW_COUNTS}
+        results = {}
+        for compiled in (False, True):
+            os.environ['ML_COMPILED_TRANSFORMS'] = '1' if compiled else '0'
+            registry.reload(category)
+            for rows, columns in inputs.items():
+                repeat = 200 if rows < 1000 else 10
+                results[compiled, rows] = measure(category, columns, repeat)
+
+        for rows in ROW_COUNTS:
+            (slow, expected), (fast, predictions) = results[False, rows], results[True, rows]
+            if not np.array_equal(predictions, expected):
+                raise RuntimeError(f"{category}: compiled transforms differ from sklearn for {rows} rows")
+            print(f"{category:<12} {rows:>6} {slow * 1e6:>8.0f}us {fast * 1e6:>8.0f}us {slow / fast:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
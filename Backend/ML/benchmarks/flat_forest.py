@@ -0,0 +1,49 @@
+"""
+Compare sklearn's RandomForestRegressor.predict with the flat-array
+evaluator in forest_store for every served model.
+
+Checks that both return the same predictions and reports the median
+latency per call for small and large batches. Run from Backend/ML:
+    python -m benchmarks.flat_forest
+"""
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from forest_store import MODEL_PATHS, flatten_forest, FlatForest, sample_inputs
+
+BATCH_SIZES = [1, 7, 365]
+
+
+def median_latency(predict, X, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predict(X)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main():
+    # The transport model was fitted on a DataFrame and warns about plain arrays
+    warnings.simplefilter('ignore', UserWarning)
+
+    print(f"{'model':<42} {'rows':>5} {'sklearn (ms)':>13} {'flat (ms)':>10} {'speedup':>8} {'max |diff|':>11}")
+    for model_path in MODEL_PATHS:
+        model = joblib.load(model_path)
+        arrays, meta = flatten_forest(model)
+        forest = FlatForest(n_features=meta['n_features'], max_depth=meta['max_depth'], **arrays)
+
+        for rows in BATCH_SIZES:
+            X = sample_inputs(forest, rows=rows, seed=rows)
+            diff = np.max(np.abs(forest.predict(X) - model.predict(X)))
+            repeat = 200 if rows <= 7 else 20
+            sklearn_ms = median_latency(model.predict, X, repeat) * 1000
+            flat_ms = median_latency(forest.predict, X, repeat) * 1000
+            print(f"{model_path:<42} {rows:>5} {sklearn_ms:>13.3f} {flat_ms:>10.3f} {sklearn_ms / flat_ms:>7.1f}x {diff:>11.3g}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark the batched fuel inference path against the per-row loop.
+
+Run from Backend/ML:
+    python -m benchmarks.fuel_batch
+"""
+import random
+import time
+
+from Fuel.fuel import predict_emissions_and_risk, predict_emissions_and_risk_per_row
+from model_registry import registry
+
+ROW_COUNTS = [7, 365, 10000]
+
+
+def make_days_data(rows, seed=0):
+    """
+    Build a days_data payload with `rows` (fuel_type, volume) tuples spread
+    over at most 365 days.
+    """
+    rng = random.Random(seed)
+    fuel_types = list(registry.get('fuel')['label_encoder'].classes_)
+    days = min(rows, 365)
+    days_data = [[] for _ in range(days)]
+    for i in range(rows):
+        days_data[i % days].append([rng.choice(fuel_types), round(rng.uniform(10, 5000), 2)])
+    return days_data
+
+
+def best_of(func, days_data, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(days_data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'rows':>8} {'per-row (s)':>12} {'batched (s)':>12} {'speedup':>9}")
+    for rows in ROW_COUNTS:
+        days_data = make_days_data(rows)
+        # The per-row loop is slow at 10k rows, so time it fewer times
+        repeat = 5 if rows <= 365 else 1
+        per_row = best_of(predict_emissions_and_risk_per_row, days_data, repeat)
+        batched = best_of(predict_emissions_and_risk, days_data, repeat)
+        print(f"{rows:>8} {per_row:>12.4f} {batched:>12.4f} {per_row / batched:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark ShardedScorer against scoring in-process.
+
+Encodes a large synthetic job once, then times model.predict on the whole
+matrix in this process and ShardedScorer.predict with 1, 2, 4 and 8
+workers, checking every result against the in-process one. Run from
+Backend/ML:
+    python -m benchmarks.sharded_scoring --category electricity --rows 1000000
+"""
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from model_registry import registry
+from pipelines import SUMMARIES
+from sharded_scoring import ShardedScorer
+
+
+def make_columns(category, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    if category == 'fuel':
+        return rng.choice(['Diesel', 'Petrol'], rows).tolist(), rng.uniform(10, 5000, rows)
+    if category == 'explosive':
+        return rng.choice(['ANFO', 'TNT'], rows).tolist(), rng.uniform(10, 5000, rows)
+    if category == 'transport':
+        return (['kg'] * rows, rng.uniform(10, 50000, rows), ['km'] * rows, rng.uniform(1, 2000, rows),
+                rng.choice(['truck'], rows).tolist())
+    return (pd.DataFrame({
+        'stateName': 'Odisha',
+        'energyPerTime': rng.uniform(0, 3000, rows),
+        'responsibleArea': rng.uniform(0, 100, rows),
+        'totalArea': rng.uniform(100, 1000, rows)
+    }),)
+
+
+def best_of(repeats, function):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--category', choices=list(SUMMARIES), default='electricity')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    X = np.asarray(SUMMARIES[args.category].model_inputs(*make_columns(args.category, args.rows)), dtype=np.float64)
+    model = registry.get(args.category)['model']
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        baseline, expected = best_of(args.repeats, lambda: model.predict(X))
+
+    print(f"{args.category}: {args.rows} rows, {os.cpu_count()} CPU(s), {type(model).__name__}")
+    print(f"{'configuration':<16} {'seconds':>9} {'rows/s':>12} {'speedup':>8}")
+    print(f"{'in-process':<16} {baseline:>9.3f} {args.rows / baseline:>12.0f} {1:>8.2f}")
+    for workers in args.workers:
+        with ShardedScorer(workers=workers, categories=[args.category]) as scorer:
+            # Start the workers and load their models before timing
+            scorer.predict(args.category, X[:workers])
+            seconds, predictions = best_of(args.repeats, lambda: scorer.predict(args.category, X))
+        if not np.array_equal(predictions, expected):
+            raise RuntimeError(f"Sharded predictions with {workers} workers differ from in-process ones")
+        print(f"{f'{workers} workers':<16} {seconds:>9.3f} {args.rows / seconds:>12.0f} {baseline / seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Benchmark suite for the four model pipelines, stage by stage.
+
+Generates reproducible synthetic days_data payloads for every category at
+several sizes (7 days, 1 year and 10 years, with 1 to 50 entries per day)
+and times each stage on its own:
+
+    encode          days_data -> feature columns (label encoding, unit factors)
+    scale           the fitted scaler (transport has none)
+    predict         the served model's predict
+    risk            risk table classification and labels
+    monthly_summary building the monthly summary from the predictions
+    json            serializing the response with the app's JSON provider
+
+plus the whole pipeline in-process and the Flask route through the test
+client. Electricity takes one reading per day, so its entries per day are
+always 1. The results are written as JSON; pass an earlier file with
+--compare to print the change of every timing and flag regressions.
+
+Run from Backend/ML:
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --days 7 365 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from app import app
+from Electricity import electricity
+from Explosives import explosive
+from Fuel import fuel
+from model_registry import registry
+from pipelines import PREDICTORS, SUMMARIES
+from Transport import transport
+
+DAY_COUNTS = [7, 365, 3650]
+ENTRY_COUNTS = [1, 10, 50]
+STAGES = ['encode', 'scale', 'predict', 'risk', 'monthly_summary', 'json']
+
+
+def make_payload(category, days, entries, seed=0):
+    """
+    A reproducible request body for a category's route.
+    """
+    rng = random.Random(f"{seed}-{category}-{days}-{entries}")
+    classes = list(registry.get(category)['label_encoder'].classes_)
+    if category in ('fuel', 'explosive'):
+        days_data = [[[rng.choice(classes), round(rng.uniform(10, 5000), 2)] for _ in range(entries)] for _ in range(days)]
+    elif category == 'transport':
+        days_data = [
+            [[rng.choice(['kg', 't', 'lb']), round(rng.uniform(10, 50000), 2), rng.choice(['km', 'mi']),
+              round(rng.uniform(1, 2000), 2), rng.choice(classes)] for _ in range(entries)]
+            for _ in range(days)
+        ]
+    else:
+        days_data = [
+            {'energyPerTime': round(rng.uniform(0, 3000), 2), 'responsibleArea': round(rng.uniform(0, 100), 2),
+             'totalArea': round(rng.uniform(100, 1000), 2)}
+            for _ in range(days)
+        ]
+        return {'state_name': rng.choice(classes), 'days_data': days_data}
+    return {'days_data': days_data}
+
+
+# Per category: encode(payload) -> unscaled features, scale(features) -> model input.
+# These follow each module's model_inputs step by step; run_stages checks that
+# their predictions still match the module's predict_outputs.
+def encode_fuel(payload):
+    rows = [entry for day in payload['days_data'] for entry in day]
+    encoded = registry.get('fuel')['label_encoder'].transform([fuel_type for fuel_type, _ in rows])
+    features = np.column_stack((encoded, np.asarray([volume for _, volume in rows])))
+    return pd.DataFrame(features, columns=fuel.FEATURE_COLUMNS)
+
+
+def encode_explosive(payload):
+    rows = [entry for day in payload['days_data'] for entry in day]
+    return pd.DataFrame({
+        'explosiveType': explosive.safe_transform_many(registry.get('explosive')['label_encoder'], [row[0] for row in rows]),
+        'amount': [row[1] for row in rows]
+    })
+
+
+def encode_transport(payload):
+    rows = [entry for day in payload['days_data'] for entry in day]
+    weight_units, weights, distance_units, distances, methods = zip(*rows)
+    return transport.model_inputs(weight_units, weights, distance_units, distances, methods)
+
+
+def encode_electricity(payload):
+    frame = pd.DataFrame(payload['days_data'])
+    state_code = registry.get('electricity')['label_encoder'].transform([payload['state_name']])[0]
+    features = pd.DataFrame({'stateName': np.full(len(frame), state_code)})
+    for column in electricity.FEATURE_COLUMNS[1:]:
+        features[column] = frame[column]
+    return features
+
+
+def scale(category):
+    scaler = registry.get(category).get('scaler')
+    return (lambda features: features) if scaler is None else scaler.transform
+
+
+def module_predictions(category, payload):
+    if category == 'electricity':
+        return electricity.predict_outputs(payload['days_data'], payload['state_name'])
+    rows = [entry for day in payload['days_data'] for entry in day]
+    return SUMMARIES[category].predict_outputs(*zip(*rows))
+
+
+ENCODERS = {
+    'fuel': encode_fuel,
+    'explosive': encode_explosive,
+    'transport': encode_transport,
+    'electricity': encode_electricity
+}
+
+ROUTES = {
+    'fuel': '/ml/fuel',
+    'explosive': '/ml/explosive',
+    'transport': '/ml/transport',
+    'electricity': '/ml/electricity'
+}
+
+
+def best_of(repeats, function):
+    """
+    Smallest and median wall time of `repeats` calls, and the last result.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': float(np.median(timings))}, result
+
+
+def run_stages(category, payload, repeats):
+    """
+    Time every stage of one payload in-process, then the whole pipeline and the route.
+    """
+    module = SUMMARIES[category]
+    model = registry.get(category)['model']
+    timings = {}
+
+    timings['encode'], features = best_of(repeats, lambda: ENCODERS[category](payload))
+    timings['scale'], X = best_of(repeats, lambda: scale(category)(features))
+    timings['predict'], predictions = best_of(repeats, lambda: model.predict(X))
+    timings['risk'], _ = best_of(repeats, lambda: module.RISK_TABLE.label(module.RISK_TABLE.classify(predictions)))
+    if not np.array_equal(predictions, module_predictions(category, payload)):
+        raise RuntimeError(f"{category}: the staged pipeline no longer matches {module.__name__}.predict_outputs")
+
+    daily_predictions = PREDICTORS[category](payload['days_data'], 1, payload)
+
+    def summarize():
+        totals = module.monthly_totals()
+        module.add_monthly_totals(totals, daily_predictions)
+        return module.format_monthly_summary(totals)
+
+    timings['monthly_summary'], summary = best_of(repeats, summarize)
+    timings['json'], body = best_of(repeats, lambda: app.json.dumps({'status': 'success', 'monthly_summary': summary}))
+
+    def pipeline():
+        return app.json.dumps({'status': 'success', 'monthly_summary': module.calculate_monthly_summary_and_format(
+            PREDICTORS[category](payload['days_data'], 1, payload))})
+
+    timings['in_process'], _ = best_of(repeats, pipeline)
+
+    client = app.test_client()
+    timings['route'], response = best_of(repeats, lambda: client.post(ROUTES[category], json=payload))
+    if response.status_code != 200:
+        raise RuntimeError(f"{ROUTES[category]} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    return timings, len(body), len(response.get_data())
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def result_key(result):
+    return result['category'], result['days'], result['entries_per_day']
+
+
+def compare(results, baseline_path, threshold, floor):
+    """
+    Print every timing against the baseline file's and return the regressions:
+    timings whose min grew by more than `threshold` (0.1 is 10%). Timings
+    under `floor` seconds in both runs are too noisy to flag.
+    """
+    with open(baseline_path) as f:
+        baseline = {result_key(result): result for result in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        changes = []
+        for stage, timing in result['timings'].items():
+            previous = before['timings'].get(stage)
+            if not previous or not previous['min']:
+                continue
+            ratio = timing['min'] / previous['min']
+            changes.append(f"{stage} {ratio:.2f}x")
+            if ratio > 1 + threshold and max(timing['min'], previous['min']) >= floor:
+                regressions.append((*result_key(result), stage, ratio))
+        print(f"{result['category']:<12} {result['days']:>5}d x{result['entries_per_day']:<3} " + ', '.join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', nargs='+', choices=list(PREDICTORS), default=list(PREDICTORS))
+    parser.add_argument('--days', type=int, nargs='+', default=DAY_COUNTS)
+    parser.add_argument('--entries', type=int, nargs='+', default=ENTRY_COUNTS, help="entries per day")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.1, help="slowdown flagged as a regression (0.1 = 10%%)")
+    parser.add_argument('--floor', type=float, default=0.002, help="ignore timings below this many seconds when flagging")
+    args = parser.parse_args()
+
+    # Fitted-on-DataFrame models warn about plain arrays and vice versa
+    warnings.simplefilter('ignore', UserWarning)
+    registry.warmup(args.categories)
+
+    results = []
+    columns = ['encode', 'scale', 'predict', 'risk', 'summary', 'json', 'in_proc', 'route']
+    print(f"{'category':<12} {'days':>5} {'x':>3} {'rows':>7} " + ' '.join(f"{column:>9}" for column in columns))
+    for category in args.categories:
+        for days in args.days:
+            # Electricity has a single reading per day
+            for entries in ([1] if category == 'electricity' else args.entries):
+                payload = make_payload(category, days, entries, args.seed)
+                timings, json_bytes, response_bytes = run_stages(category, payload, args.repeats)
+                rows = days * entries
+                results.append({
+                    'category': category,
+                    'days': days,
+                    'entries_per_day': entries,
+                    'rows': rows,
+                    'json_bytes': json_bytes,
+                    'response_bytes': response_bytes,
+                    'timings': timings
+                })
+                print(f"{category:<12} {days:>5} {entries:>3} {rows:>7} " +
+                      ' '.join(f"{timings[stage]['min'] * 1000:>7.2f}ms" for stage in STAGES + ['in_process', 'route']), flush=True)
+
+    report = {'environment': environment(), 'repeats': args.repeats, 'seed': args.seed, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold, args.floor)
+        if regressions:
+            print(f"\n{len(regressions)} timing(s) more than {args.threshold:.0%} slower:")
+            for category, days, entries, stage, ratio in regressions:
+                print(f"  {category} {days}d x{entries} {stage}: {ratio:.2f}x")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
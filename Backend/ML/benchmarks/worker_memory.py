@@ -0,0 +1,78 @@
+"""
+Measure per-worker memory with pickled vs memory-mapped flat models.
+
+Forks N workers the way a pre-fork server does, lets each one load all four
+models after the fork and score a batch, then reads USS (memory unique to
+the worker) and PSS (its proportional share of shared pages) from
+/proc/<pid>/smaps_rollup. Linux only.
+
+Export the flat models first, then run from Backend/ML:
+    python forest_store.py
+    python -m benchmarks.worker_memory
+"""
+import multiprocessing
+import os
+import warnings
+
+import numpy as np
+
+WORKER_COUNTS = [1, 4, 8]
+
+
+def read_memory_kb(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    uss = fields['Private_Clean'] + fields['Private_Dirty']
+    return uss, fields['Pss']
+
+
+def worker(use_flat, ready, done):
+    os.environ['ML_FLAT_MODELS'] = '1' if use_flat else '0'
+    import app  # noqa: F401  registers all four model modules
+    from model_registry import registry
+
+    registry.warmup()
+    # The transport model was fitted on a DataFrame and warns about plain arrays
+    warnings.simplefilter('ignore', UserWarning)
+    rng = np.random.default_rng(os.getpid())
+    for category in registry.categories():
+        model = registry.get(category)['model']
+        model.predict(rng.normal(size=(2000, model.n_features_in_)))
+
+    ready.put(os.getpid())
+    done.wait()
+
+
+def measure(use_flat, workers):
+    context = multiprocessing.get_context('fork')
+    ready = context.Queue()
+    done = context.Event()
+    processes = [context.Process(target=worker, args=(use_flat, ready, done)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    pids = [ready.get() for _ in processes]
+
+    usage = [read_memory_kb(pid) for pid in pids]
+    done.set()
+    for process in processes:
+        process.join()
+
+    uss = sum(u for u, _ in usage) / len(usage) / 1024
+    pss = sum(p for _, p in usage) / len(usage) / 1024
+    return uss, pss
+
+
+def main():
+    print(f"{'format':>7} {'workers':>8} {'USS/worker (MB)':>16} {'PSS/worker (MB)':>16}")
+    for use_flat in (False, True):
+        for workers in WORKER_COUNTS:
+            uss, pss = measure(use_flat, workers)
+            print(f"{'flat' if use_flat else 'pickle':>7} {workers:>8} {uss:>16.1f} {pss:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Bulk scoring of CSV/Parquet logs, for historical backfills.
+
+Reads a flat table with one prediction row per line (a fuel fill, a blast,
+a shipment leg or a meter reading) in chunks of `chunk_rows`, scores each
+chunk with one call to the model module's predict_outputs and writes:
+
+    <output_dir>/predictions.parquet      every input row with its predictions and risk levels
+    <output_dir>/monthly_summary.parquet  the same monthly summary the Flask route returns
+
+Only one chunk is in memory at a time, so inputs larger than RAM are fine.
+Every table needs a `day` column, holding either day numbers (day 1 is
+January 1st of the start year) or dates. The other expected columns are
+listed in LAYOUTS; map differently named file columns with --column.
+
+Run from Backend/ML, e.g.
+    python bulk_ingest.py fuel fuel_logs.csv out/fuel --column volume="Quantity Fuel Consumed (liters)"
+
+Parquet reading and writing needs pyarrow (pip install pyarrow).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from Fuel import fuel
+from pipelines import SUMMARIES
+from sharded_scoring import ShardedScorer
+
+DEFAULT_CHUNK_ROWS = 100000
+
+# Input columns of each category, which of them are numeric, the column
+# collected as names in the monthly summary, and the arguments of the
+# module's predict_outputs for one chunk
+LAYOUTS = {
+    'fuel': {
+        'inputs': ['fuel_type', 'volume'],
+        'numeric': ['volume'],
+        'name': 'fuel_type',
+        'decimals': fuel.EMISSION_DECIMALS,
+        'arguments': lambda frame: (frame['fuel_type'].tolist(), frame['volume'].to_numpy())
+    },
+    'explosive': {
+        'inputs': ['explosive_type', 'amount'],
+        'numeric': ['amount'],
+        'name': 'explosive_type',
+        'arguments': lambda frame: (frame['explosive_type'].tolist(), frame['amount'].to_numpy())
+    },
+    'transport': {
+        'inputs': ['weight_unit', 'weight', 'distance_unit', 'distance', 'transport_method'],
+        'numeric': ['weight', 'distance'],
+        'name': 'transport_method',
+        'arguments': lambda frame: (
+            frame['weight_unit'].tolist(), frame['weight'].to_numpy(),
+            frame['distance_unit'].tolist(), frame['distance'].to_numpy(),
+            frame['transport_method'].tolist()
+        )
+    },
+    'electricity': {
+        'inputs': ['state_name', 'energy_per_time', 'responsible_area', 'total_area'],
+        'numeric': ['energy_per_time', 'responsible_area', 'total_area'],
+        'name': None,
+        'arguments': lambda frame: (pd.DataFrame({
+            'stateName': frame['state_name'],
+            'energyPerTime': frame['energy_per_time'],
+            'responsibleArea': frame['responsible_area'],
+            'totalArea': frame['total_area']
+        }),)
+    }
+}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet input and output need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def read_chunks(path, columns, chunk_rows):
+    """
+    Yield DataFrames of up to chunk_rows rows holding only `columns`.
+    """
+    if path.endswith(('.parquet', '.pq')):
+        pyarrow = import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        # round_trip parses every float to exactly the value that was written
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows, float_precision='round_trip')
+
+
+def day_numbers(days, start_year):
+    """
+    Day numbers of a `day` column of day numbers or dates. Dates are
+    counted from January 1st of start_year.
+    """
+    if pd.api.types.is_numeric_dtype(days):
+        return days.to_numpy(dtype=np.int64)
+    dates = pd.to_datetime(days)
+    return (dates - pd.Timestamp(year=start_year, month=1, day=1)).dt.days.to_numpy(dtype=np.int64) + 1
+
+
+def ingest(category, input_path, output_dir, columns=None, start_year=None, state_name=None,
+           chunk_rows=DEFAULT_CHUNK_ROWS, progress=True, scorer=None):
+    """
+    Score a CSV or Parquet file and write the per-row predictions and the
+    monthly summary to Parquet.
+
+    Args:
+        category (str): One of LAYOUTS.
+        input_path (str): .csv, .parquet or .pq file.
+        output_dir (str): Directory for predictions.parquet and monthly_summary.parquet.
+        columns (dict, optional): Expected column name -> column name in the file.
+        start_year (int, optional): Calendar year of day 1. With a date `day` column it
+            defaults to the year of the first row.
+        state_name (str, optional): Electricity only: the state of every row, when the
+            file has no state_name column.
+        chunk_rows (int): Rows scored per model call.
+        progress (bool): Print rows/sec after every chunk.
+        scorer (ShardedScorer, optional): Run the model in this process pool.
+    Returns:
+        dict: Row count, elapsed seconds, rows per second and the output paths.
+    """
+    pyarrow = import_pyarrow()
+    layout = LAYOUTS[category]
+    module = SUMMARIES[category]
+    table = module.RISK_TABLE
+
+    columns = columns or {}
+    file_columns = {name: columns.get(name, name) for name in ['day'] + layout['inputs']}
+    constants = {}
+    if category == 'electricity' and state_name is not None:
+        file_columns.pop('state_name')
+        constants['state_name'] = state_name
+
+    os.makedirs(output_dir, exist_ok=True)
+    predictions_path = os.path.join(output_dir, 'predictions.parquet')
+    summary_path = os.path.join(output_dir, 'monthly_summary.parquet')
+
+    totals = None
+    writer = None
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in read_chunks(input_path, list(file_columns.values()), chunk_rows):
+            frame = pd.DataFrame({name: chunk[column] for name, column in file_columns.items()})
+            for name, value in constants.items():
+                frame[name] = value
+            frame = frame[['day'] + layout['inputs']]
+            for name in layout['inputs']:
+                frame[name] = frame[name].astype(float) if name in layout['numeric'] else frame[name].astype(str)
+
+            if totals is None:
+                if start_year is None and not pd.api.types.is_numeric_dtype(frame['day']):
+                    start_year = int(pd.to_datetime(frame['day']).iloc[0].year)
+                totals = module.monthly_totals(start_year)
+            frame['day'] = day_numbers(frame['day'], start_year)
+
+            try:
+                arguments = layout['arguments'](frame)
+                values = scorer.score(category, *arguments) if scorer else module.predict_outputs(*arguments)
+                values = np.asarray(values, dtype=np.float64).reshape(len(frame), -1)
+            except ValueError as e:
+                raise ValueError(f"Rows {rows + 1}-{rows + len(frame)}: {e}")
+            codes = table.classify(values)
+            if layout.get('decimals') is not None:
+                values = np.round(values, layout['decimals'])
+
+            totals.add(frame['day'], values, codes, frame[layout['name']].tolist() if layout['name'] else None)
+
+            for i, output in enumerate(table.outputs):
+                frame[output] = values[:, i]
+                frame[f"{output} Risk"] = pd.Categorical.from_codes(codes[:, i], categories=table.labels)
+            arrow_table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(predictions_path, arrow_table.schema)
+            writer.write_table(arrow_table.cast(writer.schema))
+
+            rows += len(frame)
+            if progress:
+                elapsed = time.perf_counter() - start
+                print(f"{rows:>12} rows  {rows / elapsed:>10.0f} rows/s", flush=True)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if totals is None:
+        totals = module.monthly_totals(start_year)
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(module.format_monthly_summary(totals)), summary_path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+        'predictions_path': predictions_path if writer is not None else None,
+        'summary_path': summary_path
+    }
+
+
+def parse_columns(pairs):
+    columns = {}
+    for pair in pairs:
+        name, sep, column = pair.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"--column expects name=file_column, got {pair!r}")
+        columns[name] = column
+    return columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('category', choices=list(LAYOUTS))
+    parser.add_argument('input_path')
+    parser.add_argument('output_dir')
+    parser.add_argument('--column', action='append', default=[], metavar='NAME=FILE_COLUMN',
+                        help="read an expected column from a differently named file column")
+    parser.add_argument('--start-year', type=int)
+    parser.add_argument('--state-name', help="electricity: state of every row, if the file has no state column")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=1, help="score each chunk across this many processes")
+    args = parser.parse_args(argv)
+
+    scorer = ShardedScorer(workers=args.workers, categories=[args.category]) if args.workers > 1 else None
+    try:
+        stats = ingest(
+            args.category, args.input_path, args.output_dir,
+            columns=parse_columns(args.column), start_year=args.start_year, state_name=args.state_name,
+            chunk_rows=args.chunk_rows, scorer=scorer
+        )
+    finally:
+        if scorer is not None:
+            scorer.close()
+    print(f"Scored {stats['rows']} rows in {stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s)")
+    print(f"Wrote {stats['predictions_path']} and {stats['summary_path']}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
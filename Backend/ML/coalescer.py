@@ -0,0 +1,106 @@
+"""
+Micro-batching for concurrent prediction requests.
+
+Under load the dashboards send many small requests at once and each one
+pays the full per-call cost of model.predict. A CoalescedModel queues the
+rows of concurrent predict() calls for a short window, runs them as one
+batched predict on its own thread and hands every caller back its slice.
+
+Enabled from app.py with ML_COALESCE_WINDOW_MS (and optionally
+ML_COALESCE_MAX_ROWS); off by default.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+
+class CoalescedModel:
+    """
+    Wraps a model so concurrent predict() calls share one model call.
+
+    A batch is flushed when `window_ms` has passed since its first request
+    arrived or once it holds `max_rows` rows, whichever comes first.
+    """
+
+    def __init__(self, model, window_ms=2.0, max_rows=1024, name='model'):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self.n_features_in_ = getattr(model, 'n_features_in_', None)
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'coalescer-{name}', daemon=True)
+        self._thread.start()
+
+    def predict(self, X):
+        future = Future()
+        self._requests.put((X, future))
+        return future.result()
+
+    def close(self):
+        """
+        Stop the batching thread once the requests already queued are scored.
+        """
+        self._requests.put(None)
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until the window
+        closes or the batch is full.
+        """
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.window
+        while rows < self.max_rows:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Closing: finish this batch, then stop on the next collect
+                self._requests.put(None)
+                break
+            batch.append(request)
+            rows += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            inputs = [X for X, _ in batch]
+            try:
+                # Keep DataFrames as DataFrames so models fitted on named
+                # features still see their column names
+                if all(isinstance(X, pd.DataFrame) for X in inputs):
+                    combined = pd.concat(inputs, ignore_index=True)
+                else:
+                    combined = np.vstack([np.asarray(X) for X in inputs])
+                predictions = self.model.predict(combined)
+            except Exception:
+                # One bad request must not fail the others, so score them one by one
+                for X, future in batch:
+                    self._predict_one(X, future)
+                continue
+
+            start = 0
+            for X, future in batch:
+                end = start + len(X)
+                future.set_result(predictions[start:end])
+                start = end
+
+    def _predict_one(self, X, future):
+        try:
+            future.set_result(self.model.predict(X))
+        except Exception as e:
+            future.set_exception(e)
@@ -0,0 +1,334 @@
+"""
+Compact variants of the served RandomForest models.
+
+The pickled forests are full-depth default forests: 50 trees of about 4000
+nodes each, 11-19 MB per model. A variant keeps fewer trees, caps their
+depth and/or applies minimal cost-complexity pruning, and can store its
+thresholds and leaf values as float32. It is written in the flat format of
+forest_store.py, next to the full export:
+
+    Fuel/fuel_model.small.flat
+
+Thresholds are rounded down to float32 (see lookup_table.float32_floor), so
+a float32 variant makes exactly the same splits; only its leaf values lose
+precision. Fewer trees, depth caps and pruning do change predictions, so
+every variant is measured against the original model on a synthetic grid
+that spans each feature's split thresholds, and reported with its size,
+load time and predict latency.
+
+Build the default variants of every model and print the report (run from
+Backend/ML):
+    python compact_models.py
+or a custom one:
+    python compact_models.py --variant tiny --trees 10 --max-depth 8 --float32
+
+Serve a variant with ML_MODEL_VARIANTS=category=variant[,...]. The fuel and
+explosive lookup tables are compiled from the full models, so those
+categories score with the variant's trees instead when one is selected.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from forest_store import FORMAT_VERSION, MODEL_PATHS, file_digest, flat_path, load_forest, save_forest
+from lookup_table import float32_floor
+
+CATEGORY_MODELS = dict(zip(['fuel', 'explosive', 'transport', 'electricity'], MODEL_PATHS))
+
+# ccp_alpha is relative to each tree's root impurity, so one value suits
+# targets of any scale
+VARIANTS = {
+    'float32': {'float32': True},
+    'trees20': {'n_trees': 20, 'float32': True},
+    'depth12': {'max_depth': 12, 'float32': True},
+    'pruned': {'ccp_alpha': 1e-5, 'float32': True},
+    'small': {'n_trees': 20, 'max_depth': 12, 'ccp_alpha': 1e-5, 'float32': True},
+}
+
+
+def prune_tree(tree, max_depth=None, ccp_alpha=None):
+    """
+    Leaf mask of a fitted sklearn tree after capping its depth and applying
+    minimal cost-complexity pruning.
+
+    Args:
+        tree: An estimator's tree_.
+        max_depth (int): Nodes this deep become leaves.
+        ccp_alpha (float): Complexity cost per leaf, relative to the root's
+            impurity. Subtrees that do not reduce the cost by that much per
+            extra leaf are collapsed, as with sklearn's ccp_alpha.
+    Returns:
+        np.ndarray: True for the nodes that are leaves of the pruned tree.
+    """
+    left, right = tree.children_left, tree.children_right
+    is_leaf = left == -1
+
+    # Nodes are numbered depth first, so a parent always comes before its children
+    if max_depth is not None:
+        depth = np.zeros(tree.node_count, dtype=np.int64)
+        for node in np.flatnonzero(~is_leaf):
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+        is_leaf = is_leaf | (depth >= max_depth)
+
+    if ccp_alpha:
+        # Cost of a node as a leaf, weighted like sklearn's pruning
+        risk = tree.impurity * tree.weighted_n_node_samples / tree.weighted_n_node_samples[0]
+        alpha = ccp_alpha * tree.impurity[0]
+        # Bottom up: the cheapest of keeping a node's best subtrees or
+        # collapsing it into a leaf (ties collapse, giving the smallest tree)
+        cost = risk + alpha
+        for node in range(tree.node_count - 1, -1, -1):
+            if is_leaf[node]:
+                continue
+            subtrees = cost[left[node]] + cost[right[node]]
+            if subtrees < cost[node]:
+                cost[node] = subtrees
+            else:
+                is_leaf[node] = True
+    return is_leaf
+
+
+def compact_forest(model, n_trees=None, max_depth=None, ccp_alpha=None, float32=False):
+    """
+    Flatten a fitted RandomForestRegressor into the arrays of a compact
+    FlatForest, dropping the nodes below the new leaves.
+
+    Returns:
+        (dict, dict): The arrays and meta, as forest_store.flatten_forest.
+    """
+    estimators = model.estimators_[:n_trees] if n_trees else model.estimators_
+    feature, threshold, children, value, roots, missing_left = [], [], [], [], [], []
+    offset = 0
+    depth_reached = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        is_leaf = prune_tree(tree, max_depth, ccp_alpha)
+
+        # Keep the nodes still reachable from the root, in their original order
+        depth = np.zeros(tree.node_count, dtype=np.int64)
+        reachable = np.zeros(tree.node_count, dtype=bool)
+        reachable[0] = True
+        for node in range(tree.node_count):
+            if reachable[node] and not is_leaf[node]:
+                reachable[tree.children_left[node]] = reachable[tree.children_right[node]] = True
+                depth[tree.children_left[node]] = depth[tree.children_right[node]] = depth[node] + 1
+        kept = np.flatnonzero(reachable)
+        new_index = np.cumsum(reachable) - 1
+        leaves = is_leaf[kept]
+
+        # Leaves point to themselves and split on feature 0, as in flatten_forest
+        tree_children = new_index[np.column_stack((tree.children_left[kept], tree.children_right[kept]))]
+        tree_children[leaves] = np.arange(len(kept))[leaves, None]
+        tree_feature = tree.feature[kept].astype(np.int64)
+        tree_feature[leaves] = 0
+
+        roots.append(offset)
+        feature.append(tree_feature)
+        threshold.append(tree.threshold[kept].astype(np.float64))
+        children.append(tree_children + offset)
+        value.append(tree.value[kept, :, 0].astype(np.float64))
+        missing_left.append(tree.missing_go_to_left[kept].astype(bool))
+        offset += len(kept)
+        depth_reached = max(depth_reached, int(depth[kept].max()))
+
+    threshold = np.concatenate(threshold)
+    value = np.concatenate(value)
+    if float32:
+        # Rounded down, float32 thresholds make the same float32 comparisons
+        threshold = float32_floor(threshold)
+        value = value.astype(np.float32)
+    # Node indexes stay int64: numpy converts narrower index arrays on every
+    # gather, which makes traversal about 40% slower
+    arrays = {
+        'feature': np.concatenate(feature),
+        'threshold': threshold,
+        'children': np.ascontiguousarray(np.concatenate(children)),
+        'value': np.ascontiguousarray(value),
+        'roots': np.array(roots, dtype=np.int64),
+        'missing_left': np.concatenate(missing_left)
+    }
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'n_features': int(model.n_features_in_),
+        'n_outputs': int(model.n_outputs_),
+        'n_trees': len(roots),
+        'n_nodes': offset,
+        'max_depth': depth_reached,
+        'variant': {'n_trees': n_trees, 'max_depth': max_depth, 'ccp_alpha': ccp_alpha, 'float32': float32}
+    }
+    return arrays, meta
+
+
+def evaluation_grid(forest, max_rows=20000):
+    """
+    Synthetic inputs for comparing a variant with the original: a grid over
+    every feature's split thresholds. Features with few distinct thresholds
+    (the label-encoded ones) take the midpoint of every region between them,
+    the others evenly spaced points that avoid the thresholds themselves.
+    """
+    per_feature = max(2, int(max_rows ** (1 / forest.n_features_in_)))
+    axes = []
+    for f in range(forest.n_features_in_):
+        thresholds = np.unique(forest.threshold[(forest.feature == f) & ~forest.is_leaf()])
+        if not len(thresholds):
+            axes.append(np.zeros(1))
+            continue
+        edges = np.concatenate(([thresholds[0] - 1], thresholds, [thresholds[-1] + 1]))
+        if len(edges) - 1 <= per_feature:
+            axes.append((edges[:-1] + edges[1:]) / 2)
+        else:
+            # Offset by half a step so no point sits on a grid line of thresholds
+            step = (edges[-1] - edges[0]) / per_feature
+            axes.append(edges[0] + step * (np.arange(per_feature) + 0.5))
+    grid = np.meshgrid(*axes, indexing='ij')
+    return np.column_stack([axis.ravel() for axis in grid])
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def median_seconds(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def prediction_error(predictions, expected):
+    """
+    Error of a variant's predictions against the original model's.
+    """
+    error = np.abs(np.asarray(predictions, dtype=np.float64) - expected)
+    scale = float(np.mean(np.abs(expected)))
+    return {
+        'mae': float(error.mean()),
+        'rmse': float(math.sqrt(np.mean(error ** 2))),
+        'max_abs': float(error.max()),
+        # Mean absolute error relative to the mean absolute prediction
+        'relative_mae': float(error.mean() / scale) if scale else 0.0
+    }
+
+
+def measure(directory, X, expected, repeat=20):
+    """
+    Size, load time, predict latency and error of a flat export.
+    """
+    # Read the arrays fully: a memory-mapped load defers the I/O to predict
+    load_seconds = median_seconds(lambda: load_forest(directory, mmap_mode=None), 5)
+    forest = load_forest(directory)
+    predictions = forest.predict(X)
+    batch = X[:1024]
+    return {
+        'nodes': int(len(forest.children)),
+        'trees': int(len(forest.roots)),
+        'size_bytes': directory_size(directory),
+        'load_seconds': load_seconds,
+        'predict_1_seconds': median_seconds(lambda: forest.predict(X[:1]), repeat * 5),
+        'predict_1024_seconds': median_seconds(lambda: forest.predict(batch), repeat),
+        **prediction_error(predictions, expected)
+    }
+
+
+def build_variants(model_path, variants):
+    """
+    Write the given variants of one model and measure them, along with the
+    pickle and the full flat export, against the original model.
+
+    Returns:
+        dict: {'pickle' | 'full' | variant name: measurements}
+    """
+    model = joblib.load(model_path)
+    full = flat_path(model_path)
+    if not os.path.isdir(full):
+        raise FileNotFoundError(f"{full} does not exist, run forest_store.py first")
+
+    X = evaluation_grid(load_forest(full, model_path=model_path))
+    with warnings.catch_warnings():
+        # Models fitted on DataFrames warn about the missing feature names
+        warnings.simplefilter('ignore', UserWarning)
+        expected = model.predict(X)
+        pickle_predict = median_seconds(lambda: model.predict(X[:1]), 20)
+
+    report = {
+        'pickle': {
+            'size_bytes': os.path.getsize(model_path),
+            'load_seconds': median_seconds(lambda: joblib.load(model_path), 3),
+            'predict_1_seconds': pickle_predict
+        },
+        'full': measure(full, X, expected)
+    }
+    for name, options in variants.items():
+        directory = flat_path(model_path, name)
+        # Replace a previous build entirely, so no stale array is left behind
+        shutil.rmtree(directory, ignore_errors=True)
+        arrays, meta = compact_forest(model, **options)
+        meta['model_digest'] = file_digest(model_path)
+        save_forest(arrays, meta, directory)
+        report[name] = measure(directory, X, expected)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({**meta, 'report': report[name]}, f)
+    report['grid_rows'] = len(X)
+    return report
+
+
+def format_report(category, report):
+    lines = [
+        f"{category} ({report['grid_rows']} grid rows)",
+        f"  {'variant':<10} {'trees':>5} {'nodes':>8} {'size':>9} {'load':>8} {'1 row':>8} {'1024 rows':>10} "
+        f"{'MAE':>10} {'max err':>10} {'rel MAE':>8}"
+    ]
+    for name, row in report.items():
+        if name == 'grid_rows':
+            continue
+        if name == 'pickle':
+            lines.append(f"  {name:<10} {'':>5} {'':>8} {row['size_bytes'] / 1e6:>7.2f}MB {row['load_seconds'] * 1e3:>6.1f}ms "
+                         f"{row['predict_1_seconds'] * 1e3:>6.2f}ms")
+            continue
+        lines.append(
+            f"  {name:<10} {row['trees']:>5} {row['nodes']:>8} {row['size_bytes'] / 1e6:>7.2f}MB {row['load_seconds'] * 1e3:>6.1f}ms "
+            f"{row['predict_1_seconds'] * 1e3:>6.2f}ms {row['predict_1024_seconds'] * 1e3:>8.2f}ms "
+            f"{row['mae']:>10.4g} {row['max_abs']:>10.4g} {row['relative_mae']:>8.2%}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--categories', nargs='+', choices=list(CATEGORY_MODELS), default=list(CATEGORY_MODELS))
+    parser.add_argument('--variant', help="Build only this variant: one of the defaults, or a new one described by the options below")
+    parser.add_argument('--trees', type=int, help="Keep the first N trees")
+    parser.add_argument('--max-depth', type=int, help="Cap the trees at this depth")
+    parser.add_argument('--ccp-alpha', type=float, help="Cost-complexity pruning strength, relative to the root impurity")
+    parser.add_argument('--float32', action='store_true', help="Store thresholds and leaf values as float32")
+    parser.add_argument('--report', help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    variants = VARIANTS
+    if args.variant:
+        custom = {'n_trees': args.trees, 'max_depth': args.max_depth, 'ccp_alpha': args.ccp_alpha, 'float32': args.float32}
+        if args.variant in VARIANTS and not any([args.trees, args.max_depth, args.ccp_alpha, args.float32]):
+            custom = VARIANTS[args.variant]
+        variants = {args.variant: custom}
+
+    reports = {}
+    for category in args.categories:
+        reports[category] = build_variants(CATEGORY_MODELS[category], variants)
+        print(format_report(category, reports[category]))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
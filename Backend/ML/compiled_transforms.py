@@ -0,0 +1,130 @@
+"""
+pandas-free encoders and scalers for inference.
+
+sklearn's LabelEncoder.transform validates its input and binary-searches
+the classes on every call. StandardScaler.transform wants a DataFrame with
+the training feature names, and then validates that too. When a model is
+loaded, the registry compiles both into plain lookups:
+
+    CompiledEncoder  a {class: code} dict
+    CompiledScaler   the fitted mean_ and scale_ arrays
+
+so the modules go from request values to the float matrix the model
+predicts on with plain numpy. The scaler applies the same float64
+subtraction and division as StandardScaler.transform, and the encoder
+returns the same codes, so predictions match the sklearn path bit for bit.
+Values the dict does not know are handed to the sklearn encoder, so unseen
+labels raise exactly the same error as before.
+
+Set ML_COMPILED_TRANSFORMS=0 to use the sklearn objects instead.
+"""
+import os
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+
+class CompiledEncoder:
+    """
+    LabelEncoder.transform as a dict lookup.
+    """
+
+    def __init__(self, label_encoder):
+        self.label_encoder = label_encoder
+        self.codes = {label: code for code, label in enumerate(label_encoder.classes_.tolist())}
+
+    def transform(self, values):
+        codes = self.codes
+        try:
+            return np.fromiter((codes[value] for value in values), dtype=np.int64, count=len(values))
+        except (KeyError, TypeError):
+            # Unseen or unhashable labels: let sklearn decide, and raise its error
+            check_labels(values)
+            return self.label_encoder.transform(values)
+
+
+class CompiledScaler:
+    """
+    StandardScaler.transform on float arrays, without input validation.
+    """
+
+    def __init__(self, scaler):
+        self.mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.with_mean else None
+        self.scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler.with_std else None
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        if self.mean is not None:
+            X -= self.mean
+        if self.scale is not None:
+            X /= self.scale
+        return X
+
+
+def compile_transforms(artifacts):
+    """
+    Add compiled_encoder, compiled_scaler and array_inputs to freshly loaded
+    artifacts. array_inputs tells the modules the model takes plain arrays
+    (it was not fitted on named DataFrame columns).
+    """
+    if os.environ.get('ML_COMPILED_TRANSFORMS', '1') == '0':
+        return artifacts
+    if 'label_encoder' in artifacts:
+        artifacts['compiled_encoder'] = CompiledEncoder(artifacts['label_encoder'])
+    if 'scaler' in artifacts:
+        artifacts['compiled_scaler'] = CompiledScaler(artifacts['scaler'])
+    artifacts['array_inputs'] = getattr(artifacts['model'], 'feature_names_in_', None) is None
+    return artifacts
+
+
+def check_labels(values):
+    """
+    Raise ValueError for values that cannot be labels at all: the lists and
+    dicts of a malformed request. sklearn takes nested lists for a column of
+    labels and dicts fail as unhashable, so they are rejected first and
+    routes answer them with a 400, like unseen labels.
+    """
+    for value in values:
+        if isinstance(value, (list, dict)):
+            raise ValueError(f"Labels must be strings, got {value!r}.")
+
+
+def encode(artifacts, values):
+    """
+    Label-encode a sequence of values with the category's encoder.
+    """
+    compiled = artifacts.get('compiled_encoder')
+    if compiled is not None:
+        # Checks the labels only when the dict lookup fails
+        return compiled.transform(values)
+    check_labels(values)
+    return artifacts['label_encoder'].transform(values)
+
+
+def scale(artifacts, features, columns):
+    """
+    Scale a (rows, features) matrix with the category's scaler. The sklearn
+    scaler gets it as a DataFrame with the training column names.
+    """
+    compiled = artifacts.get('compiled_scaler')
+    if compiled is not None:
+        return compiled.transform(features)
+    return artifacts['scaler'].transform(pd.DataFrame(features, columns=columns))
+
+
+def record_matrix(records, columns):
+    """
+    The given fields of a list of dicts as a float64 matrix, or None when a
+    record lacks one of them, a value is not a number or there are no records.
+    """
+    if not len(records):
+        return None
+    getter = itemgetter(*columns)
+    rows = map(getter, records) if len(columns) > 1 else ((getter(record),) for record in records)
+    try:
+        values = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=len(records) * len(columns))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return values.reshape(len(records), len(columns))
@@ -0,0 +1,304 @@
+"""
+Flat, memory-mappable storage for the fitted RandomForest models.
+
+A pickled forest cannot be shared between worker processes: sklearn's Tree
+copies its node arrays into private buffers when it is unpickled, even when
+joblib.load is given mmap_mode. Exporting the forest to plain .npy arrays
+and evaluating it with NumPy lets every worker np.load the same files with
+mmap_mode='r', so the node arrays live once in the page cache and are
+shared read-only between all workers.
+
+Export the models next to their pickles (run from Backend/ML):
+    python forest_store.py
+
+Every export records the sha256 of the pickle it was built from, and an
+export that does not match the pickle next to it is rejected, so a
+redeployed .pkl is never served from the trees of the previous one.
+
+compact_models.py writes smaller variants of the same format next to them
+(fuel_model.small.flat, ...). ML_MODEL_VARIANTS selects the variant each
+category serves, e.g. ML_MODEL_VARIANTS=transport=small,electricity=float32.
+"""
+import hashlib
+import json
+import os
+import sys
+import warnings
+
+import joblib
+import numpy as np
+
+FORMAT_VERSION = 3
+ARRAY_NAMES = ['feature', 'threshold', 'children', 'value', 'roots', 'missing_left']
+
+# Pickled forests served by the Flask app, relative to Backend/ML
+MODEL_PATHS = [
+    os.path.join('Fuel', 'fuel_model.pkl'),
+    os.path.join('Explosives', 'random_forest_model.pkl'),
+    os.path.join('Transport', 'carbon_emission_model.pkl'),
+    os.path.join('Electricity', 'random_forest_model.pkl')
+]
+
+
+class FlatForest:
+    """
+    A RandomForestRegressor flattened into contiguous node arrays.
+
+    The nodes of all trees are concatenated and `roots` holds the index of
+    each tree's root. `children` is an (n_nodes, 2) array of absolute
+    left/right child indexes in which every leaf points to itself, so a
+    traversal can run a fixed `max_depth` steps without checking for leaves.
+    `missing_left` is sklearn's missing_go_to_left: whether a NaN feature
+    goes to the left child at each node. predict() returns the same values
+    as the original model.predict, NaN features included.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, missing_left, n_features, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.missing_left = missing_left
+        self.max_depth = max_depth
+        self.n_outputs = value.shape[1]
+        # Same attribute names as the sklearn model, so callers can use either
+        self.n_features_in_ = n_features
+
+    def is_leaf(self):
+        return self.children[:, 0] == np.arange(len(self.children))
+
+    def apply(self, X):
+        """
+        Return the leaf index reached by every row in every tree, as an
+        (n_trees, n_rows) array.
+
+        All trees and rows are walked together, one level per step, so each
+        step is a handful of array gathers no matter how many trees there are.
+        """
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        X_flat = X.ravel()
+        row_offsets = (np.arange(n_rows) * n_features)[None, :]
+        children_flat = self.children.ravel()
+        # NaN compares False and would always go left, so rows with missing
+        # features are routed by missing_left; other inputs skip the check
+        has_missing = np.isnan(X_flat).any()
+
+        nodes = np.repeat(self.roots[:, None], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            values = X_flat[row_offsets + self.feature[nodes]]
+            go_right = values > self.threshold[nodes]
+            if has_missing:
+                missing = np.isnan(values)
+                go_right[missing] = ~self.missing_left[nodes[missing]]
+            nodes = children_flat[2 * nodes + go_right]
+        return nodes
+
+    def predict(self, X):
+        leaf_values = self.value[self.apply(X)]
+
+        # Sum tree by tree in order and then average, exactly like
+        # RandomForestRegressor, so the result matches it bit for bit.
+        # cumsum is always sequential, unlike sum which may sum pairwise.
+        # float32 leaf values of compact variants are summed as float64.
+        predictions = np.cumsum(leaf_values, axis=0, dtype=np.float64)[-1]
+        predictions /= len(self.roots)
+        if self.n_outputs == 1:
+            return predictions.ravel()
+        return predictions
+
+
+def file_digest(path):
+    """
+    sha256 of a model file, stored with its exports and lookup tables so
+    stale ones are detected.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def flat_path(model_path, variant=None):
+    """
+    Directory holding the flat export of a pickled model, or of one of its
+    compact variants.
+    """
+    return os.path.splitext(model_path)[0] + (f'.{variant}' if variant else '') + '.flat'
+
+
+def model_variant(category):
+    """
+    The compact variant ML_MODEL_VARIANTS selects for a category, or None
+    for the full model.
+    """
+    for entry in os.environ.get('ML_MODEL_VARIANTS', '').split(','):
+        if not entry.strip():
+            continue
+        name, sep, variant = entry.partition('=')
+        if not sep or not variant.strip():
+            raise ValueError(f"ML_MODEL_VARIANTS entries must look like category=variant, got {entry!r}")
+        if name.strip() == category:
+            return variant.strip()
+    return None
+
+
+def flatten_forest(model):
+    """
+    Flatten a fitted RandomForestRegressor into the arrays FlatForest uses.
+    """
+    feature, threshold, children, value, roots, missing_left = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        node_ids = np.arange(tree.node_count, dtype=np.int64)
+        leaves = tree.children_left == -1
+
+        # Leaves point to themselves and split on feature 0, which is harmless
+        tree_children = np.column_stack((tree.children_left, tree.children_right)).astype(np.int64)
+        tree_children[leaves] = node_ids[leaves, None]
+        tree_feature = tree.feature.astype(np.int64)
+        tree_feature[leaves] = 0
+
+        roots.append(offset)
+        feature.append(tree_feature)
+        threshold.append(tree.threshold.astype(np.float64))
+        # Shift child indexes so they point into the concatenated arrays
+        children.append(tree_children + offset)
+        value.append(tree.value[:, :, 0].astype(np.float64))
+        missing_left.append(tree.missing_go_to_left.astype(bool))
+        offset += tree.node_count
+
+    arrays = {
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'children': np.ascontiguousarray(np.concatenate(children)),
+        'value': np.ascontiguousarray(np.concatenate(value)),
+        'roots': np.array(roots, dtype=np.int64),
+        'missing_left': np.concatenate(missing_left)
+    }
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'n_features': int(model.n_features_in_),
+        'n_outputs': int(model.n_outputs_),
+        'n_trees': len(roots),
+        'n_nodes': offset,
+        'max_depth': max(int(estimator.tree_.max_depth) for estimator in model.estimators_)
+    }
+    return arrays, meta
+
+
+def save_forest(arrays, meta, directory):
+    """
+    Write flattened forest arrays as uncompressed .npy files plus meta.json.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def export_forest(model, directory, model_path):
+    """
+    Flatten a fitted RandomForestRegressor, loaded from model_path, into
+    uncompressed .npy files.
+    """
+    arrays, meta = flatten_forest(model)
+    meta['model_digest'] = file_digest(model_path)
+    save_forest(arrays, meta, directory)
+
+
+def load_forest(directory, mmap_mode='r', model_path=None):
+    """
+    Load a flat forest, memory-mapping its arrays by default. With
+    model_path, the export must have been built from that pickle.
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported flat forest format {meta['format_version']} in {directory}, re-run forest_store.py")
+    if model_path is not None and meta.get('model_digest') != file_digest(model_path):
+        script = 'forest_store.py' if directory == flat_path(model_path) else 'compact_models.py'
+        raise ValueError(f"{directory} was exported from a different {model_path}, re-run {script}")
+
+    # np.asarray drops the memmap subclass (and its per-operation overhead)
+    # while still reading straight from the mapped file
+    arrays = {
+        name: np.asarray(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode))
+        for name in ARRAY_NAMES
+    }
+    return FlatForest(n_features=meta['n_features'], max_depth=meta['max_depth'], **arrays)
+
+
+def export_digest(directory):
+    """
+    sha256 of the pickle a flat export was built from, None if not recorded.
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        return json.load(f).get('model_digest')
+
+
+def load_model(model_path, variant=None):
+    """
+    Load a model for serving: the memory-mapped flat export when one exists
+    next to the pickle, otherwise the pickle itself. Set ML_FLAT_MODELS=0 to
+    always load the pickle. A compact variant, when given, must exist.
+
+    An export built from another version of the pickle (e.g. a model was
+    redeployed and hot-reloaded before re-running the export) is skipped
+    with a warning, and the pickle is served instead.
+    """
+    directory = flat_path(model_path, variant)
+    if variant and not os.path.isdir(directory):
+        raise FileNotFoundError(f"No '{variant}' variant of {model_path} at {directory}, run compact_models.py")
+
+    if variant or (os.environ.get('ML_FLAT_MODELS', '1') != '0' and os.path.isdir(directory)):
+        if export_digest(directory) == file_digest(model_path):
+            return load_forest(directory)
+        script = 'compact_models.py' if variant else 'forest_store.py'
+        print(f"Warning: {directory} was exported from a different {model_path}, loading the pickle instead. Re-run {script}.")
+    return joblib.load(model_path)
+
+
+def sample_inputs(forest, rows=1024, seed=0, missing=0.0):
+    """
+    Random inputs spanning the range of every feature's split thresholds,
+    used to check an export against the original model. With `missing`,
+    that fraction of the values is NaN.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.zeros((rows, forest.n_features_in_))
+    for f in range(forest.n_features_in_):
+        thresholds = forest.threshold[(forest.feature == f) & ~forest.is_leaf()]
+        if len(thresholds):
+            X[:, f] = rng.uniform(thresholds.min() - 1, thresholds.max() + 1, rows)
+    if missing:
+        X[rng.random(X.shape) < missing] = np.nan
+    return X
+
+
+def main(model_paths):
+    for model_path in model_paths:
+        model = joblib.load(model_path)
+        directory = flat_path(model_path)
+        export_forest(model, directory, model_path)
+
+        # Make sure the export predicts exactly what the pickle does
+        forest = load_forest(directory, model_path=model_path)
+        # Including rows with missing features, which sklearn routes per node
+        X = np.vstack((sample_inputs(forest), sample_inputs(forest, seed=1, missing=0.2)))
+        with warnings.catch_warnings():
+            # Models fitted on DataFrames warn about the missing feature names
+            warnings.simplefilter('ignore', UserWarning)
+            expected = model.predict(X)
+        if not np.array_equal(forest.predict(X), expected):
+            raise RuntimeError(f"Flat export of {model_path} does not match the original model")
+        print(f"Exported {model_path} -> {directory}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or MODEL_PATHS)
@@ -0,0 +1,84 @@
+"""
+numpy-aware JSON encoding for the Flask responses.
+
+The model responses are large nested dicts full of numpy float64 values:
+per-row emissions, per-gas explosive records and per-shipment predictions.
+Flask's default provider pushes every value through Python's json
+encoder. NumpyJSONProvider serializes with orjson when it is installed
+(pip install orjson). orjson encodes numpy scalars and arrays natively, so
+no value needs a Python-level conversion. Keys stay sorted and responses
+keep Flask's trailing newline, so the JSON documents are the same as
+before. Request bodies are still parsed by the stdlib decoder, which also
+accepts the NaN and Infinity tokens that orjson rejects.
+
+Without orjson, or with ML_JSON_ENCODER=json, the stdlib encoder is used,
+with a default hook that also accepts numpy scalars and arrays.
+"""
+import os
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Sorted keys as with Flask's provider; dates go through the Flask default hook
+# so they keep their HTTP date format
+ORJSON_OPTIONS = (
+    orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+) if orjson is not None else 0
+
+
+def numpy_default(value):
+    """
+    json default hook for numpy values, falling back to Flask's.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return DefaultJSONProvider.default(value)
+
+
+def use_orjson():
+    encoder = os.environ.get('ML_JSON_ENCODER', 'orjson' if orjson is not None else 'json')
+    if encoder not in ('orjson', 'json'):
+        raise ValueError(f"ML_JSON_ENCODER must be 'orjson' or 'json', got {encoder!r}")
+    if encoder == 'orjson' and orjson is None:
+        raise ImportError("ML_JSON_ENCODER=orjson needs orjson: pip install orjson")
+    return encoder == 'orjson'
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that serializes numpy values natively.
+    """
+    default = staticmethod(numpy_default)
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.orjson = use_orjson()
+
+    def dumps(self, obj, **kwargs):
+        # Arguments only the stdlib encoder understands (indent, separators, ...)
+        # take the stdlib path
+        if self.orjson and not kwargs:
+            return orjson.dumps(obj, default=numpy_default, option=ORJSON_OPTIONS).decode()
+        return super().dumps(obj, **kwargs)
+
+    def dumps_bytes(self, obj, indent=False):
+        """
+        Serialize straight to UTF-8 bytes, skipping the str round trip.
+        """
+        if self.orjson:
+            option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+            return orjson.dumps(obj, default=numpy_default, option=option)
+        dump_args = {'indent': 2} if indent else {'separators': (',', ':')}
+        return super().dumps(obj, **dump_args).encode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,204 @@
+"""
+Exact lookup tables for models with one category code and one numeric input.
+
+The fuel model takes (fuel code, liters) and the explosive model takes
+(explosive code, amount). For a fixed code the forest is a step function of
+the numeric input that can only change at that feature's split thresholds,
+so it can be tabulated exactly: sort the reachable thresholds into
+breakpoints, evaluate the forest once per interval, and answer predictions
+with np.searchsorted instead of walking any trees.
+
+Compile the tables next to the models (run from Backend/ML):
+    python lookup_table.py
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from forest_store import FlatForest, file_digest, flatten_forest
+
+
+def float32_floor(values):
+    """
+    Largest float32 <= each value. sklearn compares float32 inputs against
+    float64 thresholds, and x32 <= t holds exactly when x32 <= float32_floor(t).
+    """
+    rounded = values.astype(np.float32)
+    too_big = rounded.astype(np.float64) > values
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+
+def reachable_thresholds(arrays, code_value, code_feature=0, numeric_feature=1):
+    """
+    Thresholds of every split on the numeric feature that can be reached
+    when the code feature is fixed to `code_value`.
+    """
+    children = arrays['children']
+    feature = arrays['feature']
+    threshold = arrays['threshold']
+    code_value = np.float32(code_value)
+
+    thresholds = []
+    nodes = arrays['roots']
+    while len(nodes):
+        # Leaves point to themselves, drop them from the frontier
+        nodes = nodes[children[nodes, 0] != nodes]
+        on_numeric = feature[nodes] == numeric_feature
+        thresholds.append(threshold[nodes[on_numeric]])
+
+        # Splits on the numeric feature can go either way, splits on the
+        # code feature always take the branch the fixed code takes
+        on_code = nodes[feature[nodes] == code_feature]
+        go_right = (code_value > threshold[on_code]).astype(np.int64)
+        nodes = np.concatenate((children[nodes[on_numeric]].ravel(), children[on_code, go_right]))
+
+    return np.unique(float32_floor(np.concatenate(thresholds)))
+
+
+def compile_tables(model, scaled_codes):
+    """
+    Build the lookup tables for a fitted forest.
+
+    Args:
+        model: The fitted forest (sklearn or FlatForest) taking scaled (code, value) rows.
+        scaled_codes (list): The scaled value of the code feature for every code to tabulate.
+    Returns:
+        dict: Arrays to save with np.savez.
+    """
+    arrays = vars(model) if isinstance(model, FlatForest) else flatten_forest(model)[0]
+
+    offsets = [0]
+    breakpoints = []
+    values = []
+    for scaled_code in scaled_codes:
+        points = reachable_thresholds(arrays, scaled_code)
+
+        # Every interval (points[i-1], points[i]] is represented by its right
+        # end, and the open last interval by the next float32 above it
+        last = np.nextafter(points[-1], np.float32(np.inf)) if len(points) else np.float32(0)
+        representatives = np.append(points, last).astype(np.float64)
+        X = np.column_stack((np.full(len(representatives), scaled_code), representatives))
+
+        breakpoints.append(points)
+        values.append(np.asarray(model.predict(X), dtype=np.float64).reshape(len(representatives), -1))
+        offsets.append(offsets[-1] + len(representatives))
+
+    return {
+        'scaled_codes': np.asarray(scaled_codes, dtype=np.float64),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'breakpoints': np.concatenate(breakpoints).astype(np.float32),
+        'values': np.concatenate(values)
+    }
+
+
+class LookupTable:
+    """
+    Drop-in replacement for a forest's predict() built from compiled tables.
+
+    Rows whose code column matches a compiled code are answered with a binary
+    search; any other row, and any row with a non-finite numeric input (which
+    the forest routes by missing_go_to_left), falls back to the forest itself.
+    """
+
+    def __init__(self, tables, fallback):
+        self.scaled_codes = tables['scaled_codes']
+        self.offsets = tables['offsets']
+        self.breakpoints = tables['breakpoints']
+        self.values = tables['values']
+        self.fallback = fallback
+        self.n_outputs = self.values.shape[1]
+        self.n_features_in_ = 2
+
+        # Each code's breakpoints sit between two of the value offsets, one
+        # breakpoint fewer than it has intervals
+        self.tables = {}
+        for i, scaled_code in enumerate(self.scaled_codes.tolist()):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            self.tables[scaled_code] = (self.breakpoints[start - i:end - i - 1], self.values[start:end])
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        predictions = np.empty((X.shape[0], self.n_outputs))
+        numeric = X[:, 1].astype(np.float32)
+        finite = np.isfinite(numeric)
+
+        unmatched = np.ones(X.shape[0], dtype=bool)
+        for scaled_code in np.unique(X[:, 0]).tolist():
+            table = self.tables.get(scaled_code)
+            if table is None:
+                continue
+            rows = (X[:, 0] == scaled_code) & finite
+            breakpoints, values = table
+            predictions[rows] = values[np.searchsorted(breakpoints, numeric[rows], side='left')]
+            unmatched[rows] = False
+
+        if unmatched.any():
+            predictions[unmatched] = np.asarray(self.fallback.predict(X[unmatched])).reshape(-1, self.n_outputs)
+
+        if self.n_outputs == 1:
+            return predictions.ravel()
+        return predictions
+
+
+def load_lookup_table(table_path, model_path, fallback):
+    """
+    Return a LookupTable when a table compiled from the current model file
+    exists, otherwise the fallback model.
+    """
+    if os.environ.get('ML_LOOKUP_TABLES', '1') == '0' or not os.path.exists(table_path):
+        return fallback
+
+    with np.load(table_path) as data:
+        tables = {name: data[name] for name in data.files}
+    if str(tables.pop('model_digest')) != file_digest(model_path):
+        print(f"Warning: {table_path} was compiled from a different model, ignoring it. Re-run lookup_table.py.")
+        return fallback
+    return LookupTable(tables, fallback)
+
+
+def compile_module(module, columns, include_unseen=False):
+    """
+    Compile and save the lookup table for one model module.
+
+    Args:
+        module: Fuel.fuel or Explosives.explosive; it must define load_artifacts,
+            model_path and lookup_path.
+        columns (list): The scaler's feature names, code column first.
+        include_unseen (bool): Also tabulate code -1, used for unseen categories.
+    """
+    artifacts = module.load_artifacts()
+    model = artifacts['model']
+    if isinstance(model, LookupTable):
+        model = model.fallback
+
+    codes = list(range(len(artifacts['label_encoder'].classes_)))
+    if include_unseen:
+        codes = [-1] + codes
+    scaled = artifacts['scaler'].transform(pd.DataFrame([[code, 0.0] for code in codes], columns=columns))
+    tables = compile_tables(model, scaled[:, 0].tolist())
+
+    # Check the tables against the forest before saving them
+    X = np.repeat(scaled, 500, axis=0)
+    rng = np.random.default_rng(0)
+    X[:, 1] = rng.uniform(tables['breakpoints'].min() - 1, tables['breakpoints'].max() + 1, len(X))
+    # Missing and infinite inputs must reach the forest
+    non_finite = rng.random(len(X)) < 0.05
+    X[non_finite, 1] = rng.choice([np.nan, np.inf, -np.inf], non_finite.sum())
+    if not np.array_equal(LookupTable(tables, model).predict(X), model.predict(X)):
+        raise RuntimeError(f"Lookup table for {module.__name__} does not match the model")
+
+    np.savez(module.lookup_path, model_digest=file_digest(module.model_path), **tables)
+    print(f"Compiled {len(codes)} codes, {len(tables['breakpoints'])} breakpoints -> {module.lookup_path}")
+
+
+if __name__ == '__main__':
+    from Explosives import explosive
+    from Fuel import fuel
+    # The modules load their tables as lookup_table.LookupTable, not as
+    # this script's __main__.LookupTable
+    from lookup_table import compile_module
+
+    compile_module(fuel, fuel.FEATURE_COLUMNS)
+    compile_module(explosive, ['explosiveType', 'amount'], include_unseen=True)
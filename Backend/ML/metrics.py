@@ -0,0 +1,262 @@
+"""
+Lightweight latency and throughput metrics in the Prometheus text format.
+
+The Flask app times every request per route, and the model modules time
+their stages (encode, scale, predict, risk, format, monthly_totals and
+monthly_summary) with
+
+    with timed('explosive', 'encode'):
+        ...
+
+or @timed('explosive', 'monthly_summary') on a whole function,
+and count every model call and its rows with record_model_call. The
+rows scored while handling a request are added up per request. GET /metrics
+renders everything as Prometheus histograms and counters.
+
+A timer costs two perf_counter calls and one short lock. Set ML_METRICS=0
+to turn all of them into no-ops.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+ENABLED = os.environ.get('ML_METRICS', '1') != '0'
+
+# Seconds, from sub-millisecond stages to multi-second year-long requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 7, 10, 50, 100, 365, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter per label combination.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    Value per label combination that can go up and down.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label combination.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per labels: [count per bucket (the last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics rendered by /metrics, in registration order.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, labelnames=()):
+        metric = Gauge(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+REQUEST_SECONDS = METRICS.histogram(
+    'ml_request_duration_seconds', 'Time spent handling a request.', ['route', 'method', 'status'])
+REQUEST_ROWS = METRICS.histogram(
+    'ml_request_rows', 'Prediction rows scored per request.', ['route'], ROW_BUCKETS)
+STAGE_SECONDS = METRICS.histogram(
+    'ml_stage_duration_seconds', 'Time spent in one stage of a model pipeline.', ['category', 'stage'])
+MODEL_CALLS = METRICS.counter(
+    'ml_model_invocations_total', 'Calls to a model\'s predict.', ['category'])
+MODEL_ROWS = METRICS.counter(
+    'ml_model_rows_total', 'Rows passed to a model\'s predict.', ['category'])
+ADMITTED_ROWS = METRICS.gauge(
+    'ml_admitted_rows', 'Prediction rows of the requests admitted and not finished yet.')
+QUEUED_REQUESTS = METRICS.gauge(
+    'ml_queued_requests', 'Requests waiting for admission.', ['priority'])
+ADMISSION_WAIT_SECONDS = METRICS.histogram(
+    'ml_admission_wait_seconds', 'Time a request waited for admission.', ['priority'])
+REJECTED_REQUESTS = METRICS.counter(
+    'ml_rejected_requests_total', 'Requests turned away at capacity.', ['status'])
+SCHEDULER_QUEUE_DEPTH = METRICS.gauge(
+    'ml_scheduler_queue_depth', 'Model work waiting for a scheduler slot.', ['priority'])
+SCHEDULER_WAIT_SECONDS = METRICS.histogram(
+    'ml_scheduler_wait_seconds', 'Time model work waited for a scheduler slot.', ['priority'])
+SCHEDULER_SLICES = METRICS.counter(
+    'ml_scheduler_slices_total', 'Slots granted: whole interactive requests or bulk chunks.', ['priority'])
+
+# Rows scored so far by the current request; None outside of requests
+_request_rows = ContextVar('ml_request_rows', default=None)
+
+
+class timed:
+    """
+    Context manager adding the time spent in its block to STAGE_SECONDS.
+    Also usable as a decorator timing every call of a function.
+    """
+    __slots__ = ('category', 'stage', 'start')
+
+    def __init__(self, category, stage):
+        self.category = category
+        self.stage = stage
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(self.category, self.stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            STAGE_SECONDS.observe(time.perf_counter() - self.start, self.category, self.stage)
+
+
+def record_model_call(category, rows):
+    """
+    Count one model call of `rows` rows, also towards the current request.
+    """
+    if not ENABLED:
+        return
+    MODEL_CALLS.inc(1, category)
+    MODEL_ROWS.inc(rows, category)
+    request_rows = _request_rows.get()
+    if request_rows is not None:
+        request_rows[0] += rows
+
+
+def start_request():
+    """
+    Start counting the rows of the request handled in this context.
+    """
+    _request_rows.set([0])
+
+
+def finish_request(route, method, status, seconds):
+    """
+    Record a finished request's latency and the rows it scored.
+    """
+    if not ENABLED:
+        return
+    REQUEST_SECONDS.observe(seconds, route, method, str(status))
+    request_rows = _request_rows.get()
+    if request_rows is not None and request_rows[0]:
+        REQUEST_ROWS.observe(request_rows[0], route)
+    _request_rows.set(None)
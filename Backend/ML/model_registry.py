@@ -0,0 +1,353 @@
+import hashlib
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from coalescer import CoalescedModel
+from compiled_transforms import compile_transforms
+from prediction_cache import CachedModel, PredictionCache
+
+# Artifacts each category's model calls use in the current request, so a
+# request never mixes two versions; None outside of requests
+_pins = ContextVar('ml_model_pins', default=None)
+
+
+def file_signature(paths):
+    """
+    (path, mtime_ns, size) of every file under `paths`, directories walked,
+    missing paths left out. Cheap enough to poll: only stat() calls.
+    """
+    signature = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for name in files:
+            try:
+                stat = os.stat(name)
+            except OSError:
+                continue
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def version_id(signature):
+    """
+    Short id of a set of model files, the same in every worker loading them.
+    """
+    digest = hashlib.sha1()
+    for name, mtime_ns, size in signature:
+        digest.update(f"{os.path.basename(name)}:{mtime_ns}:{size};".encode())
+    return digest.hexdigest()[:12]
+
+
+def _close_model(model):
+    # Stop the batching threads of the wrappers around a retired model
+    while model is not None:
+        if isinstance(model, CoalescedModel):
+            model.close()
+        model = getattr(model, 'model', None)
+
+
+class ModelRegistry:
+    """
+    Keeps track of each model category's artifacts (model, scaler, encoder)
+    and loads them the first time a category is used instead of at import.
+
+    Each model module registers a loader function that returns a dict of its
+    artifacts. The first call to get() for that category runs the loader,
+    later calls return the cached dict. Every load gets a new 'version'
+    number in the dict, which the prediction cache keys on, and a
+    'version_id' derived from the files it was loaded from.
+
+    Modules that also register their file paths can be hot-reloaded: with
+    watch() running, a changed file set is loaded and warmed up in the
+    background and then swapped in. Requests already running keep the
+    version they started with (see begin_request), and the old version is
+    retired once the last of them finishes.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._paths = {}
+        self._warmups = {}
+        self._artifacts = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+        # Loaders run one at a time: unpickling imports sklearn modules, and
+        # concurrent first imports can trip Python's import deadlock detection
+        self._load_lock = threading.Lock()
+        # Guards swaps and the in-flight counts, so a request never pins a
+        # version that is being retired
+        self._pin_lock = threading.Lock()
+        # (category, version) -> requests using it / old versions still in use
+        self._in_flight = {}
+        self._draining = {}
+        self._coalescing = None
+        self._versions = {}
+        self._watcher = None
+        self.cache = None
+
+    def register(self, category, loader, paths=(), warmup=None):
+        """
+        Register the loader for a category. Loading happens lazily on get().
+
+        Args:
+            category (str): Model category name.
+            loader (callable): Returns a dict of the category's artifacts.
+            paths (list): Files and directories the loader reads; watch()
+                reloads the category when they change.
+            warmup (callable): Runs a few dummy predictions on freshly
+                loaded artifacts before they serve requests.
+        """
+        with self._registry_lock:
+            self._loaders[category] = loader
+            self._paths[category] = list(paths)
+            self._warmups[category] = warmup
+            self._locks.setdefault(category, threading.Lock())
+
+    def categories(self):
+        return list(self._loaders)
+
+    def is_loaded(self, category):
+        return category in self._artifacts
+
+    def get(self, category):
+        """
+        Return the artifacts for a category, loading them on first use.
+        Inside a request, every call returns the version its first call got.
+        """
+        pins = _pins.get()
+        if pins is not None:
+            artifacts = pins.get(category)
+            if artifacts is not None:
+                return artifacts
+
+        artifacts = self._artifacts.get(category)
+        if artifacts is None:
+            artifacts = self._load_first(category)
+        if pins is None:
+            return artifacts
+
+        with self._pin_lock:
+            # Re-read under the lock: a swap may have happened since
+            artifacts = self._artifacts[category]
+            key = (category, artifacts['version'])
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        pins[category] = artifacts
+        return artifacts
+
+    def _load_first(self, category):
+        if category not in self._loaders:
+            raise KeyError(f"No model registered for category '{category}'")
+
+        # Only one thread loads a given category, the others wait for it
+        with self._locks[category]:
+            artifacts = self._artifacts.get(category)
+            if artifacts is None:
+                artifacts = self._load(category)
+                self._artifacts[category] = artifacts
+        return artifacts
+
+    def begin_request(self):
+        """
+        Pin the model versions of the request handled in this context.
+        """
+        _pins.set({})
+
+    def end_request(self):
+        """
+        Release the request's versions, retiring old ones nobody uses anymore.
+        """
+        pins = _pins.get()
+        _pins.set(None)
+        if pins:
+            self._release(pins.values())
+
+    def request_versions(self):
+        """
+        {category: version_id} of the models the current request used, or of
+        every loaded model when it used none (yet).
+        """
+        pins = _pins.get() or self._artifacts
+        return {category: artifacts['version_id'] for category, artifacts in sorted(pins.items())}
+
+    @contextmanager
+    def using(self, category, artifacts):
+        """
+        Make get(category) return `artifacts` in this block, e.g. to warm up
+        a version that is not serving yet.
+        """
+        token = _pins.set({category: artifacts})
+        try:
+            yield artifacts
+        finally:
+            pins = _pins.get()
+            _pins.reset(token)
+            self._release(a for c, a in pins.items() if c != category)
+
+    def _release(self, pinned):
+        retired = []
+        with self._pin_lock:
+            for artifacts in pinned:
+                key = (artifacts['category'], artifacts['version'])
+                self._in_flight[key] -= 1
+                if not self._in_flight[key]:
+                    del self._in_flight[key]
+                    if key in self._draining:
+                        retired.append(self._draining.pop(key))
+        for artifacts in retired:
+            _close_model(artifacts['model'])
+
+    def reload(self, category, warmup=True):
+        """
+        Load a category's artifacts again (e.g. after its files changed),
+        warm them up and swap them in, dropping its cached predictions. The
+        old version keeps serving the requests that already use it, and is
+        retired when they finish. If loading or the warmup fails, the old
+        version stays in place and the error is raised.
+        """
+        with self._locks[category]:
+            artifacts = self._load(category)
+            if warmup:
+                try:
+                    self._warm(category, artifacts)
+                except Exception:
+                    _close_model(artifacts['model'])
+                    raise
+            with self._pin_lock:
+                old = self._artifacts.get(category)
+                self._artifacts[category] = artifacts
+                if old is not None:
+                    key = (category, old['version'])
+                    if key in self._in_flight:
+                        self._draining[key] = old
+                        old = None
+            if old is not None:
+                _close_model(old['model'])
+        if self.cache is not None:
+            self.cache.invalidate(category)
+        return artifacts
+
+    def _load(self, category):
+        with self._load_lock:
+            # Stat before loading: a file written during the load then shows up
+            # as a change on the next poll instead of being missed
+            signature = file_signature(self._paths[category])
+            artifacts = self._loaders[category]()
+            self._versions[category] = self._versions.get(category, 0) + 1
+            artifacts['version'] = self._versions[category]
+        artifacts['category'] = category
+        artifacts['signature'] = signature
+        artifacts['version_id'] = version_id(signature) if signature else str(artifacts['version'])
+        artifacts['loaded_at'] = time.time()
+        compile_transforms(artifacts)
+        self._wrap_model(category, artifacts)
+        return artifacts
+
+    def _warm(self, category, artifacts):
+        warmup = self._warmups.get(category)
+        if warmup is not None:
+            with self.using(category, artifacts):
+                warmup(artifacts)
+
+    def status(self):
+        """
+        The loaded version of every category, and the old versions still
+        finishing requests.
+        """
+        with self._pin_lock:
+            return {
+                category: {
+                    'version': artifacts['version'],
+                    'version_id': artifacts['version_id'],
+                    'loaded_at': artifacts['loaded_at'],
+                    'in_flight': self._in_flight.get((category, artifacts['version']), 0),
+                    'draining': [
+                        {'version': version, 'version_id': old['version_id'], 'in_flight': self._in_flight[c, version]}
+                        for (c, version), old in sorted(self._draining.items()) if c == category
+                    ]
+                }
+                for category, artifacts in sorted(self._artifacts.items())
+            }
+
+    def watch(self, interval=5.0):
+        """
+        Poll the registered paths of the loaded categories every `interval`
+        seconds on a background thread and reload a category once its files
+        changed and then stayed the same for one more poll (so a copy in
+        progress is not loaded half-written).
+        """
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval):
+        # category -> signature seen changed on the last poll / that failed to load
+        pending = {}
+        failed = {}
+        while True:
+            time.sleep(interval)
+            for category, artifacts in list(self._artifacts.items()):
+                if not self._paths.get(category):
+                    continue
+                signature = file_signature(self._paths[category])
+                if signature == artifacts['signature'] or signature == failed.get(category):
+                    pending.pop(category, None)
+                    continue
+                if pending.get(category) != signature:
+                    pending[category] = signature
+                    continue
+                del pending[category]
+                try:
+                    new = self.reload(category)
+                    failed.pop(category, None)
+                    print(f"Reloaded {category} model: version {artifacts['version_id']} -> {new['version_id']}")
+                except Exception:
+                    failed[category] = signature
+                    print(f"Reloading the {category} model failed, keeping version {artifacts['version_id']}:")
+                    traceback.print_exc()
+
+    def enable_cache(self, max_entries, ttl_seconds=None):
+        """
+        Put a shared PredictionCache in front of every category's model.
+        """
+        self.cache = PredictionCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        for category, artifacts in self._artifacts.items():
+            self._wrap_model(category, artifacts)
+
+    def enable_coalescing(self, window_ms, max_rows=1024):
+        """
+        Route every category's model.predict through a CoalescedModel so
+        concurrent requests are scored in shared batches.
+        """
+        self._coalescing = {'window_ms': window_ms, 'max_rows': max_rows}
+        for category, artifacts in self._artifacts.items():
+            self._wrap_model(category, artifacts)
+
+    def _wrap_model(self, category, artifacts):
+        # The cache sits in front of the coalescer, so hits never wait in its queue
+        model = artifacts['model']
+        if isinstance(model, CachedModel):
+            model = model.model
+        if self._coalescing and not isinstance(model, CoalescedModel):
+            model = CoalescedModel(model, name=category, **self._coalescing)
+        if self.cache is not None:
+            model = CachedModel(model, self.cache, category, artifacts['version'])
+        artifacts['model'] = model
+
+    def warmup(self, categories=None):
+        """
+        Eagerly load the given categories (all registered ones by default)
+        and run their warmup predictions.
+        """
+        for category in categories or self.categories():
+            self._warm(category, self.get(category))
+
+
+# Shared registry used by all the model modules and the Flask app
+registry = ModelRegistry()
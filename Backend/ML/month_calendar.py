@@ -0,0 +1,194 @@
+"""
+Day-number to month bucketing shared by the monthly summaries.
+
+Predictions are numbered by day, with day 1 being January 1st of the first
+year. Instead of scanning twelve day ranges for every prediction, the day
+numbers are mapped to months through a precomputed lookup array, and the
+monthly sums, counts and histograms are accumulated with np.add.at into a
+MonthlyTotals that can be fed one chunk of predictions at a time.
+
+Without a start year every year is 365 days long. With one, each year's
+real length is used, so leap years get their February 29th.
+"""
+import calendar
+from functools import lru_cache
+
+import numpy as np
+
+MONTH_NAMES = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+NON_LEAP_MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+# First row of an (output, code) pair that has not been seen yet
+NEVER = np.iinfo(np.int64).max
+
+
+def month_days(year):
+    """
+    Length of each month of a year; a year of None is a 365-day year.
+    """
+    if year is None:
+        return NON_LEAP_MONTH_DAYS
+    return [calendar.monthrange(year, month)[1] for month in range(1, 13)]
+
+
+@lru_cache(maxsize=64)
+def day_to_month(years, start_year=None):
+    """
+    Array mapping day number - 1 to a month index (12 * year offset + month)
+    for `years` consecutive years.
+    """
+    lengths = []
+    for offset in range(years):
+        lengths.extend(month_days(None if start_year is None else start_year + offset))
+    table = np.repeat(np.arange(12 * years, dtype=np.int64), lengths)
+    table.setflags(write=False)
+    return table
+
+
+def year_count(max_day, start_year=None):
+    """
+    Number of years needed to cover day numbers up to max_day.
+    """
+    years, covered = 0, 0
+    while covered < max_day or years == 0:
+        covered += 366 if start_year is not None and calendar.isleap(start_year + years) else 365
+        years += 1
+    return years
+
+
+def month_index(day_numbers, start_year=None):
+    """
+    Map day numbers to month indexes.
+
+    Args:
+        day_numbers (array-like): 1-based day numbers.
+        start_year (int, optional): Calendar year of day 1, for leap years.
+    Returns:
+        tuple: (month index per day with -1 for day numbers below 1, number of months covered)
+    """
+    days = np.asarray(day_numbers, dtype=np.int64)
+    max_day = int(days.max()) if len(days) else 0
+    years = year_count(max_day, start_year)
+    table = day_to_month(years, start_year)
+
+    months = np.full(len(days), -1, dtype=np.int64)
+    valid = days >= 1
+    months[valid] = table[days[valid] - 1]
+    return months, 12 * years
+
+
+def month_labels(n_months, start_year=None):
+    """
+    Header fields for every month bucket. "Year" is only added when the
+    buckets span more than one year, so one-year summaries keep their shape.
+    """
+    labels = []
+    for index in range(n_months):
+        label = {"Month": MONTH_NAMES[index % 12]}
+        if n_months > 12:
+            year_offset = index // 12
+            label["Year"] = start_year + year_offset if start_year is not None else year_offset + 1
+        labels.append(label)
+    return labels
+
+
+class MonthlyTotals:
+    """
+    Running per-month statistics of a stream of predictions.
+
+    Predictions are added in chunks of any size. Per month bucket it keeps
+    the row count, the sum of every output, a histogram of every output's
+    risk codes, the first row each (output, code) pair appeared in and the
+    distinct names seen, so memory grows with the months covered rather
+    than the rows. Sums are added row by row in input order, so the result
+    does not depend on how the rows were chunked.
+
+    Args:
+        n_outputs (int): Values (and risk codes) per prediction row.
+        n_codes (int): Number of distinct risk codes.
+        start_year (int, optional): Calendar year of day 1, for leap years.
+    """
+
+    def __init__(self, n_outputs, n_codes, start_year=None):
+        self.n_outputs = n_outputs
+        self.n_codes = n_codes
+        self.start_year = start_year
+        self.rows = 0
+        self.n_months = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, n_outputs))
+        self.histograms = np.zeros((0, n_outputs, n_codes), dtype=np.int64)
+        self.first_rows = np.zeros((0, n_outputs, n_codes), dtype=np.int64)
+        self.names = []
+        self._grow(12 * year_count(0, start_year))
+
+    def _grow(self, n_months):
+        if n_months <= self.n_months:
+            return
+        extra = n_months - self.n_months
+        self.counts = np.concatenate((self.counts, np.zeros(extra, dtype=np.int64)))
+        self.sums = np.concatenate((self.sums, np.zeros((extra, self.n_outputs))))
+        self.histograms = np.concatenate((self.histograms, np.zeros((extra, self.n_outputs, self.n_codes), dtype=np.int64)))
+        self.first_rows = np.concatenate((self.first_rows, np.full((extra, self.n_outputs, self.n_codes), NEVER, dtype=np.int64)))
+        self.names.extend(dict() for _ in range(extra))
+        self.n_months = n_months
+
+    def add(self, day_numbers, values, codes, names=None):
+        """
+        Add a chunk of predictions.
+
+        Args:
+            day_numbers (array-like): 1-based day number of every row; rows before day 1 are ignored.
+            values (array-like): (rows, n_outputs) predicted values, or (rows,) for one output.
+            codes (array-like): Risk codes, in the shape of values.
+            names (list, optional): A name per row, collected per month in order of first appearance.
+        """
+        months, n_months = month_index(day_numbers, self.start_year)
+        self._grow(n_months)
+
+        n_rows = len(months)
+        valid = months >= 0
+        rows = self.rows + np.nonzero(valid)[0]
+        months = months[valid]
+        values = np.asarray(values, dtype=np.float64).reshape(n_rows, self.n_outputs)[valid]
+        codes = np.asarray(codes, dtype=np.int64).reshape(n_rows, self.n_outputs)[valid]
+
+        np.add.at(self.counts, months, 1)
+        np.add.at(self.sums, months, values)
+
+        # One (month, output, code) cell per value
+        cells = (np.repeat(months, self.n_outputs), np.tile(np.arange(self.n_outputs), len(months)), codes.ravel())
+        np.add.at(self.histograms, cells, 1)
+        np.minimum.at(self.first_rows, cells, np.repeat(rows, self.n_outputs))
+
+        if names is not None:
+            for month, name in zip(months.tolist(), (names[i] for i in np.nonzero(valid)[0].tolist())):
+                self.names[month].setdefault(name, None)
+
+        self.rows += n_rows
+
+    def restore(self, month, count, sums, histogram, first_rows, names):
+        """
+        Set one month bucket to previously saved statistics, e.g. from an
+        AggregateStore, growing the buckets to cover it.
+        """
+        self._grow(12 * (month // 12 + 1))
+        self.counts[month] = count
+        self.sums[month] = sums
+        self.histograms[month] = np.asarray(histogram).reshape(self.n_outputs, self.n_codes)
+        self.first_rows[month] = np.asarray(first_rows).reshape(self.n_outputs, self.n_codes)
+        self.names[month] = dict.fromkeys(names)
+
+    def means(self):
+        """
+        Average of every output per month; months without rows average to 0.
+        """
+        return self.sums / np.maximum(self.counts, 1)[:, None]
+
+    def month_names(self, month):
+        return list(self.names[month])
+
+    def labels(self):
+        return month_labels(self.n_months, self.start_year)
@@ -0,0 +1,159 @@
+"""
+The four model pipelines behind one interface.
+
+Every category scores a list of days with PREDICTORS[category] and
+summarizes the predictions with the monthly_totals, add_monthly_totals and
+format_monthly_summary functions of its module in SUMMARIES[category].
+Used by the streaming routes and by /ml/batch, which runs several
+pipelines at once on a thread pool (tree prediction releases the GIL).
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Electricity import electricity
+from Explosives import explosive
+from Fuel import fuel
+from month_calendar import month_labels
+from profiler import run_profiled
+from scheduler import scheduler
+from Transport import transport
+
+# Scores one chunk of days numbered from first_day, with the request's options
+PREDICTORS = {
+    'fuel': lambda days, first_day, options: fuel.predict_emissions_and_risk(days, first_day=first_day),
+    'explosive': lambda days, first_day, options: explosive.predict_7_days_multiple_explosives(days, first_day=first_day),
+    'transport': lambda days, first_day, options: transport.predict_emissions_and_risk(days, first_day=first_day),
+    'electricity': lambda days, first_day, options: electricity.predict_emissions_and_risk(days, options['state_name'], first_entry=first_day)
+}
+
+# Modules providing daily_results, monthly_totals, add_monthly_totals and format_monthly_summary
+SUMMARIES = {
+    'fuel': fuel,
+    'explosive': explosive,
+    'transport': transport,
+    'electricity': electricity
+}
+
+# The output of each model that counts towards a site's combined CO2 total
+CO2_OUTPUTS = {
+    'fuel': 'CO2 (kg)',
+    'explosive': 'CO2',
+    'transport': 'Predicted Emission',
+    'electricity': 'predicted_co2'
+}
+
+# Extra request fields each category needs besides days_data
+REQUIRED_OPTIONS = {
+    'electricity': ['state_name']
+}
+
+executor = ThreadPoolExecutor(max_workers=len(PREDICTORS), thread_name_prefix='ml-pipeline')
+
+
+def validate_options(category, options):
+    """
+    Raise ValueError naming any field the category's request is missing.
+    """
+    missing = [field for field in ['days_data'] + REQUIRED_OPTIONS.get(category, []) if field not in options]
+    if missing:
+        raise ValueError(f"Missing required field(s) for {category}: {', '.join(missing)}.")
+
+
+def predict_days(category, days, options, first_day=1):
+    """
+    Score a list of a category's days numbered from first_day, through the
+    request scheduler when it is on (bulk requests chunk by chunk).
+    """
+    def predict(chunk, chunk_first_day):
+        return PREDICTORS[category](chunk, chunk_first_day, options)
+    if scheduler is None:
+        return predict(days, first_day)
+    return join_predictions(category, scheduler.run_days(predict, days, first_day))
+
+
+def join_predictions(category, parts):
+    """
+    Join the predictions of consecutive chunks of days into those of all of
+    them, in the shape of the category's predictor.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    if category == 'fuel':
+        return {**parts[0], 'predictions': [row for part in parts for row in part['predictions']]}
+    if category == 'explosive':
+        # Keyed by "Day N", in day order
+        return {day: results for part in parts for day, results in part.items()}
+    return [entry for part in parts for entry in part]
+
+
+def run_scheduled(function, *args):
+    """
+    Call a model function in one scheduler slot, or directly when
+    scheduling is off.
+    """
+    if scheduler is None:
+        return function(*args)
+    with scheduler.slot():
+        return function(*args)
+
+
+def run_pipeline(category, options, start_year=None):
+    """
+    Score all of a category's days and return their MonthlyTotals.
+    """
+    predictions = predict_days(category, options['days_data'], options)
+    module = SUMMARIES[category]
+    totals = module.monthly_totals(start_year)
+    module.add_monthly_totals(totals, predictions)
+    return totals
+
+
+def run_pipelines(requests, start_year=None):
+    """
+    Run several categories' pipelines concurrently.
+
+    Args:
+        requests (dict): Category -> that category's request body.
+        start_year (int, optional): Calendar year of day 1 for every category.
+    Returns:
+        dict: Category -> MonthlyTotals. The first failing category's exception is re-raised.
+    """
+    # Each pipeline runs in a copy of the caller's context, so the rows it
+    # scores still count towards the request's metrics and its thread is
+    # sampled with the request's profile
+    futures = {
+        category: executor.submit(contextvars.copy_context().run, run_profiled, run_pipeline, category, options, start_year)
+        for category, options in requests.items()
+    }
+    return {category: future.result() for category, future in futures.items()}
+
+
+def combined_total(totals_by_category, start_year=None):
+    """
+    Total predicted CO2 per month and overall, per category and summed over
+    all categories, from the CO2_OUTPUTS column of every category's totals.
+    """
+    categories = list(totals_by_category)
+    n_months = max([totals.n_months for totals in totals_by_category.values()] + [12])
+
+    monthly = np.zeros((n_months, len(categories)))
+    for i, category in enumerate(categories):
+        totals = totals_by_category[category]
+        column = SUMMARIES[category].RISK_TABLE.outputs.index(CO2_OUTPUTS[category])
+        monthly[:totals.n_months, i] = totals.sums[:, column]
+
+    months = []
+    for month, label in enumerate(month_labels(n_months, start_year)):
+        months.append({
+            **label,
+            "CO2": dict(zip(categories, monthly[month].tolist())),
+            "Total CO2": float(monthly[month].sum())
+        })
+
+    return {
+        "CO2": dict(zip(categories, monthly.sum(axis=0).tolist())),
+        "Total CO2": float(monthly.sum()),
+        "Monthly": months
+    }
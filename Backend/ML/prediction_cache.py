@@ -0,0 +1,125 @@
+"""
+Bounded LRU/TTL cache of model predictions.
+
+Sites submit the same fuel volumes, explosive charges and transport legs day
+after day, so many prediction rows repeat. CachedModel sits in front of a
+model's predict() and only sends the rows it has not seen to the model.
+Entries are keyed on (category, model version, encoded feature row), where
+the row is exactly what the model receives (encoded, unit-normalized and
+scaled), so a hit returns the same prediction the model would.
+
+Enabled from app.py with ML_PREDICTION_CACHE_SIZE (and optionally
+ML_PREDICTION_CACHE_TTL in seconds); off by default.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live per entry.
+    """
+
+    def __init__(self, max_entries=100000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_many(self, keys):
+        """
+        Return the cached value for every key, or None where there is none.
+        """
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] < now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values.append(entry[1])
+        return values
+
+    def put_many(self, keys, values):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, category=None):
+        """
+        Drop every entry for a category, or the whole cache.
+        """
+        with self._lock:
+            if category is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == category]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class CachedModel:
+    """
+    Wraps a model so predict() only scores rows missing from the cache.
+    """
+
+    def __init__(self, model, cache, category, version):
+        self.model = model
+        self.cache = cache
+        self.category = category
+        self.version = version
+        self.n_features_in_ = getattr(model, 'n_features_in_', None)
+
+    def predict(self, X):
+        rows = np.asarray(X, dtype=np.float64)
+        keys = [(self.category, self.version, row) for row in map(tuple, rows.tolist())]
+        predictions = self.cache.get_many(keys)
+
+        # Score each distinct missing row once, even if it repeats in the batch
+        missing = {}
+        for i, (key, prediction) in enumerate(zip(keys, predictions)):
+            if prediction is None:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            first_rows = [positions[0] for positions in missing.values()]
+            X_missing = X.iloc[first_rows] if isinstance(X, pd.DataFrame) else rows[first_rows]
+            scored = np.array(self.model.predict(X_missing))
+            self.cache.put_many(list(missing), [np.copy(prediction) for prediction in scored])
+            for positions, prediction in zip(missing.values(), scored):
+                for i in positions:
+                    predictions[i] = prediction
+
+        return np.array(predictions)
@@ -0,0 +1,140 @@
+"""
+Sampling profiler for slow requests.
+
+While enabled, one background thread samples the stack of every thread that
+is working for a request, every `interval_ms`. When a request takes longer
+than `slow_ms`, its samples are written to `directory` as collapsed stacks,
+one "outer;...;inner count" line per distinct stack. flamegraph.pl,
+speedscope and inferno read that format directly. Faster requests drop
+their samples.
+
+A request's samples follow its context rather than its thread: the thread
+that starts it is sampled until it finishes, and other threads are sampled
+while they run its work through run_profiled() (the /ml/batch pipelines,
+the ASGI server's pool threads). Model calls batched by the coalescer run
+for several requests at once and are not attributed to any of them.
+
+Enabled from app.py by setting ML_PROFILE_SLOW_MS. ML_PROFILE_INTERVAL_MS
+(default 5) sets the sampling interval and ML_PROFILE_DIR (default
+profiles) the output directory.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+# Samples of the request handled in this context; None when it is not profiled
+_request_samples = ContextVar('ml_profile_samples', default=None)
+# Thread id -> samples of the request that thread is working for
+_threads = {}
+_lock = threading.Lock()
+_active = threading.Event()
+
+
+def collapse(frame):
+    """
+    One collapsed-stack line for a frame and its callers, outermost first.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _attach(samples):
+    with _lock:
+        _threads[threading.get_ident()] = samples
+        _active.set()
+
+
+def _detach(samples, thread_id=None):
+    # Stops sampling one thread, or every thread, for these samples
+    with _lock:
+        for other_id in [other_id for other_id, other in _threads.items() if other is samples]:
+            if thread_id is None or other_id == thread_id:
+                del _threads[other_id]
+        if not _threads:
+            _active.clear()
+
+
+def run_profiled(function, *args):
+    """
+    Call function(*args), sampling the calling thread for the request of the
+    current context while it runs, if that request is profiled. The thread
+    is no longer sampled afterwards, also when the call started the profile.
+    """
+    samples = _request_samples.get()
+    if samples is not None:
+        _attach(samples)
+    try:
+        return function(*args)
+    finally:
+        samples = _request_samples.get() or samples
+        if samples is not None:
+            _detach(samples, threading.get_ident())
+
+
+class SlowRequestProfiler:
+    """
+    Samples the threads working for the requests between start() and
+    finish() and writes the stacks of the ones slower than slow_ms.
+    """
+
+    def __init__(self, slow_ms, interval_ms=5, directory='profiles'):
+        self.slow_seconds = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.profiles_written = 0
+        self._thread = threading.Thread(target=self._run, name='ml-profiler', daemon=True)
+        self._thread.start()
+
+    def start(self):
+        """
+        Start profiling the request of the current context, sampling the
+        calling thread.
+        """
+        samples = Counter()
+        _request_samples.set(samples)
+        _attach(samples)
+
+    def finish(self, name, seconds):
+        """
+        Stop profiling the request of the current context, on whichever
+        thread, and write its stacks if it was slow.
+
+        Returns:
+            str: The path of the written profile, or None.
+        """
+        samples = _request_samples.get()
+        if samples is None:
+            return None
+        _request_samples.set(None)
+        _detach(samples)
+        if not samples or seconds < self.slow_seconds:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_') or 'request'
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{seconds * 1000:.0f}ms.folded")
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.profiles_written += 1
+        return path
+
+    def _run(self):
+        while True:
+            _active.wait()
+            frames = sys._current_frames()
+            with _lock:
+                for thread_id, samples in _threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
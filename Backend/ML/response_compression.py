@@ -0,0 +1,73 @@
+"""
+gzip/zstd compression of large responses, negotiated via Accept-Encoding.
+
+A year of monthly summaries or batch results compresses by an order of
+magnitude, so this pays off whenever the client is not on the same
+machine. zstd is offered when the zstandard package (or Python 3.14's
+compression.zstd) is installed; gzip always is. Streamed responses are
+left as they are.
+
+Enabled from app.py by setting ML_COMPRESS_MIN_BYTES, the smallest body
+that is worth compressing. ML_GZIP_LEVEL and ML_ZSTD_LEVEL set the levels.
+"""
+import gzip
+
+try:
+    import zstandard
+
+    def zstd_compress(data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+except ImportError:
+    try:
+        # Python 3.14+; this module is not named compression so it does not
+        # shadow the stdlib package
+        from compression import zstd
+
+        def zstd_compress(data, level):
+            return zstd.compress(data, level=level)
+    except ImportError:
+        zstd_compress = None
+
+
+class ResponseCompressor:
+    """
+    after_request hook compressing responses the client accepts compressed.
+
+    Args:
+        min_bytes (int): Bodies smaller than this are sent as they are.
+        gzip_level (int): gzip compression level, 1 (fastest) to 9.
+        zstd_level (int): zstd compression level.
+    """
+
+    def __init__(self, min_bytes=1024, gzip_level=5, zstd_level=3):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        # Preferred first when the client accepts several equally
+        self.encodings = (['zstd'] if zstd_compress is not None else []) + ['gzip']
+
+    def compress(self, data, encoding):
+        if encoding == 'zstd':
+            return zstd_compress(data, self.zstd_level)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def __call__(self, response, accept_encodings):
+        """
+        Compress `response` in place with the best encoding in the request's
+        Accept-Encoding (werkzeug's request.accept_encodings) and return it.
+        """
+        if (response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or not 200 <= response.status_code < 300):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,114 @@
+"""
+Risk banding shared by all four models.
+
+Each model defines its risk table once: three ascending thresholds per
+output column, splitting predictions into four levels. A whole prediction
+matrix is classified with one np.digitize per output column into small
+integer codes, and the codes only become labels when a response is built.
+
+The default thresholds live in the model modules. They can be overridden
+without code changes by pointing ML_RISK_THRESHOLDS at a JSON file keyed by
+category and output name, e.g.
+    {"fuel": {"CO2 (kg)": [2500, 9000, 15000]}, "transport": {"Predicted Emission": [400, 2000, 5000]}}
+Outputs that are not mentioned keep their defaults.
+"""
+import json
+import os
+
+import numpy as np
+
+# Every table defined so far, by category
+RISK_TABLES = {}
+
+
+def load_threshold_config(path=None):
+    """
+    Read threshold overrides from `path`, or from the file named by
+    ML_RISK_THRESHOLDS. Returns {} when neither is set.
+    """
+    path = path or os.environ.get('ML_RISK_THRESHOLDS')
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class RiskTable:
+    """
+    Threshold table for one model.
+
+    Args:
+        outputs (list): Output column names, in the model's output order.
+        thresholds (dict): Three ascending thresholds per output name.
+        labels (list): The four level labels, lowest first.
+        right (bool): False when a value equal to a threshold moves up a level
+            (value < threshold stays below it), True when it stays below
+            (only value > threshold moves up).
+    """
+
+    def __init__(self, outputs, thresholds, labels, right=False):
+        self.outputs = list(outputs)
+        self.labels = list(labels)
+        self.right = right
+        self.thresholds = np.array([thresholds[output] for output in self.outputs], dtype=np.float64)
+        if self.thresholds.shape != (len(self.outputs), len(self.labels) - 1):
+            raise ValueError(f"Expected {len(self.labels) - 1} thresholds per output, got {self.thresholds.shape[1:]}")
+        if (np.diff(self.thresholds, axis=1) < 0).any():
+            raise ValueError(f"Risk thresholds must be ascending: {self.as_dict()}")
+        self._label_array = np.array(self.labels, dtype=object)
+
+    def classify(self, predictions):
+        """
+        Risk code of every prediction.
+
+        Args:
+            predictions (array-like): (rows, outputs), or (rows,) for a single-output model.
+        Returns:
+            np.ndarray: int8 codes indexing into labels, in the shape of predictions.
+        """
+        predictions = np.asarray(predictions, dtype=np.float64)
+        columns = predictions.reshape(len(predictions), -1)
+        codes = np.empty(columns.shape, dtype=np.int8)
+        for i in range(columns.shape[1]):
+            codes[:, i] = np.digitize(columns[:, i], self.thresholds[i], right=self.right)
+        if self.right:
+            # NaN fails every `>` comparison so it stays at the lowest level,
+            # but digitize sorts it above every threshold
+            codes[np.isnan(columns)] = 0
+        return codes.reshape(predictions.shape)
+
+    def classify_one(self, value, output=None):
+        """
+        Risk code of a single value, for `output` or the only output.
+        """
+        i = self.outputs.index(output) if output is not None else 0
+        if self.right and np.isnan(value):
+            return 0
+        return int(np.digitize(value, self.thresholds[i], right=self.right))
+
+    def label(self, codes):
+        """
+        Turn codes from classify() into labels: a list (of lists) for an
+        array, a single label for a scalar.
+        """
+        labels = self._label_array[np.asarray(codes, dtype=np.intp)]
+        return labels.tolist() if isinstance(labels, np.ndarray) else labels
+
+    def as_dict(self):
+        return dict(zip(self.outputs, self.thresholds.tolist()))
+
+
+def risk_table(category, outputs, thresholds, labels, right=False, config=None):
+    """
+    Define the risk table for a category, applying any overrides from the
+    threshold config, and keep it in RISK_TABLES.
+    """
+    config = load_threshold_config() if config is None else config
+    overrides = config.get(category, {})
+    unknown = set(overrides) - set(outputs)
+    if unknown:
+        raise ValueError(f"Unknown {category} risk outputs in threshold config: {sorted(unknown)}")
+
+    table = RiskTable(outputs, {**thresholds, **overrides}, labels, right=right)
+    RISK_TABLES[category] = table
+    return table
@@ -0,0 +1,158 @@
+"""
+Priority scheduling of the model work of concurrent requests.
+
+The dashboard's 7-day queries and year-long backfills hit the same routes
+and compete for the same CPU. The scheduler gives the model calls a fixed
+number of slots and two priority classes:
+
+    interactive  small requests; they take the next free slot first
+    bulk         large requests; scored chunk_days days per slot, so they
+                 give their slot up between chunks and queued interactive
+                 work runs before their next chunk
+
+A request's class comes from its X-Priority header ('interactive' or
+'bulk'), otherwise from its size: more than ML_BULK_ROWS prediction rows
+is bulk, as are NDJSON uploads. app.py sets it per request with
+set_priority(); the routes score days with pipelines.predict_days, which
+runs them through the scheduler. The ASGI server's admission control
+(admission.py) uses the same classes.
+Queue depth, wait time and slices are reported per class at /metrics.
+
+Enabled with ML_SCHEDULER_SLOTS (the model calls that may run at once,
+e.g. the CPU count); ML_BULK_ROWS (default 1000) and ML_BULK_CHUNK_DAYS
+(default 30) tune the classes. Scheduling is off by default: every request
+then runs in one piece, as before.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import ENABLED, SCHEDULER_QUEUE_DEPTH, SCHEDULER_SLICES, SCHEDULER_WAIT_SECONDS
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+# Lower runs first
+PRIORITIES = {INTERACTIVE: 0, BULK: 1}
+
+# Requests with more prediction rows than this are bulk
+BULK_ROWS = int(os.environ.get('ML_BULK_ROWS', 1000))
+
+# Class of the request handled in this context
+_priority = ContextVar('ml_priority', default=INTERACTIVE)
+
+
+def classify(rows, header=None, bulk_rows=BULK_ROWS):
+    """
+    Priority class of a request from its X-Priority header, or else from the
+    prediction rows it carries.
+    """
+    if header:
+        header = header.strip().lower()
+        if header not in PRIORITIES:
+            raise ValueError(f"X-Priority must be one of {list(PRIORITIES)}, got {header!r}.")
+        return header
+    return BULK if rows > bulk_rows else INTERACTIVE
+
+
+def set_priority(priority):
+    _priority.set(priority)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class PriorityScheduler:
+    """
+    A fixed number of slots for model work, handed to the waiting callers
+    by priority class, first come first served within a class.
+
+    Args:
+        slots (int): Model calls that may run at once.
+        chunk_days (int): Days a bulk request scores per slot.
+    """
+
+    def __init__(self, slots, chunk_days=30):
+        self.free = slots
+        self.chunk_days = chunk_days
+        self._condition = threading.Condition()
+        # (priority rank, arrival, priority) of the waiting callers
+        self._waiting = []
+        self._arrivals = itertools.count()
+
+    def acquire(self, priority):
+        start = time.perf_counter()
+        with self._condition:
+            ticket = (PRIORITIES[priority], next(self._arrivals), priority)
+            heapq.heappush(self._waiting, ticket)
+            self._update_depth(priority)
+            try:
+                while not (self.free and self._waiting[0] is ticket):
+                    self._condition.wait()
+            except BaseException:
+                # Interrupted while waiting: a ticket left in the heap would
+                # block every caller queued behind it
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._update_depth(priority)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self.free -= 1
+            self._update_depth(priority)
+            # The next waiter may fit in another free slot
+            self._condition.notify_all()
+        if ENABLED:
+            SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - start, priority)
+            SCHEDULER_SLICES.inc(1, priority)
+
+    def release(self):
+        with self._condition:
+            self.free += 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority=None):
+        """
+        Hold one slot for the block, waiting for it by the current
+        request's class unless `priority` is given.
+        """
+        self.acquire(priority or current_priority())
+        try:
+            yield
+        finally:
+            self.release()
+
+    def run_days(self, predict, days, first_day=1, priority=None):
+        """
+        Score a list of days with predict(chunk, first_day), in one slot for
+        interactive requests and chunk_days days per slot for bulk ones.
+        Returns the list of every chunk's predictions.
+        """
+        priority = priority or current_priority()
+        if priority != BULK:
+            with self.slot(priority):
+                return [predict(days, first_day)]
+
+        parts = []
+        for start in range(0, max(len(days), 1), self.chunk_days):
+            with self.slot(priority):
+                parts.append(predict(days[start:start + self.chunk_days], first_day + start))
+        return parts
+
+    def _update_depth(self, priority):
+        if ENABLED:
+            SCHEDULER_QUEUE_DEPTH.set(sum(waiting[2] == priority for waiting in self._waiting), priority)
+
+
+# Shared scheduler, or None when scheduling is off
+scheduler = None
+if int(os.environ.get('ML_SCHEDULER_SLOTS', 0)) > 0:
+    scheduler = PriorityScheduler(
+        slots=int(os.environ['ML_SCHEDULER_SLOTS']),
+        chunk_days=int(os.environ.get('ML_BULK_CHUNK_DAYS', 30))
+    )
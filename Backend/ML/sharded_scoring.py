@@ -0,0 +1,133 @@
+"""
+Score large jobs across a pool of worker processes.
+
+One forest predict runs on one core. ShardedScorer keeps a
+ProcessPoolExecutor whose workers load the models once, in their
+initializer. A job is scored in three steps:
+
+1. The parent encodes and scales the rows into the model's float feature
+   matrix with the module's model_inputs. This step is cheap.
+2. The matrix is copied once into a shared-memory block.
+3. Each worker predicts a slice of that block and writes its predictions
+   into the matching rows of a shared output block.
+
+Shards are only ever passed as (block name, row range). No rows are
+pickled, and the predictions come back in input order without a merge
+step.
+
+    with ShardedScorer(workers=4) as scorer:
+        co2 = scorer.score('electricity', frame)
+"""
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from model_registry import registry
+from pipelines import SUMMARIES
+
+DEFAULT_SHARD_ROWS = 65536
+
+
+def _init_worker(categories):
+    registry.warmup(categories)
+
+
+def _predict_shard(category, input_name, input_shape, output_name, n_outputs, start, end):
+    # Workers share the parent's resource tracker, so attaching here does not
+    # leave a second owner behind; the parent unlinks both blocks
+    input_block = shared_memory.SharedMemory(name=input_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    X = predictions = None
+    try:
+        X = np.ndarray(input_shape, dtype=np.float64, buffer=input_block.buf)
+        predictions = np.ndarray((input_shape[0], n_outputs), dtype=np.float64, buffer=output_block.buf)
+        with warnings.catch_warnings():
+            # Models fitted on DataFrames warn about the missing feature names
+            warnings.simplefilter('ignore', UserWarning)
+            shard = registry.get(category)['model'].predict(X[start:end])
+        predictions[start:end] = np.asarray(shard).reshape(end - start, n_outputs)
+    finally:
+        # The blocks can only be closed once no array points into them
+        X = predictions = None
+        input_block.close()
+        output_block.close()
+    return end - start
+
+
+class ShardedScorer:
+    """
+    Process pool that scores feature matrices in shared-memory shards.
+
+    Args:
+        workers (int, optional): Worker processes; defaults to the CPU count.
+        categories (list, optional): Models each worker loads at start (all by default).
+        shard_rows (int): Largest number of rows per task.
+        start_method (str): multiprocessing start method. 'spawn' keeps the
+            workers clear of the parent's threads and locks.
+    """
+
+    def __init__(self, workers=None, categories=None, shard_rows=DEFAULT_SHARD_ROWS, start_method='spawn'):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.shard_rows = shard_rows
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(list(categories or SUMMARIES),)
+        )
+
+    def predict(self, category, X):
+        """
+        Predict a category's model on a feature matrix, as model.predict would.
+
+        Returns:
+            np.ndarray: (rows,) for single-output models, otherwise (rows, outputs).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n_rows = X.shape[0]
+        n_outputs = len(SUMMARIES[category].RISK_TABLE.outputs)
+        if n_rows == 0:
+            return np.empty((0, n_outputs) if n_outputs > 1 else 0)
+
+        input_block = shared_memory.SharedMemory(create=True, size=X.nbytes)
+        output_block = shared_memory.SharedMemory(create=True, size=n_rows * n_outputs * 8)
+        try:
+            np.ndarray(X.shape, dtype=np.float64, buffer=input_block.buf)[:] = X
+
+            # Enough shards to keep every worker busy, none above shard_rows
+            shard_rows = min(self.shard_rows, -(-n_rows // self.workers))
+            futures = [
+                self.executor.submit(_predict_shard, category, input_block.name, X.shape, output_block.name,
+                                     n_outputs, start, min(start + shard_rows, n_rows))
+                for start in range(0, n_rows, shard_rows)
+            ]
+            for future in futures:
+                future.result()
+
+            predictions = np.ndarray((n_rows, n_outputs), dtype=np.float64, buffer=output_block.buf).copy()
+        finally:
+            input_block.close()
+            input_block.unlink()
+            output_block.close()
+            output_block.unlink()
+
+        return predictions.ravel() if n_outputs == 1 else predictions
+
+    def score(self, category, *columns):
+        """
+        Sharded equivalent of the module's predict_outputs(*columns): the
+        inputs are encoded here, the model runs in the workers.
+        """
+        return self.predict(category, np.asarray(SUMMARIES[category].model_inputs(*columns), dtype=np.float64))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,92 @@
+"""
+Streaming predictions for year-scale inputs.
+
+The /ml/<category>/stream routes read the days one at a time, score them in
+chunks of `chunk_days` and write every day's results back as one NDJSON
+line as soon as its chunk is scored. The monthly summary is accumulated
+chunk by chunk in a MonthlyTotals and written as the last line, so memory is
+bounded by the chunk size instead of the length of the upload.
+
+Request bodies are either NDJSON, one day's `days_data` entry per line, or
+the regular JSON body of the non-streaming route. Response lines are
+    {"day": 1, "results": [...]}
+    ...
+    {"status": "success", "monthly_summary": [...]}
+or, when a chunk fails after the response has started,
+    {"status": "error", "message": "..."}
+"""
+import json
+from itertools import islice
+
+from pipelines import PREDICTORS, SUMMARIES, run_scheduled
+
+DEFAULT_CHUNK_DAYS = 256
+
+
+def read_ndjson(stream):
+    """
+    Yield the JSON value of every non-empty line of a binary stream.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {line_number} of the NDJSON body is not valid JSON.")
+
+
+def chunks(iterable, size):
+    """
+    Yield lists of up to `size` items from any iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_predictions(category, days, options, start_year=None, chunk_days=DEFAULT_CHUNK_DAYS, dumps=json.dumps):
+    """
+    Score `days` chunk by chunk and yield the NDJSON response.
+
+    Args:
+        category (str): One of PREDICTORS.
+        days (iterable): Every day's input, in order; consumed lazily.
+        options (dict): Extra request fields, e.g. 'state_name' for electricity.
+        start_year (int, optional): Calendar year of day 1, for the monthly summary.
+        chunk_days (int): Days scored per model call.
+        dumps (callable): JSON serializer for each line.
+    Yields:
+        str: One or more complete NDJSON lines per chunk, then the summary line.
+    """
+    module = SUMMARIES[category]
+    totals = module.monthly_totals(start_year)
+    first_day = 1
+
+    try:
+        for chunk in chunks(days, chunk_days):
+            # One scheduler slot per chunk, so other requests can run in between
+            predictions = run_scheduled(PREDICTORS[category], chunk, first_day, options)
+            results = dict(module.daily_results(predictions))
+            yield ''.join(
+                dumps({'day': day, 'results': results.get(day, [])}) + '\n'
+                for day in range(first_day, first_day + len(chunk))
+            )
+            module.add_monthly_totals(totals, predictions)
+            first_day += len(chunk)
+    except ValueError as e:
+        yield dumps({'status': 'error', 'message': str(e)}) + '\n'
+        return
+    except Exception as e:
+        yield dumps({'status': 'error', 'message': f"An unexpected error occurred: {str(e)}"}) + '\n'
+        return
+
+    summary = {'status': 'success'}
+    if category == 'electricity':
+        summary['state'] = options['state_name']
+    summary['monthly_summary'] = module.format_monthly_summary(totals)
+    yield dumps(summary) + '\n'